@@ -0,0 +1,378 @@
+"""
+Theta Terminal simulato per test di throughput in locale (nessuna licenza né rete necessarie).
+
+Implementa gli endpoint /v2/list/*, /v2/hist/* e /v2/bulk_hist/* usati dai fetcher, con catene di
+opzioni sintetiche deterministiche: gli stessi parametri producono sempre le stesse righe, giorno
+per giorno, indipendentemente da come vengono suddivise le richieste. Latenza, errori transitori
+e rate limit (429) possono essere iniettati per misurare il comportamento del client.
+
+Uso standalone:
+    python -m benchmarks.mock_terminal --port 25510 --expirations 8 --strikes 20
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from utils.schema import SCHEMAS
+from utils.trading_calendar import session_bounds, trading_days
+
+EOD_MS_OF_DAY = 62100000            # 17:15, orario del report EOD del terminale
+OPEN_INTEREST_MS_OF_DAY = 23400000  # 06:30, orario di pubblicazione dell'open interest
+
+# Formato (header.format) delle risposte per tipo di dato, come lo restituisce il terminale
+FORMATS = {
+    "eod": list(SCHEMAS["eod"]),
+    "ohlc": list(SCHEMAS["ohlc"]),
+    "quote": list(SCHEMAS["quote"]),
+    "price": list(SCHEMAS["price"]),
+    "greeks": [c for c in SCHEMAS["greeks"] if c not in ("underlying_ms_of_day", "open_interest")],
+    "open_interest": list(SCHEMAS["open_interest"]),
+}
+
+# Endpoint storici -> tipo di dato restituito
+HIST_KINDS = {
+    "/v2/hist/option/eod": "eod",
+    "/v2/hist/option/quote": "quote",
+    "/v2/hist/option/ohlc": "ohlc",
+    "/v2/hist/option/open_interest": "open_interest",
+    "/v2/hist/option/greeks": "greeks",
+    "/v2/hist/stock/eod": "eod",
+    "/v2/hist/stock/ohlc": "ohlc",
+    "/v2/hist/stock/quote": "quote",
+    "/v2/hist/index/eod": "eod",
+    "/v2/hist/index/ohlc": "ohlc",
+    "/v2/hist/index/price": "price",
+}
+BULK_KINDS = {
+    "/v2/bulk_hist/option/eod": "eod",
+    "/v2/bulk_hist/option/quote": "quote",
+    "/v2/bulk_hist/option/ohlc": "ohlc",
+    "/v2/bulk_hist/option/open_interest": "open_interest",
+    "/v2/bulk_hist/option/greeks": "greeks",
+}
+
+TRANSIENT_ERRORS = (500, 503, 474)
+NO_DATA_STATUS = 472
+
+
+class MockChain:
+    """
+    Catena di opzioni sintetica: `expirations` scadenze settimanali (venerdì) a partire da start
+    e `strikes` strike centrati su underlying_price, con storico giornaliero tra start ed end.
+    """
+
+    def __init__(self, root="SPY", start="2024-01-02", end="2024-03-28", expirations=8, strikes=20,
+                 underlying_price=470.0, strike_step=5.0, stock_roots=("SPY", "AAPL"), index_roots=("SPX", "VIX")):
+        self.root = root
+        self.sessions = trading_days(start, end)
+        self.session_ints = pd.DatetimeIndex(self.sessions).strftime("%Y%m%d").astype(np.int64).to_numpy()
+        first_friday = pd.Timestamp(start) + pd.Timedelta(days=(4 - pd.Timestamp(start).weekday()) % 7)
+        span_weeks = max(1, (pd.Timestamp(end) - first_friday).days // 7 + 5)
+        step = max(1, span_weeks // expirations)
+        self.expirations = [int((first_friday + pd.Timedelta(weeks=i * step)).strftime("%Y%m%d")) for i in range(expirations)]
+        center = round(underlying_price / strike_step) * strike_step
+        offsets = np.arange(strikes) - strikes // 2
+        self.strikes = [int(round((center + o * strike_step) * 1000)) for o in offsets]
+        self.underlying_price = underlying_price
+        self.stock_roots = list(stock_roots)
+        self.index_roots = list(index_roots)
+
+    def sessions_between(self, start_date, end_date, last_date=None):
+        """Sessioni (YYYYMMDD int) in [start_date, end_date], troncate a last_date (es. la scadenza)."""
+        end = min(int(end_date), int(last_date)) if last_date else int(end_date)
+        days = self.session_ints
+        return days[(days >= int(start_date)) & (days <= end)]
+
+
+def _seed(*parts):
+    return zlib.crc32("|".join(str(p) for p in parts).encode())
+
+
+def _day_rows(kind, day, interval_ms, seed, base_price):
+    """Colonne (nell'ordine di FORMATS[kind]) di una giornata, generate in modo deterministico."""
+    rng = np.random.default_rng(seed)
+    if kind == "eod":
+        ms = np.array([EOD_MS_OF_DAY], dtype=np.int64)
+    elif kind == "open_interest":
+        ms = np.array([OPEN_INTEREST_MS_OF_DAY], dtype=np.int64)
+    else:
+        open_ms, close_ms = session_bounds(np.array([pd.Timestamp(str(day)).date()], dtype="datetime64[D]"))
+        ms = np.arange(open_ms[0], close_ms[0], interval_ms or 60000, dtype=np.int64)
+    n = len(ms)
+    price = np.round(base_price * np.exp(np.cumsum(rng.normal(0, 0.002, n))), 2)
+    columns = []
+    for name in FORMATS[kind]:
+        if name == "date":
+            columns.append(np.full(n, day, dtype=np.int64))
+        elif name in ("ms_of_day", "ms_of_day2"):
+            columns.append(ms)
+        elif name in ("open", "high", "low", "close", "bid", "ask", "price"):
+            spread = {"high": 0.01, "low": -0.01, "bid": -0.005, "ask": 0.005}.get(name, 0.0)
+            columns.append(np.round(price * (1 + spread), 2))
+        elif name in ("underlying_price",):
+            columns.append(np.round(np.full(n, base_price), 2))
+        elif SCHEMAS.get(kind, {}).get(name, "float32").startswith("float"):
+            columns.append(np.round(rng.random(n), 4))
+        else:
+            columns.append(rng.integers(0, 1000, n))
+    return columns
+
+
+def generate_rows(kind, days, interval_ms, key, base_price):
+    """Righe (liste) per tutte le giornate in days; key identifica lo strumento (root o contratto)."""
+    rows = []
+    for day in days:
+        columns = _day_rows(kind, int(day), interval_ms, _seed(key, kind, interval_ms, day), base_price)
+        rows.extend(zip(*(c.tolist() for c in columns)))
+    return rows
+
+
+class _RateLimiter:
+    """Token bucket non bloccante lato server: quando è vuoto la richiesta riceve 429."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class MockTerminal:
+    """
+    Server HTTP che simula Theta Terminal su 127.0.0.1.
+
+    Args:
+        chain (MockChain): Dati sintetici serviti.
+        port (int): 0 = porta libera scelta dal sistema.
+        latency (float): Secondi di attesa aggiunti a ogni risposta (più jitter uniforme fino a latency_jitter).
+        error_rate (float): Frazione di richieste che ricevono un errore transitorio (500/503/474).
+        rate_limit (float | None): Richieste al secondo oltre le quali il server risponde 429.
+        seed (int): Seme per l'iniezione di errori e jitter.
+    """
+
+    def __init__(self, chain=None, port=0, latency=0.0, latency_jitter=0.0, error_rate=0.0, rate_limit=None, seed=0):
+        self.chain = chain or MockChain()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limiter = _RateLimiter(rate_limit) if rate_limit else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "bytes": 0, "rows": 0, "status": {}, "paths": {}}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def snapshot(self):
+        """Copia dei contatori (richieste, byte, righe, status code, richieste per endpoint)."""
+        with self._lock:
+            return json.loads(json.dumps(self.stats))
+
+    def _record(self, path, status, size, rows):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += size
+            self.stats["rows"] += rows
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+            self.stats["paths"][path] = self.stats["paths"].get(path, 0) + 1
+
+    def _handler(self):
+        terminal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, body, rows, headers = terminal.respond(url.path, params)
+                payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json" if status < 400 else "text/plain")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # il client ha chiuso la connessione (es. processo del benchmark terminato)
+                terminal._record(url.path, status, len(payload), rows)
+
+        return Handler
+
+    def respond(self, path, params):
+        """(status, body, righe, header extra) per una richiesta GET."""
+        if self.latency or self.latency_jitter:
+            with self._lock:
+                jitter = self._random.random() * self.latency_jitter
+            time.sleep(self.latency + jitter)
+        if self.rate_limiter is not None and not self.rate_limiter.allow():
+            return 429, "Too many requests", 0, {"Retry-After": "1"}
+        if self.error_rate:
+            with self._lock:
+                fail = self._random.random() < self.error_rate
+                code = self._random.choice(TRANSIENT_ERRORS)
+            if fail:
+                return code, f"Injected error {code}", 0, {}
+        try:
+            return self._route(path, params)
+        except (KeyError, ValueError) as e:
+            return 400, f"Bad request: {e}", 0, {}
+
+    def _route(self, path, params):
+        chain = self.chain
+        if path.startswith("/v2/list/"):
+            return self._list(path, params)
+        root = params.get("root", "").upper()
+        known = {chain.root, *chain.stock_roots, *chain.index_roots}
+        if root not in known:
+            return NO_DATA_STATUS, "No data for the specified timeframe & contract.", 0, {}
+        if path in BULK_KINDS:
+            return self._bulk(BULK_KINDS[path], params)
+        if path in HIST_KINDS:
+            return self._hist(path, HIST_KINDS[path], params)
+        return 404, f"Unknown endpoint {path}", 0, {}
+
+    def _envelope(self, response, kind=None):
+        header = {"format": FORMATS[kind]} if kind else {"format": None}
+        return {"header": {"latency_ms": 0, "error_type": "null", "error_msg": "null", "next_page": "null", **header},
+                "response": response}
+
+    def _list(self, path, params):
+        chain = self.chain
+        if path == "/v2/list/roots/stock":
+            values = chain.stock_roots
+        elif path == "/v2/list/roots/index":
+            values = chain.index_roots
+        elif path == "/v2/list/roots/option":
+            values = [chain.root]
+        elif path.startswith("/v2/list/dates/"):
+            values = chain.session_ints.tolist()
+        elif path == "/v2/list/expirations":
+            values = chain.expirations if params.get("root", "").upper() == chain.root else []
+        elif path == "/v2/list/strikes":
+            values = chain.strikes if int(params["exp"]) in chain.expirations else []
+        else:
+            return 404, f"Unknown endpoint {path}", 0, {}
+        if not values:
+            return NO_DATA_STATUS, "No data for the specified timeframe & contract.", 0, {}
+        return 200, self._envelope(list(values)), len(values), {}
+
+    def _contract_price(self, strike, right):
+        intrinsic = max(0.0, (self.chain.underlying_price - strike / 1000) * (1 if right == "C" else -1))
+        return intrinsic + 2.0
+
+    def _hist(self, path, kind, params):
+        chain = self.chain
+        interval_ms = int(params.get("ivl", 0)) or None
+        if "/option/" in path:
+            if not {"exp", "strike", "right"} <= set(params):
+                return NO_DATA_STATUS, "No data for the specified timeframe & contract.", 0, {}
+            exp, strike, right = int(params["exp"]), int(params["strike"]), params["right"].upper()[0]
+            if exp not in chain.expirations or strike not in chain.strikes:
+                return NO_DATA_STATUS, "No data for the specified timeframe & contract.", 0, {}
+            days = chain.sessions_between(params["start_date"], params["end_date"], exp)
+            key, base = (chain.root, exp, strike, right), self._contract_price(strike, right)
+        else:
+            days = chain.sessions_between(params["start_date"], params["end_date"])
+            key, base = params["root"].upper(), chain.underlying_price
+        rows = generate_rows(kind, days, interval_ms, key, base)
+        if "start_time" in params or "end_time" in params:
+            # Finestra di orari (ms_of_day inclusi), come i parametri start_time/end_time del terminale
+            position = FORMATS[kind].index("ms_of_day")
+            start_time, end_time = int(params.get("start_time", 0)), int(params.get("end_time", 86400000))
+            rows = [row for row in rows if start_time <= row[position] <= end_time]
+        if not rows:
+            return NO_DATA_STATUS, "No data for the specified timeframe & contract.", 0, {}
+        return 200, self._envelope(rows, kind), len(rows), {}
+
+    def _bulk(self, kind, params):
+        chain = self.chain
+        interval_ms = int(params.get("ivl", 0)) or None
+        exp = int(params.get("exp", 0))
+        expirations = chain.expirations if exp == 0 else [e for e in chain.expirations if e == exp]
+        items, total = [], 0
+        for expiration in expirations:
+            days = chain.sessions_between(params["start_date"], params["end_date"], expiration)
+            for strike in chain.strikes:
+                for right in ("C", "P"):
+                    key = (chain.root, expiration, strike, right)
+                    ticks = generate_rows(kind, days, interval_ms, key, self._contract_price(strike, right))
+                    if ticks:
+                        contract = {"root": chain.root, "expiration": expiration, "strike": strike, "right": right}
+                        items.append({"contract": contract, "ticks": ticks})
+                        total += len(ticks)
+        if not items:
+            return NO_DATA_STATUS, "No data for the specified timeframe & contract.", 0, {}
+        return 200, self._envelope(items, kind), total, {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Theta Terminal simulato per benchmark locali.")
+    parser.add_argument("--port", type=int, default=25510)
+    parser.add_argument("--root", default="SPY")
+    parser.add_argument("--start", default="2024-01-02")
+    parser.add_argument("--end", default="2024-03-28")
+    parser.add_argument("--expirations", type=int, default=8)
+    parser.add_argument("--strikes", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None)
+    args = parser.parse_args()
+
+    chain = MockChain(args.root, args.start, args.end, args.expirations, args.strikes)
+    terminal = MockTerminal(chain, port=args.port, latency=args.latency, latency_jitter=args.latency_jitter,
+                            error_rate=args.error_rate, rate_limit=args.rate_limit)
+    print(f"🧪 Mock Theta Terminal su {terminal.url} (Ctrl+C per uscire)")
+    try:
+        terminal._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        terminal._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
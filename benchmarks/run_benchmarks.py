@@ -0,0 +1,275 @@
+"""
+Benchmark end-to-end dei fetcher contro il Theta Terminal simulato (benchmarks.mock_terminal).
+
+Ogni scenario gira in un processo separato (così il picco di RSS misurato è solo quello del
+client) su una cartella dati temporanea; il server simulato conta richieste e righe servite.
+Per ogni scenario vengono riportati richieste/s, righe/s, picco di RSS e byte scritti su disco.
+
+I risultati vengono aggiunti a uno storico JSONL etichettato con la versione (commit git) e
+confrontati con la versione precedente (o con --baseline): un calo di throughput o un aumento di
+memoria/byte oltre --tolerance viene segnalato come regressione.
+
+Uso:
+    python -m benchmarks.run_benchmarks [--scenarios options_daily_bulk,update_daily] [--fail-on-regression]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from benchmarks.mock_terminal import NO_DATA_STATUS, MockChain, MockTerminal
+
+RESULT_MARKER = "BENCH_RESULT "
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.jsonl")
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metriche confrontate tra versioni: True se "più alto è meglio"
+TRACKED_METRICS = {
+    "requests_per_sec": True,
+    "rows_per_sec": True,
+    "peak_rss_mb": False,
+    "bytes_written": False,
+}
+
+
+def _options_daily(url, workdir, start, end, bulk):
+    from options.fetch_options import FetchOptions
+    from utils.http_client import get_default_client
+    fetcher = FetchOptions("SPY", workdir, base_url=url, client=get_default_client(url))
+    fetcher.fetch_daily_option_data(start, end, max_concurrency=4, bulk=bulk)
+
+
+def _options_intraday(url, workdir, start, end, bulk, pipeline=False):
+    from options.fetch_options import FetchOptions
+    from utils.http_client import get_default_client
+    fetcher = FetchOptions("SPY", workdir, base_url=url, client=get_default_client(url), pipeline=pipeline)
+    fetcher.fetch_intraday_option_data(start, min(end, start + pd.Timedelta(days=6)), 60000, max_concurrency=4, bulk=bulk)
+
+
+def _stock_intraday(url, workdir, start, end):
+    from stock.fetch_stock import FetchStock
+    from utils.http_client import get_default_client
+    from utils.storage import DatasetStore
+    df = FetchStock("SPY", workdir, base_url=url, client=get_default_client(url)).fetch_intraday_stock_data(start, end, 60000)
+    DatasetStore(workdir).append(df, "SPY", "stock", "1minute", kind="ohlc")
+
+
+def _index_daily(url, workdir, start, end):
+    from index.fetch_index import FetchIndex
+    from utils.http_client import get_default_client
+    FetchIndex("SPX", workdir, base_url=url, client=get_default_client(url)).fetch_daily_index_data(start, end)
+
+
+def _update_data(url, workdir, timeframes, symbols=None):
+    from fetcher import ThetaDataFetcher
+
+    # Il terminale simulato è già in ascolto: Java non viene mai cercato
+    fetcher = ThetaDataFetcher(
+        "user", "password", "SPY",
+        options_dir=os.path.join(workdir, "options"), stock_dir=os.path.join(workdir, "stock"),
+        index_dir=os.path.join(workdir, "index"), BASE_URL=url,
+    )
+    if symbols:
+        fetcher.update_symbols(symbols, timeframes, recent_only=False)
+    else:
+        fetcher.update_data(timeframes, recent_only=False)
+
+
+SCENARIOS = {
+    "options_daily_bulk": lambda url, wd, s, e: _options_daily(url, wd, s, e, bulk=True),
+    "options_daily_contracts": lambda url, wd, s, e: _options_daily(url, wd, s, e, bulk=False),
+    "options_intraday_bulk": lambda url, wd, s, e: _options_intraday(url, wd, s, e, bulk=True),
+    "options_intraday_contracts": lambda url, wd, s, e: _options_intraday(url, wd, s, e, bulk=False),
+    "options_intraday_pipeline": lambda url, wd, s, e: _options_intraday(url, wd, s, e, bulk=False, pipeline=True),
+    "stock_intraday": _stock_intraday,
+    "index_daily": _index_daily,
+    "update_daily": lambda url, wd, s, e: _update_data(url, wd, ["daily"]),
+    "update_1minute": lambda url, wd, s, e: _update_data(url, wd, ["1minute"]),
+    "update_symbols_daily": lambda url, wd, s, e: _update_data(url, wd, ["daily"], symbols=["SPY", "AAPL", "SPX", "VIX"]),
+}
+
+
+def peak_rss_bytes():
+    """Picco di memoria residente del processo corrente (None se non misurabile)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    except ImportError:
+        return None
+
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            total += os.path.getsize(os.path.join(dirpath, name))
+    return total
+
+
+def git_version():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_child(args):
+    """Esegue uno scenario nel processo corrente e stampa il risultato su una riga marcata."""
+    from utils.http_client import TokenBucket, get_default_client
+    if args.requests_per_second:
+        get_default_client(args.url).rate_limiter = TokenBucket(args.requests_per_second, max(1, args.requests_per_second / 5))
+    start, end = pd.Timestamp(args.start), pd.Timestamp(args.end)
+    t0 = time.perf_counter()
+    SCENARIOS[args.child](args.url, args.workdir, start, end)
+    elapsed = time.perf_counter() - t0
+    print(RESULT_MARKER + json.dumps({"elapsed": elapsed, "peak_rss": peak_rss_bytes()}), flush=True)
+
+
+def run_scenario(name, terminal, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    before = terminal.snapshot()
+    command = [sys.executable, "-m", "benchmarks.run_benchmarks", "--child", name, "--url", terminal.url,
+               "--workdir", workdir, "--start", args.start, "--end", args.end]
+    if args.requests_per_second:
+        command += ["--requests-per-second", str(args.requests_per_second)]
+    try:
+        proc = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+        after = terminal.snapshot()
+        lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+        if proc.returncode != 0 or not lines:
+            tail = "\n".join((proc.stderr or proc.stdout).splitlines()[-15:])
+            print(f"❌ Scenario {name} fallito:\n{tail}")
+            return None
+        child = json.loads(lines[-1][len(RESULT_MARKER):])
+        bytes_written = directory_size(workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    requests = after["requests"] - before["requests"]
+    rows = after["rows"] - before["rows"]
+    status = {code: count - before["status"].get(code, 0) for code, count in after["status"].items()}
+    no_data = status.get(str(NO_DATA_STATUS), 0)
+    errors = sum(count for code, count in status.items() if int(code) >= 400) - no_data
+    elapsed = child["elapsed"]
+    return {
+        "scenario": name,
+        "elapsed_s": round(elapsed, 3),
+        "requests": requests,
+        "rows": rows,
+        "errors": errors,
+        "no_data": no_data,
+        "requests_per_sec": round(requests / elapsed, 2) if elapsed else None,
+        "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": round(child["peak_rss"] / 2**20, 1) if child["peak_rss"] else None,
+        "bytes_written": bytes_written,
+    }
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_regressions(results, history, version, baseline=None, tolerance=0.1):
+    """Confronta i risultati con la versione di riferimento; restituisce una lista di messaggi."""
+    previous = [entry for entry in history if entry["version"] != version]
+    if baseline:
+        previous = [entry for entry in previous if entry["version"] == baseline]
+    reference = {}
+    for entry in previous:
+        reference[entry["scenario"]] = entry          # l'ultima occorrenza vince
+    messages = []
+    for result in results:
+        ref = reference.get(result["scenario"])
+        if ref is None:
+            continue
+        for metric, higher_is_better in TRACKED_METRICS.items():
+            new, old = result.get(metric), ref.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                messages.append(f"{result['scenario']}.{metric}: {old} -> {new} ({change:+.1%} vs {ref['version']})")
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end contro il Theta Terminal simulato.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Scenari separati da virgola.")
+    parser.add_argument("--start", default="2024-01-02")
+    parser.add_argument("--end", default="2024-02-29")
+    parser.add_argument("--expirations", type=int, default=4)
+    parser.add_argument("--strikes", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=None, help="Richieste/s accettate dal server simulato.")
+    parser.add_argument("--requests-per-second", type=float, default=None, help="Budget del client (default: config).")
+    parser.add_argument("--history", default=DEFAULT_HISTORY)
+    parser.add_argument("--baseline", default=None, help="Versione di riferimento (default: la precedente).")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-record", action="store_true", help="Non aggiunge i risultati allo storico.")
+    # Modalità interna: esecuzione di un singolo scenario nel processo figlio
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Scenari sconosciuti: {unknown}. Disponibili: {sorted(SCENARIOS)}")
+
+    chain = MockChain("SPY", args.start, args.end, args.expirations, args.strikes)
+    version = git_version()
+    results = []
+    with MockTerminal(chain, latency=args.latency, error_rate=args.error_rate, rate_limit=args.rate_limit) as terminal:
+        for name in names:
+            print(f"⏱️ {name}...")
+            result = run_scenario(name, terminal, args)
+            if result is not None:
+                results.append(result)
+
+    if not results:
+        sys.exit(1)
+    print(pd.DataFrame(results).set_index("scenario").to_string())
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, version, args.baseline, args.tolerance)
+    if not args.no_record:
+        timestamp = datetime.now().isoformat(timespec="seconds")
+        with open(args.history, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps({"version": version, "timestamp": timestamp, **result}) + "\n")
+    if regressions:
+        print("⚠️ Regressioni rispetto alla versione di riferimento:")
+        for message in regressions:
+            print(f"\t{message}")
+        if args.fail_on_regression:
+            sys.exit(1)
+    else:
+        print("✅ Nessuna regressione.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,122 @@
 # Configurazioni globali
+
+BASE_URL = "http://127.0.0.1:25510"
+
+# 🔹 **Client HTTP verso Theta Terminal**
+# Il terminale accetta un numero limitato di richieste contemporanee (dipende dall'abbonamento):
+# il rate limiter globale evita di saturarlo e di ricevere 429.
+HTTP_POOL_SIZE = 16
+HTTP_MAX_RETRIES = 5
+HTTP_BACKOFF_BASE = 0.5      # secondi, raddoppia a ogni tentativo
+HTTP_BACKOFF_MAX = 30.0
+TERMINAL_REQUESTS_PER_SECOND = 20.0
+TERMINAL_BURST = 4
+
+# Timeout (connect, read) in secondi per prefisso di endpoint; il prefisso più lungo vince.
+HTTP_TIMEOUTS = {
+    "/v2/list/": (3.05, 30),
+    "/v2/hist/": (3.05, 120),
+    "/v2/bulk_hist/": (3.05, 600),
+}
+HTTP_DEFAULT_TIMEOUT = (3.05, 60)
+
+# 🔹 **Pianificazione delle richieste**
+# Le date mancanti vengono raggruppate in intervalli contigui: ogni intervallo è una sola richiesta.
+MAX_REQUEST_SPAN_DAYS = 31
+
+# 🔹 **Timeframe intraday supportati** (nome -> intervallo in millisecondi)
+INTRADAY_TIMEFRAMES = {
+    "1minute": 60000,
+    "5minute": 300000,
+    "15minute": 900000,
+    "30minute": 1800000,
+    "1hour": 3600000
+}
+
+# 🔹 **Storage**
+PARQUET_COMPRESSION = "zstd"
+
+# 🔹 **Cache dei metadati dei contratti** (liste di root, scadenze e strike)
+# Gli strike delle scadenze già passate non cambiano più e restano in cache per sempre.
+METADATA_CACHE_FILE = "metadata_cache.json"
+METADATA_TTL_SECONDS = 6 * 3600      # scadenze e strike di contratti ancora quotati
+ROOT_LIST_TTL_SECONDS = 24 * 3600    # liste di root (stock, indici, opzioni)
+
+# 🔹 **Logging** (i messaggi per singolo contratto sono a livello DEBUG)
+LOG_LEVEL = "INFO"
+LOG_JSON = False     # True -> una riga JSON per messaggio, con i campi strutturati (symbol, expiration, ...)
+
+# 🔹 **Coda persistente dei download** (piano dei backfill, ripresa dopo un'interruzione)
+JOB_QUEUE_FILE = "jobs.sqlite"
+
+# 🔹 **Selezione dell'universo di contratti** (FetchOptions / update_data)
+# Per ogni data vengono scaricati solo i contratti con DTE in [min_dte, max_dte] e strike entro la banda
+# di moneyness (|strike / spot - 1|) o di |delta| (calcolato con volatilità costante) rispetto alla
+# chiusura dell'underlying salvata. None = nessun filtro; con tutti i filtri a None si scarica l'intera catena.
+UNIVERSE = {
+    "min_dte": 0,
+    "max_dte": None,
+    "moneyness": None,      # es. 0.15 -> strike entro ±15% dallo spot
+    "delta": None,          # es. (0.05, 0.95)
+    "volatility": 0.2,
+}
+
+# 🔹 **Aggiornamento di più simboli** (orchestrator.UpdateOrchestrator)
+# Task in volo contemporaneamente per tutti i simboli: non superare HTTP_POOL_SIZE, il ritmo delle
+# richieste resta comunque limitato da TERMINAL_REQUESTS_PER_SECOND.
+ORCHESTRATOR_MAX_CONCURRENCY = 8
+
+# 🔹 **Pipeline di ingest** (fetch nei thread -> decode/normalize/write in un pool di processi)
+# Con INGEST_PIPELINE i task dei contratti di FetchOptions passano da utils.pipeline.IngestPipeline:
+# utile nei backfill grandi, dove il parsing JSON e la compressione zstd saturano il GIL.
+INGEST_PIPELINE = False
+PIPELINE_PROCESSES = None    # None = un processo per core
+PIPELINE_QUEUE_SIZE = 32     # risposte scaricate in attesa di decodifica (limita la memoria)
+
+# 🔹 **Lettura dei dati salvati** (DatasetStore.query / ThetaDataFetcher.query)
+QUERY_BATCH_SIZE = 131072    # righe per RecordBatch negli iteratori a batch
+
+# 🔹 **Compattazione dello storage** (utils.compaction): i frammenti di ogni partizione date=
+# vengono fusi in file ordinati per (expiration, strike, right, ms_of_day)
+COMPACTION_ROW_GROUP_SIZE = 128 * 1024
+COMPACTION_MAX_ROWS_PER_FILE = 8 * 1024 * 1024
+COMPACTION_BLOOM_FILTERS = False     # True -> bloom filter su expiration e strike
+COMPACTION_DEDUPLICATE = True        # una riga per chiave primaria (utils.schema.PRIMARY_KEYS): vince il frammento più recente
+
+# 🔹 **Theta Terminal** (utils.terminal.TerminalManager)
+JAVA_PATH = None                  # eseguibile java esplicito; None = ricerca in JAVA_HOME, PATH e cartelle standard
+JAVA_MIN_VERSION = 22
+TERMINAL_START_TIMEOUT = 120      # secondi massimi di attesa perché il terminale risponda dopo l'avvio
+TERMINAL_PROBE_INITIAL = 0.1      # intervallo iniziale tra i probe di readiness (raddoppia a ogni probe)
+TERMINAL_PROBE_MAX = 2.0
+TERMINAL_PROBE_TIMEOUT = (0.5, 5)
+TERMINAL_WATCHDOG_INTERVAL = 15   # secondi tra i controlli del watchdog durante gli aggiornamenti
+TERMINAL_MAX_RESTARTS = 5
+
+# 🔹 **Modalità live** (utils.live.LiveFollower / ThetaDataFetcher.follow)
+# Ogni poll scarica solo le barre completate dall'ultimo poll; le barre vengono salvate in blocco ogni LIVE_FLUSH_SECONDS.
+LIVE_POLL_SECONDS = 5
+LIVE_FLUSH_SECONDS = 60
+LIVE_BUFFER_CAPACITY = 2048     # barre in memoria per strumento (una sessione a 1 minuto = 390 barre)
+LIVE_MAX_CONTRACTS = 50         # contratti seguiti quando non indicati esplicitamente
+LIVE_MAX_CONCURRENCY = 4
+
+# 🔹 **Cache delle tabelle lette** (utils.table_cache, usata da DatasetStore.read / DatasetStore.query)
+# Le letture ripetute degli stessi dati non modificati vengono servite dalla memoria; oltre il budget
+# vengono eliminate le tabelle usate meno di recente. 0 = cache disattivata.
+TABLE_CACHE_MAX_BYTES = 512 * 2**20
+
+# 🔹 **Greche** (update_data): "local" = IV e greche calcolate da utils.greeks a partire dalle quote e
+# dall'underlying già salvati (nessun download aggiuntivo); "terminal" = scaricate dal terminale.
+GREEKS_SOURCE = "local"
+GREEKS_OPEN_INTEREST = True        # con "local" l'open interest viene comunque scaricato (una richiesta per intervallo)
+GREEKS_RISK_FREE_RATE = 0.05       # tasso continuo annuo usato dal calcolo locale
+GREEKS_DIVIDEND_YIELD = 0.0        # dividend yield continuo annuo dell'underlying
+GREEKS_IV_TOLERANCE = 1e-6         # errore relativo massimo sul prezzo della soluzione di Newton
+GREEKS_IV_MAX_ITER = 50
+GREEKS_CHUNK_ROWS = 500000         # righe calcolate insieme (limita la memoria dei calcoli intermedi)
+
+# 🔹 **Ricampionamento** (update_data): i timeframe intraday multipli di RESAMPLE_SOURCE_TIMEFRAME vengono
+# costruiti localmente dalle barre già salvate (utils.resample); si scaricano solo le sessioni non coperte.
+RESAMPLE_ENABLED = True
+RESAMPLE_SOURCE_TIMEFRAME = "1minute"
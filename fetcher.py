@@ -1,10 +1,37 @@
+import copy
+import logging
 import os
-import time
 import requests
-import subprocess
 import pandas as pd
+import pyarrow.dataset as ds
 from datetime import datetime, timedelta
+
+import config
 from options.fetch_options import FetchOptions
+from stock.fetch_stock import FetchStock
+from index.fetch_index import FetchIndex
+from orchestrator import UpdateOrchestrator
+from utils.compaction import compact_store
+from utils.greeks import iter_local_greeks
+from utils.http_client import get_default_client
+from utils.job_queue import JobQueue
+from utils.live import LiveFollower
+from utils.logging_utils import configure_logging
+from utils.manifest import CoverageManifest
+from utils.merge_data import iter_joined_days
+from utils.metadata_cache import MetadataCache
+from utils.metrics import profiled
+from utils.resample import can_resample, resample_dataset, resample_order
+from utils.schema import underlying_kind
+from utils.storage import DatasetStore
+from utils.terminal import TerminalManager
+from utils.trading_calendar import missing_sessions, session_spans, trading_days
+from utils.universe import UniverseSelector
+
+logger = logging.getLogger(__name__)
+
+# Colonne delle quote lette per il calcolo locale delle greche (close solo per option_eod)
+LOCAL_GREEKS_COLUMNS = ["date", "ms_of_day", "expiration", "strike", "right", "bid", "ask", "close"]
 
 
 
@@ -28,203 +55,395 @@ class ThetaDataFetcher:
         self.index_data_dir = index_dir
         self.BASE_URL = BASE_URL
         self.TERMINAL_JAR_PATH = TERMINAL_JAR_PATH
-        
-        self.options_fetcher = FetchOptions(symbol="SPY", options_data_dir="data/options", base_url=self.BASE_URL)
 
+        # 🔹 **Logging strutturato (nessun effetto se l'applicazione ha già configurato il logging)**
+        configure_logging(config.LOG_LEVEL, json_format=config.LOG_JSON)
+
+        # 🔹 **Client HTTP condiviso da tutti i fetcher (pool di connessioni + rate limit globale)**
+        self.client = get_default_client(self.BASE_URL)
+        self.metrics = self.client.metrics
 
         os.makedirs(self.options_data_dir, exist_ok=True)
         os.makedirs(self.stock_data_dir, exist_ok=True)
         os.makedirs(self.index_data_dir, exist_ok=True)
 
-        self.JAVA_PATH = self.find_java_executable()
-        
-        # 🔹 **Recupera la lista degli stock e degli indici**
-        self.stock_list = self.get_stock_list()
-        self.index_list = self.get_index_list()
+        # 🔹 **Manifest di copertura condiviso: la pianificazione degli aggiornamenti non legge i file di dati**
+        self.manifest = CoverageManifest(os.path.join(self.options_data_dir, "coverage.sqlite"))
+        self.options_store = DatasetStore(self.options_data_dir)
+        # 🔹 **Cache LRU delle tabelle lette, condivisa da tutti gli store del processo (hit/miss in table_cache.stats())**
+        self.table_cache = self.options_store.cache
+        # 🔹 **Cache persistente dei metadati (root, scadenze, strike) condivisa con i fetcher**
+        self.metadata_cache = MetadataCache(os.path.join(self.options_data_dir, config.METADATA_CACHE_FILE))
+        self.job_queue = JobQueue(os.path.join(self.options_data_dir, config.JOB_QUEUE_FILE))
+
+        self.options_fetcher = self._options_fetcher(self.symbol)
 
-        if not self.check_terminal_connection():
-            print("Theta Terminal non è attivo. Tentativo di avvio...")
-            self.start_terminal()
-            time.sleep(20)
-            if not self.check_terminal_connection():
-                raise ConnectionError("Impossibile avviare Theta Terminal. Controlla i log.")
+        # 🔹 **Liste di stock e indici: caricate al primo uso (dalla cache dei metadati se valida)**
+        self._stock_list = None
+        self._index_list = None
+
+        # 🔹 **Theta Terminal: Java viene cercato solo se serve avviarlo; dopo un errore di connessione
+        # il client chiede al manager di riavviarlo e ripete la richiesta**
+        self.terminal = TerminalManager(self.client, self.username, self.password, self.TERMINAL_JAR_PATH,
+                                        metadata_cache=self.metadata_cache, java_path=config.JAVA_PATH)
+        self.client.on_connection_lost = self.terminal.recover
+        self.terminal.ensure_running()
 
     def find_java_executable(self):
-        """Trova il percorso dell'eseguibile Java installato."""
-        try:
-            output = subprocess.check_output(["where", "java"], shell=True, text=True).strip()
-            java_paths = output.split("\n")
-            for path in java_paths:
-                try:
-                    version_output = subprocess.check_output([path, "-version"], stderr=subprocess.STDOUT, text=True)
-                    if "version \"22" in version_output:
-                        print(f"Usando Java: {path}")
-                        return path
-                except subprocess.CalledProcessError:
-                    continue
-        except Exception as e:
-            print(f"Errore nel trovare Java: {e}")
-        raise RuntimeError("Impossibile trovare un'installazione Java 22 valida.")
-        
-        
+        """Trova il percorso di un'installazione Java valida (ricerca multipiattaforma, risultato in cache)."""
+        return self.terminal.find_java()
+
+    @property
+    def JAVA_PATH(self):
+        return self.terminal.find_java()
+
+
+    @property
+    def stock_list(self):
+        if self._stock_list is None:
+            self._stock_list = self.get_stock_list()
+        return self._stock_list
+
+    @property
+    def index_list(self):
+        if self._index_list is None:
+            self._index_list = self.get_index_list()
+        return self._index_list
+
+    def _options_fetcher(self, symbol):
+        return FetchOptions(symbol=symbol, options_data_dir=self.options_data_dir, base_url=self.BASE_URL, client=self.client,
+                            manifest=self.manifest, metadata_cache=self.metadata_cache, job_queue=self.job_queue)
+
+    def for_symbol(self, symbol):
+        """
+        Fetcher per un altro simbolo che condivide client HTTP, manifest, cache dei metadati, coda dei job
+        e il terminale già avviato: la creazione non apre connessioni e non fa richieste.
+        """
+        fetcher = copy.copy(self)
+        fetcher.symbol = symbol
+        fetcher.options_fetcher = self._options_fetcher(symbol)
+        return fetcher
+
     def get_stock_list(self):
-        """Fetches the list of available stock symbols from ThetaData."""
-        try:
-            response = requests.get(f"{self.BASE_URL}/v2/list/roots/stock")
-            response.raise_for_status()
-            data = response.json().get("response", [])
-            return set(data) if data else set()
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Error retrieving stock list: {e}")
-            return set()
+        """Fetches the list of available stock symbols from ThetaData (cached on disk)."""
+        data = self._cached_roots("stock", "❌ Error retrieving stock list")
+        return set(data) if data else set()
 
     def get_index_list(self):
-        """Fetches the list of available index symbols from ThetaData."""
-        try:
-            response = requests.get(f"{self.BASE_URL}/v2/list/roots/index")
-            response.raise_for_status()
-            data = response.json().get("response", [])
-            return set(data) if data else set()
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Error retrieving index list: {e}")
-            return set()
+        """Fetches the list of available index symbols from ThetaData (cached on disk)."""
+        data = self._cached_roots("index", "❌ Error retrieving index list")
+        return set(data) if data else set()
+
+    def _cached_roots(self, sec_type, error_message):
+        """Lista dei root per tipo di strumento, dalla cache dei metadati se non più vecchia di ROOT_LIST_TTL_SECONDS."""
+        def fetch():
+            try:
+                return self.client.get_json(f"/v2/list/roots/{sec_type}")
+            except requests.exceptions.RequestException as e:
+                logger.error(f"{error_message}: {e}", extra={"endpoint": f"/v2/list/roots/{sec_type}"})
+                return None
+        return self.metadata_cache.get_or_fetch(f"roots:{sec_type}", fetch, ttl=config.ROOT_LIST_TTL_SECONDS)
         
         
         
     def get_interval_ms(self, timeframe):
         """Converts the timeframe into milliseconds for API requests (only for intraday data)."""
-        timeframe_map = {
-            "1minute": 60000,
-            "5minute": 300000,
-            "15minute": 900000,
-            "30minute": 1800000,
-            "1hour": 3600000
-        }
-        if timeframe not in timeframe_map:
+        if timeframe not in config.INTRADAY_TIMEFRAMES:
             raise ValueError(f"Invalid intraday timeframe: {timeframe}")
-        return timeframe_map[timeframe]
+        return config.INTRADAY_TIMEFRAMES[timeframe]
 
 
 
 
     def start_terminal(self):
-        """Avvia Theta Terminal in background."""
-        try:
-            creation_flags = subprocess.DETACHED_PROCESS if os.name == "nt" else 0
-            subprocess.Popen(
-                [self.JAVA_PATH, "-jar", self.TERMINAL_JAR_PATH, self.username, self.password],
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
-                creationflags=creation_flags
-            )
-            print("✅ Theta Terminal avviato. Attendi qualche secondo per la connessione...")
-        except Exception as e:
-            print(f"❌ Errore nell'avvio di Theta Terminal: {e}")
+        """Avvia Theta Terminal in background e attende che risponda."""
+        self.terminal.start()
+        return self.terminal.wait_until_ready()
 
     def check_terminal_connection(self):
         """Verifica se Theta Terminal è in esecuzione e raggiungibile."""
-        try:
-            response = requests.get(f"{self.BASE_URL}/v2/list/roots/option", timeout=5)
-            return response.status_code == 200
-        except requests.exceptions.RequestException:
-            return False
+        return self.terminal.is_ready()
         
     def list_roots_option(self):
-        """Recupera la lista dei simboli root delle opzioni disponibili."""
-        try:
-            response = requests.get(f"{self.BASE_URL}/v2/list/roots/option", timeout=5)
-            response.raise_for_status()
-            return response.json().get("response", [])
-        except requests.exceptions.RequestException as e:
-            print(f"Errore nella richiesta: {e}")
-            print(f"\tStatus Code: {response.status_code}")
-            print(f"\tResponse Text: {response.text}")
-            return None
+        """Recupera la lista dei simboli root delle opzioni disponibili (dalla cache dei metadati se valida)."""
+        return self._cached_roots("option", "Errore nella richiesta")
 
 
-    def update_data(self, selected_timeframes, recent_only=True):
+    def update_data(self, selected_timeframes, recent_only=True, profile=None, profile_output=None):
         """
         Updates options, Greeks (including IV), Open Interest, and underlying data for selected timeframes.
 
+        The work is planned from the coverage manifest alone: no data file is opened to find
+        out what is missing.
+
         Args:
             selected_timeframes (list): List of timeframes to update.
             recent_only (bool): 
-                - If True, downloads only from the last available date/timestamp in the file onward.
-                - If False, downloads all available dates/timestamps and fetches only the missing ones.
+                - If True, downloads only from the last covered date onward.
+                - If False, checks the whole available history and fetches only the missing dates.
+            profile (str): Optional profiler around the whole update: "cprofile" or "pyinstrument".
+            profile_output (str): File for the profiler output (.prof for cProfile, .html for pyinstrument);
+                if omitted the report is logged.
         """
-        current_date = datetime.utcnow()  # Get current date and time
-
-        for timeframe in selected_timeframes:
-            print(f"🔄 Updating for timeframe: {timeframe}")
-            is_intraday = timeframe != "daily"
-
-            # 🔹 **Determina se l'underlying è uno stock o un index**
-            if self.symbol in self.stock_list:
-                fetch_daily = self.fetch_daily_stock_data
-                fetch_intraday = self.fetch_intraday_stock_data
-                available_dates = self.get_available_dates(is_intraday, data_type="stock")
-            elif self.symbol in self.index_list:
-                fetch_daily = self.fetch_daily_index_data
-                fetch_intraday = self.fetch_intraday_index_data
-                available_dates = self.get_available_dates(is_intraday, data_type="index")
+        with self.terminal.watch():
+            if profile:
+                with profiled(profile, profile_output):
+                    self._update_data(selected_timeframes, recent_only)
             else:
-                raise ValueError(f"Symbol {self.symbol} not recognized as stock or index.")
+                self._update_data(selected_timeframes, recent_only)
+        logger.info(f"📊 {self.metrics.summary()}", extra={"symbol": self.symbol})
+
+
+    def update_symbols(self, symbols, selected_timeframes, recent_only=True, max_concurrency=config.ORCHESTRATOR_MAX_CONCURRENCY):
+        """
+        Updates several symbols at once, sharing this fetcher's connection pool, rate budget,
+        manifest and caches; tasks of different symbols are interleaved in one worker pool.
+
+        Returns:
+            dict: Per-symbol summary (status, tasks, done, failed, failures), see UpdateOrchestrator.run.
+        """
+        with self.terminal.watch():
+            return UpdateOrchestrator(self, symbols, max_concurrency).run(selected_timeframes, recent_only)
+
+
+    def follow(self, timeframe="1minute", contracts=None, background=False, until_close=True, **options):
+        """
+        Live tail-follow of the current session: polls only the bars completed since the last poll for
+        the underlying and a subset of option contracts, keeps them in array-backed ring buffers
+        (follower.underlying / follower.options, readable without copies) and flushes them to storage
+        in batches (see utils.live.LiveFollower).
+
+        Args:
+            timeframe (str): Intraday timeframe to follow.
+            contracts (list): (exp, strike, right) to follow; None = the nearest contracts of the universe.
+            background (bool): If True the follower runs in a background thread (stop it with follower.stop()).
+            until_close (bool): Stop when the session closes.
+            **options: poll_seconds, flush_seconds, capacity, max_contracts, max_concurrency, clock.
+
+        Returns:
+            LiveFollower: The follower (already finished unless background=True).
+        """
+        follower = LiveFollower(self, timeframe, contracts, **options)
+        if background:
+            return follower.start(until_close)
+        follower.run(until_close)
+        return follower
+
+
+    def query(self, symbol, data_type, timeframe, start=None, end=None, expirations=None, strikes=None, rights=None,
+              columns=None, filter=None, output="scanner", batch_size=config.QUERY_BATCH_SIZE):
+        """
+        Lazy read of stored data with predicate pushdown and column projection (see DatasetStore.query).
+
+        Only the date partitions in [start, end] are listed; expiration/strike/right filters are
+        checked against Parquet row-group statistics, and only the requested columns are read.
+        One day's chain across all strikes is a single-partition scan:
+
+            fetcher.query("SPY", "option_eod", "daily", 20240105, 20240105, columns=["strike", "right", "close"], output="pandas")
+
+        Args:
+            data_type (str): "option_eod", "option_quote", "greeks", "stock" or "index".
+            output (str): "scanner" (default), "dataset", "batches", "polars", "table" or "pandas".
+                "table" and "pandas" results are served from the process-wide table cache while the
+                underlying partitions are unchanged.
+        """
+        if data_type == "stock":
+            store = DatasetStore(self.stock_data_dir)
+        elif data_type == "index":
+            store = DatasetStore(self.index_data_dir)
+        else:
+            store = self.options_store
+        return store.query(symbol, data_type, timeframe, start, end, expirations, strikes, rights, columns, filter, output, batch_size)
+
 
-            # 🔹 **Definizione dei file**
-            option_file = os.path.join(self.options_data_dir, self.generate_file_name(self.symbol, "options", timeframe))
-            greeks_file = os.path.join(self.options_data_dir, self.generate_file_name(self.symbol, "greeks", timeframe))
-            underlying_file = os.path.join(self.options_data_dir, self.generate_file_name(self.symbol, "underlying", timeframe))
+    def compact_data(self, symbols=None, data_types=None, timeframes=None, **options):
+        """
+        Compacts the stored fragments of options, stock and index data into large sorted files
+        (see utils.compaction). Only date partitions with more than one fragment are rewritten.
+        Must not run while update_data writes to the same directories.
 
-            # 🔹 **Trova le date mancanti**
-            last_dates = {}
-            if recent_only:
-                last_dates["options"] = self.get_last_available_date(option_file, is_intraday)
-                last_dates["greeks"] = self.get_last_available_date(greeks_file, is_intraday)
-                last_dates["underlying"] = self.get_last_available_date(underlying_file, is_intraday)
+        Returns:
+            dict: Partitions compacted/skipped, files and bytes before/after, bytes saved, rows checked.
+        """
+        report = None
+        for root_dir in (self.options_data_dir, self.stock_data_dir, self.index_data_dir):
+            result = compact_store(root_dir, symbols, data_types, timeframes, **options)
+            report = result if report is None else {key: report[key] + value for key, value in result.items()}
+        logger.info(f"🗜️ Compattazione: {report['partitions_compacted']} partizioni, {report['files_before']} -> "
+                    f"{report['files_after']} file, {report['bytes_saved'] / 2**20:.1f} MB risparmiati", extra=report)
+        return report
 
-                # 🔹 **Filtra solo le date successive all'ultima presente nel file**
-                available_dates = {d for d in available_dates if any(d > last_dates[k] for k in last_dates if last_dates[k])}
 
+    def export_metrics(self, path=None, format="json"):
+        """
+        Exports the collected metrics (per-endpoint latency, bytes, rows, retries, errors and
+        decode/normalize/merge/write timings) as a JSON snapshot or Prometheus text.
+
+        Returns:
+            str: The exported text (also written to path when given).
+        """
+        if format == "json":
+            return self.metrics.to_json(path)
+        if format == "prometheus":
+            text = self.metrics.to_prometheus()
+            if path:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+            return text
+        raise ValueError(f"Invalid format: {format}. Must be 'json' or 'prometheus'.")
+
+
+    def _update_data(self, selected_timeframes, recent_only):
+        # 🔹 **Determina se l'underlying è uno stock o un index**
+        underlying = self._underlying()
+        date_range = self._date_range(underlying[0])
+
+        for timeframe in resample_order(selected_timeframes):
+            logger.info(f"🔄 Updating for timeframe: {timeframe}", extra={"symbol": self.symbol, "timeframe": timeframe})
+            # **Sessioni già presenti a 1 minuto: ricampionate in locale, il piano scarica solo il resto**
+            self._resample_timeframe(timeframe, underlying, date_range)
+            plan = self._plan_timeframe(timeframe, underlying, date_range, recent_only)
+
+            # **Underlying** (prima di opzioni e greche: serve alla selezione dei contratti e al join as-of)
+            for span_start, span_end in plan["missing_underlying"]:
+                self._update_underlying_span(plan, span_start, span_end)
+
+            # **Opzioni: la copertura è per contratto e viene pianificata da FetchOptions sullo stesso manifest**
+            self._select_universe(plan)
+            if plan["is_intraday"]:
+                self.options_fetcher.fetch_intraday_option_data(plan["start_date"], plan["last_date"], plan["interval_ms"])
             else:
-                # 🔹 **Se recent_only=False, controlla quali date/orari sono effettivamente mancanti nel file**
-                missing_options = self.get_missing_dates(option_file, available_dates, is_intraday)
-                missing_greeks = self.get_missing_dates(greeks_file, available_dates, is_intraday)
-                missing_underlying = self.get_missing_dates(underlying_file, available_dates, is_intraday)
+                self.options_fetcher.fetch_daily_option_data(plan["start_date"], plan["last_date"])
 
-                # 🔹 **Rimuove date già presenti nei file**
-                available_dates = available_dates - (set(missing_options) | set(missing_greeks) | set(missing_underlying))
+            if not plan["missing_greeks"]:
+                logger.info(f"✅ No missing Greeks dates for timeframe {timeframe}.", extra={"symbol": self.symbol, "timeframe": timeframe})
+                continue
 
-            # **Scaricare solo i dati mancanti**
-            new_options = pd.DataFrame()
-            if not available_dates:
-                print(f"✅ No missing dates for timeframe {timeframe}. Skipping update.")
-                continue  # Evita download inutili
+            # **Greche + Open Interest + barra dell'underlying (salvati nello stesso dataset, una giornata alla volta)**
+            for span_start, span_end in plan["missing_greeks"]:
+                self._update_greeks_span(plan, span_start, span_end)
 
-            if not missing_options.empty:
-                new_options = self.fetch_intraday_option_data(missing_options) if is_intraday else self.options_fetcher.fetch_daily_option_data(missing_options)
+        logger.info("✅ Data update complete.", extra={"symbol": self.symbol})
 
-            new_greeks = pd.DataFrame()
-            if not missing_greeks.empty:
-                new_greeks = self.fetch_option_greeks_intraday(missing_greeks) if is_intraday else self.fetch_option_greeks_eod(missing_greeks)
-                new_options = self.merge_option_data(new_options, new_greeks)
 
-            new_oi = pd.DataFrame()
-            if not missing_greeks.empty:  # OI is saved within Greeks file
-                new_oi = self.fetch_option_open_interest(missing_greeks)
-                new_greeks = self.merge_option_data(new_greeks, new_oi)
+    def _date_range(self, underlying_type):
+        """(prima, ultima) sessione disponibile per l'underlying, senza andare oltre oggi."""
+        available_dates = self.get_available_dates(False, data_type=underlying_type)
+        return available_dates[0], min(available_dates[-1], pd.Timestamp(datetime.utcnow()).normalize())
 
-            new_underlying = pd.DataFrame()
-            if not missing_underlying.empty:
-                new_underlying = fetch_intraday(missing_underlying) if is_intraday else fetch_daily(missing_underlying)
 
-            # **Merge and save**
-            if not new_options.empty:
-                self.merge_downloaded_data(option_file, new_options)
-            if not new_greeks.empty:
-                self.merge_downloaded_data(greeks_file, new_greeks)
-            if not new_underlying.empty:
-                self.merge_downloaded_data(underlying_file, new_underlying)
+    def _resample_timeframe(self, timeframe, underlying, date_range):
+        """
+        Costruisce underlying e quote di opzioni di timeframe dalle barre a 1 minuto già salvate (vedi
+        utils.resample) e le registra nel manifest, così la pianificazione non le scarica di nuovo.
+        """
+        if not config.RESAMPLE_ENABLED or not can_resample(timeframe):
+            return
+        underlying_type, _, underlying_store = underlying
+        first_date, last_date = date_range
+        resample_dataset(underlying_store, self.manifest, self.symbol, underlying_type, timeframe, first_date, last_date,
+                         kind=underlying_kind(timeframe))
+        resample_dataset(self.options_store, self.manifest, self.symbol, "option_quote", timeframe, first_date, last_date, kind="quote")
+
+
+    def _plan_timeframe(self, timeframe, underlying, date_range, recent_only):
+        """Intervalli mancanti (dal manifest) di underlying e greche per un timeframe, come dizionario di piano."""
+        underlying_type = underlying[0]
+        first_date, last_date = date_range
+        is_intraday = timeframe != "daily"
+
+        start_date = first_date
+        if recent_only:
+            last_covered = [
+                self.manifest.last_covered(self.symbol, data_type, timeframe)
+                for data_type in ("greeks", underlying_type)
+            ]
+            if all(last_covered):
+                start_date = max(first_date, min(last_covered) + timedelta(days=1))
+
+        return {
+            "timeframe": timeframe,
+            "is_intraday": is_intraday,
+            "interval_ms": self.get_interval_ms(timeframe) if is_intraday else None,
+            "start_date": start_date,
+            "last_date": last_date,
+            "underlying": underlying,
+            "missing_underlying": self.get_missing_dates(underlying_type, timeframe, start_date, last_date),
+            "missing_greeks": self.get_missing_dates("greeks", timeframe, start_date, last_date),
+        }
+
 
-        print("✅ Data update complete.")
+    def _update_underlying_span(self, plan, span_start, span_end):
+        underlying_type, underlying_fetcher, underlying_store = plan["underlying"]
+        timeframe = plan["timeframe"]
+        if plan["is_intraday"]:
+            new_underlying = underlying_fetcher.fetch_intraday_underlying_data(span_start, span_end, plan["interval_ms"])
+        else:
+            new_underlying = underlying_fetcher.fetch_daily_underlying_data(span_start, span_end)
+        if new_underlying is not None:
+            underlying_store.append(new_underlying, self.symbol, underlying_type, timeframe, kind=underlying_kind(timeframe))
+        self.manifest.add(self.symbol, underlying_type, timeframe, span_start, span_end)
+
+
+    def _select_universe(self, plan):
+        """L'universo di contratti (DTE, moneyness/delta) si basa sulle chiusure daily dell'underlying già salvate."""
+        underlying_type, _, underlying_store = plan["underlying"]
+        self.options_fetcher.selector = UniverseSelector.from_store(underlying_store, self.symbol, underlying_type)
+
+
+    def _update_greeks_span(self, plan, span_start, span_end):
+        underlying_type, _, underlying_store = plan["underlying"]
+        timeframe = plan["timeframe"]
+        is_intraday = plan["is_intraday"]
+        if config.GREEKS_SOURCE == "local":
+            new_greeks = None
+        elif is_intraday:
+            new_greeks = self.options_fetcher.fetch_option_greeks_intraday(span_start, span_end, plan["interval_ms"])
+        else:
+            new_greeks = self.options_fetcher.fetch_daily_option_greeks(span_start, span_end)
+        new_oi = None
+        if config.GREEKS_SOURCE != "local" or config.GREEKS_OPEN_INTEREST:
+            if is_intraday:
+                new_oi = self.options_fetcher.fetch_option_open_interest_intraday(span_start, span_end, plan["interval_ms"])
+            else:
+                new_oi = self.options_fetcher.fetch_daily_option_open_interest(span_start, span_end)
+
+        span_filter = (ds.field("date") >= int(span_start.strftime("%Y%m%d"))) & (ds.field("date") <= int(span_end.strftime("%Y%m%d")))
+        span_underlying = underlying_store.read(self.symbol, underlying_type, timeframe, columns=["date", "ms_of_day", "close"], filter=span_filter)
+        if config.GREEKS_SOURCE == "local":
+            # **Greche calcolate dalle quote già salvate (option_quote / option_eod), una giornata alla volta**
+            #    Le sessioni con task di opzioni ancora pendenti o falliti restano mancanti: verranno calcolate
+            #    quando le quote di tutti i contratti saranno salvate
+            quote_type = "option_quote" if is_intraday else "option_eod"
+            sessions = pd.DatetimeIndex(trading_days(span_start, span_end))
+            unfinished = self.options_fetcher.unfinished_sessions(plan["start_date"], plan["last_date"], plan["interval_ms"])
+            ready = sessions[~sessions.strftime("%Y%m%d").astype(int).isin(unfinished)]
+            ready_days = set(ready.strftime("%Y%m%d").astype(int))
+            for day in [d for d in self.options_store.dates(self.symbol, quote_type, timeframe) if d in ready_days]:
+                quotes = self.options_store.query(self.symbol, quote_type, timeframe, day, day, output="pandas",
+                                                  columns=[c for c in LOCAL_GREEKS_COLUMNS if c != "close" or not is_intraday])
+                # Nome deterministico: ricalcolare una giornata interrotta prima della registrazione la sovrascrive
+                for day_df in iter_local_greeks(quotes, span_underlying, oi_df=new_oi, intraday=is_intraday):
+                    self.options_store.append(day_df, self.symbol, "greeks", timeframe, name="local-greeks")
+            if len(ready) < len(sessions):
+                logger.info(f"⏳ Greche di {len(sessions) - len(ready)} sessioni rimandate: quote di opzioni incomplete.",
+                            extra={"symbol": self.symbol, "timeframe": timeframe, "sessions": len(sessions) - len(ready)})
+            for ready_start, ready_end in session_spans(ready):
+                self.manifest.add(self.symbol, "greeks", timeframe, ready_start, ready_end)
+            return
+        if new_greeks is not None:
+            for day_df in iter_joined_days(new_greeks, oi_df=new_oi, underlying_df=span_underlying, intraday=is_intraday):
+                self.options_store.append(day_df, self.symbol, "greeks", timeframe)
+        self.manifest.add(self.symbol, "greeks", timeframe, span_start, span_end)
+
+
+    def _underlying(self):
+        """Returns (data_type, fetcher, store) for the underlying of self.symbol."""
+        if self.symbol in self.stock_list:
+            return "stock", FetchStock(self.symbol, self.stock_data_dir, base_url=self.BASE_URL, client=self.client), DatasetStore(self.stock_data_dir)
+        if self.symbol in self.index_list:
+            return "index", FetchIndex(self.symbol, self.index_data_dir, base_url=self.BASE_URL, client=self.client), DatasetStore(self.index_data_dir)
+        raise ValueError(f"Symbol {self.symbol} not recognized as stock or index.")
 
 
 
@@ -249,18 +468,16 @@ class ThetaDataFetcher:
             raise ValueError(f"Invalid data_type: {data_type}. Must be 'stock' or 'index'.")
 
         try:
-            response = requests.get(f"{self.BASE_URL}{endpoint}", params={"root": self.symbol})
-            response.raise_for_status()
-            data = response.json()
+            data = self.client.get_json(endpoint, params={"root": self.symbol})
 
-            if "response" in data and isinstance(data["response"], list) and len(data["response"]) > 0:
-                dates = sorted(pd.to_datetime([str(d) for d in data["response"]], format="%Y%m%d" if not is_intraday else "%Y%m%d%H%M"))
+            if isinstance(data, list) and len(data) > 0:
+                dates = sorted(pd.to_datetime([str(d) for d in data], format="%Y%m%d" if not is_intraday else "%Y%m%d%H%M"))
                 return dates
             else:
                 raise ValueError(f"❌ No available dates returned by API for {self.symbol}.")
 
         except requests.exceptions.RequestException as e:
-            print(f"❌ Error retrieving available dates: {e}")
+            logger.error(f"❌ Error retrieving available dates: {e}", extra={"symbol": self.symbol, "endpoint": endpoint})
             raise
 
             
@@ -274,20 +491,13 @@ class ThetaDataFetcher:
 
 
 
-    def get_missing_dates(self, file_path, first_date, last_date, is_intraday=False):
-        """Verifica quali date o minuti mancano nel file locale."""
-        if not os.path.exists(file_path):
-            return pd.date_range(first_date, last_date, freq="1D" if not is_intraday else "T")
-
-        df = pd.read_parquet(file_path)
-        if df.empty:
-            return pd.date_range(first_date, last_date, freq="1D" if not is_intraday else "T")
-
-        if is_intraday:
-            existing_timestamps = set(pd.to_datetime(df["timestamp"]))
-            all_timestamps = set(pd.date_range(first_date, last_date, freq="T"))
-            return sorted(all_timestamps - existing_timestamps)
+    def get_missing_dates(self, data_type, timeframe, first_date, last_date):
+        """
+        Restituisce gli intervalli (start, end) di sessioni di borsa non ancora scaricate secondo il manifest
+        di copertura, spezzati in richieste di al massimo config.MAX_REQUEST_SPAN_DAYS giorni.
 
-        existing_dates = set(pd.to_datetime(df["date"]).dt.date)
-        all_dates = set(pd.date_range(first_date, last_date).date)
-        return sorted(all_dates - existing_dates)
+        Weekend e festività non sono mai considerati mancanti e non interrompono un intervallo;
+        nessun file di dati viene letto. Vale sia per il daily sia per l'intraday, che si scarica a giornate intere.
+        """
+        covered = self.manifest.covered(self.symbol, data_type, timeframe)
+        return session_spans(missing_sessions(first_date, last_date, covered), config.MAX_REQUEST_SPAN_DAYS)
@@ -1,13 +1,21 @@
-import requests
+import logging
 import os
 import pandas as pd
 
+import config
+from utils.http_client import get_default_client
+
+logger = logging.getLogger(__name__)
+
 class FetchIndex:
-    BASE_URL = "http://127.0.0.1:25510"
+    BASE_URL = config.BASE_URL
 
-    def __init__(self, symbol, index_data_dir):
+    def __init__(self, symbol, index_data_dir, base_url=BASE_URL, client=None):
         self.symbol = symbol
         self.index_data_dir = index_data_dir
+        self.base_url = base_url
+        self.client = client or get_default_client(base_url)
+        self.metrics = self.client.metrics
         os.makedirs(self.index_data_dir, exist_ok=True)
 
     def fetch_daily_index_data(self, start_date, end_date):
@@ -16,16 +24,13 @@ class FetchIndex:
         file_path = os.path.join(self.index_data_dir, file_name)
 
         params = {"root": self.symbol, "start_date": start_date.strftime("%Y%m%d"), "end_date": end_date.strftime("%Y%m%d")}
-        response = requests.get(f"{self.BASE_URL}/v2/hist/index/price", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        if data:
-            df = pd.DataFrame(data)
+        df = self.client.get_frame("/v2/hist/index/price", params=params)
+        if df is not None:
             df.to_parquet(file_path, compression="zstd")
-            print(f"Index EOD data saved to {file_path}")
+            logger.info(f"Index EOD data saved to {file_path}", extra={"symbol": self.symbol, "rows": len(df)})
         else:
-            print("No index EOD data available.")
+            logger.warning("No index EOD data available.", extra={"symbol": self.symbol})
+        return df
             
             
     def fetch_intraday_index_data(self, start_date, end_date, interval_ms):
@@ -36,9 +41,20 @@ class FetchIndex:
             "end_date": end_date.strftime("%Y%m%d"),
             "ivl": interval_ms
         }
-        response = requests.get(f"{self.BASE_URL}/v2/hist/index/ohlc", params=params)
-        response.raise_for_status()
+        return self.client.get_frame("/v2/hist/index/ohlc", params=params)
+
+
+
+    def fetch_daily_underlying_data(self, start_date, end_date):
+        """Fetches daily (EOD) data for the index used as underlying asset."""
+        params = {
+            "root": self.symbol,
+            "start_date": start_date.strftime("%Y%m%d"),
+            "end_date": end_date.strftime("%Y%m%d")
+        }
+        return self.client.get_frame("/v2/hist/index/eod", params=params)
 
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
 
+    def fetch_intraday_underlying_data(self, start_date, end_date, interval_ms):
+        """Fetches intraday OHLC data for the index used as underlying asset."""
+        return self.fetch_intraday_index_data(start_date, end_date, interval_ms)
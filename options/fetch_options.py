@@ -1,44 +1,92 @@
-import os
+import logging
 import requests
+import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
+import config
+from utils.concurrency import run_tasks
+from utils.http_client import get_default_client
+from utils.job_queue import FAILED, IN_FLIGHT, PENDING, JobQueue, task_key
+from utils.manifest import CoverageManifest
+from utils.metadata_cache import MetadataCache
+from utils.pipeline import IngestPipeline
+from utils.schema import DATASET_KINDS
+from utils.storage import DatasetStore, timeframe_name
+from utils.trading_calendar import missing_sessions, session_spans, trading_days
+from utils.universe import contract_priority, days_to_expiration
+
+logger = logging.getLogger(__name__)
+
 class FetchOptions:
     
-    def __init__(self, symbol, options_data_dir, base_url="http://127.0.0.1:25510"):
+    def __init__(self, symbol, options_data_dir, base_url=config.BASE_URL, client=None, manifest=None, metadata_cache=None, job_queue=None,
+                 selector=None, pipeline=config.INGEST_PIPELINE, processes=config.PIPELINE_PROCESSES):
         self.symbol = symbol
         self.options_data_dir = options_data_dir
         self.base_url = base_url  # ✅ Ora è un parametro della classe
+        # Client HTTP condiviso (pool di connessioni, retry e rate limit comuni a tutti i fetcher)
+        self.client = client or get_default_client(base_url)
+        self.metrics = self.client.metrics
+        # Storage append-only partizionato symbol=/type=/timeframe=/date=
+        self.store = DatasetStore(options_data_dir)
+        # Manifest delle date già scaricate: la pianificazione non apre mai i file di dati
+        self.manifest = manifest or CoverageManifest(os.path.join(options_data_dir, "coverage.sqlite"))
+        # Cache persistente di scadenze e strike (evita di rielencare la catena a ogni aggiornamento)
+        self.metadata_cache = metadata_cache or MetadataCache(os.path.join(options_data_dir, config.METADATA_CACHE_FILE))
+        # Coda persistente dei task di download: un backfill interrotto riprende dai soli task rimasti
+        self.job_queue = job_queue or JobQueue(os.path.join(options_data_dir, config.JOB_QUEUE_FILE))
+        # Selezione dei contratti per DTE e moneyness/delta (utils.universe.UniverseSelector); None = intera catena
+        self.selector = selector
+        # Con pipeline=True i task dei contratti vengono decodificati e scritti in un pool di processi (utils.pipeline)
+        self.pipeline = pipeline
+        self.processes = processes
+
 
+    def fetch_expirations(self, refresh=False):
+        """Recupera tutte le date di scadenza disponibili per il simbolo (dalla cache se ancora valida)."""
+        key = f"expirations:{self.symbol}"
+        if refresh:
+            self.metadata_cache.invalidate(key)
+        return self.metadata_cache.get_or_fetch(key, lambda: self._list("/v2/list/expirations", {"root": self.symbol}))
 
-    def fetch_expirations(self):
-        """Recupera tutte le date di scadenza disponibili per il simbolo."""
-        params = {"root": self.symbol}
+    def fetch_strikes(self, expiration, refresh=False):
+        """
+        Recupera tutti i prezzi di esercizio disponibili per una data di scadenza specifica.
+
+        Gli strike di una scadenza già passata non possono più cambiare e restano in cache per sempre.
+        """
+        key = f"strikes:{self.symbol}:{expiration}"
+        if refresh:
+            self.metadata_cache.invalidate(key)
+        expired = int(expiration) < int(datetime.now().strftime("%Y%m%d"))
+        return self.metadata_cache.get_or_fetch(
+            key, lambda: self._list("/v2/list/strikes", {"root": self.symbol, "exp": expiration}), immutable=expired
+        )
+
+    def _list(self, endpoint, params):
         try:
-            response = requests.get(f"{self.base_url}/v2/list/expirations", params=params)
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(f"Errore nella richiesta: {e}")
-            print(f"\tStatus Code: {response.status_code}")
-            print(f"\tResponse Text: {response.text}")
-            
-        expirations = response.json().get("response", [])
-        return expirations
-
-    def fetch_strikes(self, expiration):
-        """Recupera tutti i prezzi di esercizio disponibili per una data di scadenza specifica."""
-        params = {"root": self.symbol, "exp": expiration}
-        try: 
-            response = requests.get(f"{self.base_url}/v2/list/strikes", params=params)
-            response.raise_for_status()
+            return self.client.get_json(endpoint, params=params)
         except requests.exceptions.RequestException as e:
-            print(f"Errore nella richiesta: {e}")
-            print(f"\tStatus Code: {response.status_code}")
-            print(f"\tResponse Text: {response.text}")
-        
-        
-        strikes = response.json().get("response", [])
-        return strikes
+            logger.error(f"Errore nella richiesta: {e}", extra={"endpoint": endpoint, "symbol": self.symbol})
+            return []
+
+    def warm_up_metadata(self, max_concurrency=1, refresh=False):
+        """
+        Popola la cache con le scadenze e gli strike di tutta la catena, richiedendo in parallelo solo
+        le liste mancanti o scadute e salvando la cache su disco una sola volta.
+
+        Returns:
+            dict: scadenza -> lista di strike.
+        """
+        expirations = self.fetch_expirations(refresh=refresh)
+        with self.metadata_cache.batch():
+            results = run_tasks(lambda exp: self.fetch_strikes(exp, refresh=refresh), [(exp,) for exp in expirations], max_concurrency)
+        logger.info(f"📇 Metadati {self.symbol}: {len(expirations)} scadenze "
+                    f"(cache: {self.metadata_cache.hits} hit, {self.metadata_cache.misses} miss)",
+                    extra={"symbol": self.symbol, "cache_hits": self.metadata_cache.hits, "cache_misses": self.metadata_cache.misses})
+        return {res.task[0]: res.result for res in results if res.ok}
     
     
     def fetch_daily_option_greeks(self, start_date, end_date):
@@ -48,11 +96,7 @@ class FetchOptions:
             "start_date": start_date.strftime("%Y%m%d"),
             "end_date": end_date.strftime("%Y%m%d")
         }
-        response = requests.get(f"{self.base_url}/v2/bulk_hist/option/eod", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/bulk_hist/option/eod", params=params, bulk=True)
     
     
     def fetch_option_greeks_intraday(self, start_date, end_date, interval_ms):
@@ -63,11 +107,7 @@ class FetchOptions:
             "end_date": end_date.strftime("%Y%m%d"),
             "ivl": interval_ms
         }
-        response = requests.get(f"{self.base_url}/v2/bulk_hist/option/ohlc", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/bulk_hist/option/ohlc", params=params, bulk=True)
     
     
     def fetch_daily_option_open_interest(self, start_date, end_date):
@@ -77,11 +117,7 @@ class FetchOptions:
             "start_date": start_date.strftime("%Y%m%d"),
             "end_date": end_date.strftime("%Y%m%d")
         }
-        response = requests.get(f"{self.base_url}/v2/hist/option/open_interest", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/hist/option/open_interest", params=params)
     
     
     def fetch_option_open_interest_intraday(self, start_date, end_date, interval_ms):
@@ -92,144 +128,384 @@ class FetchOptions:
             "end_date": end_date.strftime("%Y%m%d"),
             "ivl": interval_ms
         }
-        response = requests.get(f"{self.base_url}/v2/hist/option/open_interest", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/hist/option/open_interest", params=params)
     
     
     
 
-    def fetch_daily_option_data(self, start_date, end_date):
-        """Scarica i dati EOD per le opzioni iterando su tutte le expiration e strike disponibili, evitando duplicati."""
-
+    def _collect_contracts(self, max_concurrency=1):
+        """Costruisce la lista (exp, strike, right) di tutti i contratti disponibili per il simbolo."""
         expirations = self.fetch_expirations()
         if not expirations:
-            print("❌ Nessuna data di scadenza disponibile per questo simbolo.")
-            return
+            logger.error("❌ Nessuna data di scadenza disponibile per questo simbolo.", extra={"symbol": self.symbol})
+            return []
 
-        for exp in expirations:
-            strikes = self.fetch_strikes(exp)
-            if not strikes:
-                print(f"⚠️ Nessun prezzo di esercizio disponibile per la scadenza {exp}.")
-                continue
+        # Le liste di strike sono indipendenti tra loro: vengono richieste in parallelo
+        # (solo quelle non in cache) e la cache viene salvata su disco una volta sola
+        with self.metadata_cache.batch():
+            strike_results = run_tasks(self.fetch_strikes, [(exp,) for exp in expirations], max_concurrency)
 
-            for strike in strikes:
+        contracts = []
+        for res in strike_results:
+            exp = res.task[0]
+            if not res.ok:
+                logger.error(f"❌ Errore nel recupero degli strike per la scadenza {exp}: {res.error}", extra={"symbol": self.symbol, "expiration": exp})
+                continue
+            if not res.result:
+                logger.warning(f"⚠️ Nessun prezzo di esercizio disponibile per la scadenza {exp}.", extra={"symbol": self.symbol, "expiration": exp})
+                continue
+            for strike in res.result:
                 for right in ['C', 'P']:
-                    file_name = f"{self.symbol}_options_eod_{exp}_{strike}_{right}.parquet"
-                    file_path = os.path.join(self.options_data_dir, file_name)
-
-                    # **Verifica i dati esistenti**
-                    if os.path.exists(file_path):
-                        existing_df = pd.read_parquet(file_path)
-                        existing_dates = set(pd.to_datetime(existing_df["date"]).dt.strftime("%Y%m%d"))
-                    else:
-                        existing_df = pd.DataFrame()
-                        existing_dates = set()
-
-                    # **Trova solo le date mancanti**
-                    requested_dates = set(pd.date_range(start_date, end_date).strftime("%Y%m%d"))
-                    missing_dates = sorted(requested_dates - existing_dates)
-
-                    if not missing_dates:
-                        print(f"✅ I dati per {exp}, {strike}, {right} sono già completi.")
-                        continue
-
-                    print(f"🔄 Scaricando dati per {exp}, {strike}, {right}, date mancanti: {len(missing_dates)}")
-
-                    # **Scarica SOLO i dati mancanti**
-                    for date in missing_dates:
-                        params = {
-                            "root": self.symbol,
-                            "exp": exp,
-                            "strike": strike,
-                            "right": right,
-                            "start_date": date,
-                            "end_date": date  # Scarica solo un giorno alla volta
-                        }
-                        
-                        try:
-                            response = requests.get(f"{self.base_url}/v2/hist/option/eod", params=params)
-                            response.raise_for_status()
-                        except requests.exceptions.RequestException as e:
-                            print(f"Errore nella richiesta: {e}")
-                            print(f"\tStatus Code: {response.status_code}")
-                            print(f"\tResponse Text: {response.text}")
-
-                        data = response.json().get("response", [])
-                        if data:
-                            new_df = pd.DataFrame(data)
-                            full_df = pd.concat([existing_df, new_df]).drop_duplicates().sort_values("date")
-                            full_df.to_parquet(file_path, compression="zstd")
-                            print(f"✅ Dati aggiornati salvati in {file_path}")
-                        else:
-                            print(f"⚠️ Nessun dato nuovo per {exp}, {strike}, {right}.")
-
-
-
-    def fetch_intraday_option_data(self, start_date, end_date, interval_ms):
-        """Scarica i dati intraday per le opzioni iterando su tutte le expiration e strike disponibili, evitando duplicati."""
+                    contracts.append((exp, strike, right))
+        return contracts
+
+
+    def _log_fields(self, exp, strike, right):
+        """Campi strutturati dei messaggi di log relativi a un contratto."""
+        return {"symbol": self.symbol, "expiration": exp, "strike": strike, "right": right}
+
+
+    def _report_failures(self, results):
+        """Stampa un riepilogo dei contratti falliti e li restituisce come lista di (exp, strike, right, errore)."""
+        failures = [(res.task[0]["params"]["exp"], res.task[0]["params"]["strike"], res.task[0]["params"]["right"], res.error)
+                    for res in results if not res.ok]
+        if failures:
+            logger.error(f"❌ {len(failures)} contratti su {len(results)} non aggiornati.", extra={"symbol": self.symbol, "failed": len(failures)})
+            for exp, strike, right, error in failures:
+                logger.error(f"\t{exp}, {strike}, {right}: {error}", extra=self._log_fields(exp, strike, right))
+        return failures
+
+
+    def fetch_daily_option_data(self, start_date, end_date, max_concurrency=1, max_span_days=config.MAX_REQUEST_SPAN_DAYS, bulk=False,
+                                only_failed=False, dry_run=False):
+        """
+        Scarica i dati EOD per le opzioni iterando su tutte le expiration e strike disponibili, evitando duplicati.
+
+        Il piano (un task per contratto e intervallo di date mancante) viene salvato nella coda persistente
+        prima di iniziare: se l'esecuzione si interrompe, la chiamata successiva con lo stesso intervallo
+        riprende dai soli task non completati, senza ripianificare.
+
+        Args:
+            start_date, end_date: Intervallo di date richiesto.
+            max_concurrency (int): Numero massimo di contratti scaricati in parallelo (1 = sequenziale).
+            max_span_days (int): Ampiezza massima in giorni di ogni singola richiesta.
+            bulk (bool | str): Se True o "expiration", scarica l'intera catena di ogni scadenza con
+                /v2/bulk_hist/option/eod; se "root", tutte le scadenze con una sola richiesta per intervallo.
+                I contratti non restituiti dalla richiesta bulk vengono scaricati singolarmente.
+            only_failed (bool): Riesegue solo i task falliti del job in corso.
+            dry_run (bool): Non scarica nulla: riporta solo la dimensione del piano.
+
+        Returns:
+            list: Contratti non aggiornati a causa di un errore, come (exp, strike, right, errore).
+                Con dry_run=True, il numero di task per stato.
+        """
+        return self._run_job(start_date, end_date, None, max_concurrency, max_span_days, bulk, only_failed, dry_run)
+
+
+    def fetch_intraday_option_data(self, start_date, end_date, interval_ms, max_concurrency=1, max_span_days=config.MAX_REQUEST_SPAN_DAYS, bulk=False,
+                                   only_failed=False, dry_run=False):
+        """
+        Scarica i dati intraday per le opzioni iterando su tutte le expiration e strike disponibili, evitando duplicati.
+
+        Args:
+            start_date, end_date: Intervallo di date richiesto.
+            interval_ms (int): Intervallo delle barre in millisecondi.
+            max_concurrency (int): Numero massimo di contratti scaricati in parallelo (1 = sequenziale).
+            max_span_days (int): Ampiezza massima in giorni di ogni singola richiesta.
+            bulk (bool | str): Come in fetch_daily_option_data, usando /v2/bulk_hist/option/quote.
+            only_failed, dry_run (bool): Come in fetch_daily_option_data.
+
+        Returns:
+            list: Contratti non aggiornati a causa di un errore, come (exp, strike, right, errore).
+                Con dry_run=True, il numero di task per stato.
+        """
+        return self._run_job(start_date, end_date, interval_ms, max_concurrency, max_span_days, bulk, only_failed, dry_run)
+
+
+    def _job_id(self, start_date, end_date, interval_ms=None):
+        data_type, timeframe = self._dataset_key(interval_ms)
+        return f"{self.symbol}/{data_type}/{timeframe}/{pd.Timestamp(start_date):%Y%m%d}-{pd.Timestamp(end_date):%Y%m%d}"
+
+
+    def _run_job(self, start_date, end_date, interval_ms, max_concurrency, max_span_days, bulk, only_failed, dry_run):
+        """Pianifica (o riprende) il job dell'intervallo ed esegue i task pendenti tramite la coda persistente."""
+        job = self._job_id(start_date, end_date, interval_ms)
+        if dry_run:
+            if self.job_queue.has_job(job):
+                # Sola lettura: recover() riporterebbe a pending i task in_flight di un processo ancora in esecuzione
+                counts = self.job_queue.counts(job)
+                logger.info(f"📋 Piano per {job}: {counts}", extra={"job": job, **counts})
+                return counts
+            if only_failed:
+                logger.info(f"✅ Nessun job in corso per {job}.", extra={"job": job})
+                return {}
+            # Il piano non viene salvato; con bulk il numero reale di task sarebbe minore
+            tasks = self._plan(self._collect_contracts(max_concurrency), start_date, end_date, interval_ms, max_span_days)
+            logger.info(f"📋 Piano per {job}: {len(tasks)} task.", extra={"job": job, "tasks": len(tasks)})
+            return {PENDING: len(tasks)}
+
+        job, tasks = self.prepare_job(start_date, end_date, interval_ms, max_concurrency, max_span_days, bulk, only_failed)
+
+        if self.pipeline:
+            results = self._run_pipelined(tasks, max_concurrency)
+        else:
+            results = run_tasks(self.run_task, [(task,) for task in tasks], max_concurrency)
+        return self.finish_job(job, results)
 
-        expirations = self.fetch_expirations()
-        if not expirations:
-            print("❌ Nessuna data di scadenza disponibile per questo simbolo.")
-            return
 
-        for exp in expirations:
-            strikes = self.fetch_strikes(exp)
-            if not strikes:
-                print(f"⚠️ Nessun prezzo di esercizio disponibile per la scadenza {exp}.")
+    def prepare_job(self, start_date, end_date, interval_ms=None, max_concurrency=1, max_span_days=config.MAX_REQUEST_SPAN_DAYS,
+                    bulk=False, only_failed=False):
+        """
+        Pianifica (o riprende) il job dell'intervallo nella coda persistente, senza eseguirlo.
+
+        Returns:
+            tuple: (job, task da eseguire con run_task in ordine di priorità).
+        """
+        job = self._job_id(start_date, end_date, interval_ms)
+        if self.job_queue.has_job(job):
+            recovered = self.job_queue.recover(job)
+            counts = self.job_queue.counts(job)
+            logger.info(f"♻️ Ripresa del job {job}: {counts[PENDING]} task da eseguire, {counts[FAILED]} falliti, "
+                        f"{recovered} interrotti", extra={"job": job, **counts})
+        elif only_failed:
+            logger.info(f"✅ Nessun job in corso per {job}.", extra={"job": job})
+            return job, []
+        else:
+            contracts = self._collect_contracts(max_concurrency)
+            if bulk:
+                contracts = self._bulk_ingest(contracts, start_date, end_date, interval_ms, max_concurrency, max_span_days, bulk)
+            added = self.job_queue.add_tasks(job, self._plan(contracts, start_date, end_date, interval_ms, max_span_days))
+            logger.info(f"📋 Job {job}: {added} task pianificati.", extra={"job": job, "tasks": added})
+        return job, self.job_queue.tasks(job, (FAILED,) if only_failed else (PENDING, FAILED))
+
+
+    def unfinished_sessions(self, start_date, end_date, interval_ms=None):
+        """
+        Sessioni (YYYYMMDD int) con task del job dell'intervallo ancora pending, in_flight o falliti: le
+        quote di quei giorni non sono complete e le greche calcolate in locale devono aspettare.
+        """
+        job = self._job_id(start_date, end_date, interval_ms)
+        days = set()
+        for task in self.job_queue.tasks(job, (PENDING, IN_FLIGHT, FAILED)):
+            params = task["params"]
+            days.update(pd.DatetimeIndex(trading_days(params["start_date"], params["end_date"])).strftime("%Y%m%d").astype(int))
+        return days
+
+
+    def finish_job(self, job, results):
+        """Riepiloga gli esiti (TaskResult) dei task del job e lo rimuove dalla coda se è completo."""
+        failures = self._report_failures(results)
+        counts = self.job_queue.counts(job)
+        if not (counts[PENDING] or counts[IN_FLIGHT] or counts[FAILED]):
+            # Job completato: la copertura è nel manifest, la coda conserva solo il lavoro in sospeso
+            self.job_queue.delete_job(job)
+        return failures
+
+
+    def _plan(self, contracts, start_date, end_date, interval_ms=None, max_span_days=config.MAX_REQUEST_SPAN_DAYS):
+        """
+        Task (endpoint, params, priorità) per ogni contratto e intervallo contiguo di sessioni non ancora coperto.
+
+        Con un selettore vengono pianificate solo le sessioni in cui il contratto rientra nell'universo;
+        la priorità mette in testa le scadenze vicine e, a parità di DTE, gli strike vicini al denaro.
+        """
+        endpoint = "/v2/hist/option/eod" if interval_ms is None else "/v2/hist/option/quote"
+        tasks = []
+        pruned = 0
+        for exp, strike, right in contracts:
+            missing = pd.to_datetime(self._load_contract(exp, strike, right, start_date, end_date, interval_ms), format="%Y%m%d")
+            if self.selector is not None and len(missing):
+                keep = self.selector.select(exp, strike, right, missing.values.astype("datetime64[D]"))
+                pruned += int((~keep).sum())
+                missing = missing[keep]
+            for span_start, span_end in session_spans(missing, max_span_days):
+                if self.selector is not None:
+                    priority = self.selector.priority(exp, strike, span_start)
+                else:
+                    priority = contract_priority(days_to_expiration(exp, [np.datetime64(span_start.date(), "D")])[0])
+                params = {
+                    "root": self.symbol,
+                    "exp": exp,
+                    "strike": strike,
+                    "right": right,
+                    "start_date": span_start.strftime("%Y%m%d"),
+                    "end_date": span_end.strftime("%Y%m%d")
+                }
+                if interval_ms is not None:
+                    params["ivl"] = interval_ms
+                tasks.append((endpoint, params, priority))
+        if pruned:
+            logger.info(f"✂️ Universo {self.symbol}: {pruned} sessioni-contratto escluse dal filtro DTE/moneyness.",
+                        extra={"symbol": self.symbol, "pruned": pruned})
+        return tasks
+
+
+    def _dataset_key(self, interval_ms=None):
+        """(type, timeframe) della partizione in cui vengono salvati i dati EOD o intraday."""
+        data_type = "option_eod" if interval_ms is None else "option_quote"
+        return data_type, timeframe_name(interval_ms)
+
+
+    def _load_contract(self, exp, strike, right, start_date, end_date, interval_ms=None):
+        """Sessioni (YYYYMMDD) del contratto non ancora scaricate, ricavate dal solo manifest di copertura."""
+        data_type, timeframe = self._dataset_key(interval_ms)
+        covered = self.manifest.covered(self.symbol, data_type, timeframe, contract=(exp, strike, right))
+        return list(pd.DatetimeIndex(missing_sessions(start_date, end_date, covered)).strftime("%Y%m%d"))
+
+
+    def _record_coverage(self, span_start, span_end, contracts, interval_ms=None):
+        """Registra nel manifest l'intervallo scaricato con successo (anche se senza righe) per i contratti indicati."""
+        data_type, timeframe = self._dataset_key(interval_ms)
+        self.manifest.add(self.symbol, data_type, timeframe, span_start, span_end, contracts=contracts)
+
+
+    def _save_contract(self, new_df, interval_ms=None, contract=None, name=None):
+        """Aggiunge i nuovi dati allo storage come frammenti immutabili, senza rileggere lo storico."""
+        if contract is not None:
+            new_df = new_df.assign(expiration=int(contract[0]), strike=int(contract[1]), right=contract[2])
+        data_type, timeframe = self._dataset_key(interval_ms)
+        return self.store.append(new_df.drop(columns=["root"], errors="ignore"), self.symbol, data_type, timeframe, name=name)
+
+
+    def run_task(self, task):
+        """
+        Esegue un task della coda: scarica l'intervallo del contratto, salva il frammento e registra la copertura.
+
+        Il frammento ha il nome del task, quindi rieseguire un task interrotto dopo la scrittura non duplica righe.
+        """
+        params = task["params"]
+        contract = (params["exp"], params["strike"], params["right"])
+        interval_ms = params.get("ivl")
+        fields = self._log_fields(*contract)
+        self.job_queue.start(task["id"])
+        try:
+            new_df = self.client.get_frame(task["endpoint"], params=params)
+            if new_df is not None:
+                self._save_contract(new_df, interval_ms, contract=contract, name=task["task_key"])
+                logger.debug(f"✅ Dati aggiornati salvati per {contract[0]}, {contract[1]}, {contract[2]}", extra={**fields, "rows": len(new_df)})
+            else:
+                logger.debug(f"⚠️ Nessun dato nuovo per {contract[0]}, {contract[1]}, {contract[2]}.", extra=fields)
+            self._record_coverage(params["start_date"], params["end_date"], [contract], interval_ms)
+        except Exception as e:
+            self.job_queue.fail(task["id"], e)
+            raise
+        self.job_queue.complete(task["id"])
+
+
+    def _run_pipelined(self, tasks, max_concurrency=1):
+        """
+        Esegue i task con IngestPipeline: max_concurrency thread scaricano, il pool di processi decodifica,
+        normalizza e scrive i frammenti; copertura e stato del task vengono aggiornati dopo la scrittura.
+        """
+        def request(task):
+            self.job_queue.start(task["id"])
+            params = task["params"]
+            data_type, timeframe = self._dataset_key(params.get("ivl"))
+            sink = {
+                "dataset_dir": self.store.dataset_dir(self.symbol, data_type, timeframe),
+                "kind": DATASET_KINDS.get(data_type),
+                "name": task["task_key"],
+                "assign": {"expiration": int(params["exp"]), "strike": int(params["strike"]), "right": params["right"]},
+                "drop": ["root"],
+            }
+            return task["endpoint"], params, False, sink
+
+        def written(task, result):
+            params = task["params"]
+            contract = (params["exp"], params["strike"], params["right"])
+            self._record_coverage(params["start_date"], params["end_date"], [contract], params.get("ivl"))
+            self.job_queue.complete(task["id"])
+
+        results = IngestPipeline(self.client, max_concurrency, self.processes).run(tasks, request, written)
+        for res in results:
+            if not res.ok:
+                self.job_queue.fail(res.task[0]["id"], res.error)
+        return results
+
+
+    def _bulk_ingest(self, contracts, start_date, end_date, interval_ms, max_concurrency, max_span_days, bulk):
+        """
+        Scarica le catene tramite gli endpoint bulk e restituisce i contratti da scaricare singolarmente
+        (non restituiti dalla richiesta bulk o appartenenti a una scadenza la cui richiesta bulk è fallita).
+        """
+        by_exp = {}
+        for exp, strike, right in contracts:
+            by_exp.setdefault(exp, []).append((exp, strike, right))
+
+        if bulk == "root":
+            # exp=0 -> tutte le scadenze del root in una sola richiesta per intervallo
+            groups = [(0, contracts)]
+        else:
+            groups = list(by_exp.items())
+
+        tasks = [(exp, group, start_date, end_date, interval_ms, max_span_days) for exp, group in groups]
+        results = run_tasks(self._bulk_update_chain, tasks, max_concurrency)
+
+        remaining = []
+        for res in results:
+            exp, group = res.task[0], res.task[1]
+            if not res.ok:
+                logger.warning(f"❌ Richiesta bulk fallita per la scadenza {exp}: {res.error}. Scarico i contratti singolarmente.",
+                               extra={"symbol": self.symbol, "expiration": exp})
+                remaining.extend(group)
                 continue
+            remaining.extend(contract for contract in group if contract not in res.result)
 
-            for strike in strikes:
-                for right in ['C', 'P']:
-                    file_name = f"{self.symbol}_options_intraday_{exp}_{strike}_{right}_{interval_ms}ms.parquet"
-                    file_path = os.path.join(self.options_data_dir, file_name)
-
-                    # **Verifica i dati esistenti**
-                    if os.path.exists(file_path):
-                        existing_df = pd.read_parquet(file_path)
-                        existing_timestamps = set(pd.to_datetime(existing_df["timestamp"]).strftime("%Y%m%d%H%M"))
-                    else:
-                        existing_df = pd.DataFrame()
-                        existing_timestamps = set()
-
-                    # **Trova solo i timestamp mancanti**
-                    requested_timestamps = set(pd.date_range(start_date, end_date, freq=f"{interval_ms//60000}min").strftime("%Y%m%d%H%M"))
-                    missing_timestamps = sorted(requested_timestamps - existing_timestamps)
-
-                    if not missing_timestamps:
-                        print(f"✅ I dati intraday per {exp}, {strike}, {right} sono già completi.")
-                        continue
-
-                    print(f"🔄 Scaricando dati intraday per {exp}, {strike}, {right}, date mancanti: {len(missing_timestamps)}")
-
-                    # **Scarica SOLO i dati mancanti**
-                    for timestamp in missing_timestamps:
-                        params = {
-                            "root": self.symbol,
-                            "exp": exp,
-                            "strike": strike,
-                            "right": right,
-                            "start_date": timestamp[:8],  # YYYYMMDD
-                            "end_date": timestamp[:8],  # Scarica solo un giorno alla volta
-                            "ivl": interval_ms
-                        }
-                        
-                        try:
-                            response = requests.get(f"{self.BASE_URL}/v2/hist/option/quote", params=params)
-                            response.raise_for_status()
-                        except requests.exceptions.RequestException as e:
-                            print(f"Errore nella richiesta: {e}")
-                            print(f"\tStatus Code: {response.status_code}")
-                            print(f"\tResponse Text: {response.text}")
-
-                        data = response.json().get("response", [])
-                        if data:
-                            new_df = pd.DataFrame(data)
-                            full_df = pd.concat([existing_df, new_df]).drop_duplicates().sort_values("timestamp")
-                            full_df.to_parquet(file_path, compression="zstd")
-                            print(f"✅ Dati intraday aggiornati salvati in {file_path}")
-                        else:
-                            print(f"⚠️ Nessun dato nuovo per {exp}, {strike}, {right}.")
+        logger.info(f"📦 Bulk: {len(contracts) - len(remaining)} contratti aggiornati, {len(remaining)} da scaricare singolarmente.",
+                    extra={"symbol": self.symbol, "bulk_contracts": len(contracts) - len(remaining), "remaining": len(remaining)})
+        return remaining
+
+
+    def _bulk_update_chain(self, exp, contracts, start_date, end_date, interval_ms=None, max_span_days=config.MAX_REQUEST_SPAN_DAYS):
+        """Aggiorna tutti i contratti di una scadenza (o del root se exp=0) con una richiesta bulk per intervallo."""
+        states = {}
+        for contract in contracts:
+            states[contract] = self._load_contract(*contract, start_date, end_date, interval_ms)
+
+        # Nessun dato da scaricare: tutti i contratti risultano già aggiornati
+        missing_days = set()
+        for days in states.values():
+            missing_days.update(days)
+        if not missing_days:
+            return set(states)
+
+        endpoint = "/v2/bulk_hist/option/eod" if interval_ms is None else "/v2/bulk_hist/option/quote"
+        spans = session_spans(pd.to_datetime(sorted(missing_days), format="%Y%m%d"), max_span_days)
+        frames = []
+        for span_start, span_end in spans:
+            params = {
+                "root": self.symbol,
+                "exp": exp,
+                "start_date": span_start.strftime("%Y%m%d"),
+                "end_date": span_end.strftime("%Y%m%d")
+            }
+            if interval_ms is not None:
+                params["ivl"] = interval_ms
+            frame = self.client.get_frame(endpoint, params=params, bulk=True)
+            if frame is not None:
+                frames.append(frame)
+
+        if not frames:
+            return set()
+        bulk_df = pd.concat(frames, ignore_index=True)
+
+        # Tiene solo le righe dei contratti richiesti e dei giorni a loro mancanti, poi scrive tutto in una volta
+        received = set()
+        keep = pd.Series(False, index=bulk_df.index)
+        for (contract_exp, strike, right), group in bulk_df.groupby(["expiration", "strike", "right"], sort=False):
+            contract = (contract_exp, strike, right)
+            if contract not in states:
+                continue
+            keep[group.index] = group["date"].astype(str).isin(states[contract])
+            received.add(contract)
+
+        if keep.any():
+            # Nome deterministico (simbolo, scadenza, intervallo, timeframe): ripetere la richiesta bulk
+            # interrotta prima della registrazione della copertura sovrascrive il frammento invece di duplicarlo
+            name_params = {"root": self.symbol, "exp": exp, "start_date": spans[0][0].strftime("%Y%m%d"),
+                           "end_date": spans[-1][1].strftime("%Y%m%d"), "ivl": interval_ms}
+            self._save_contract(bulk_df[keep], interval_ms, name=task_key(endpoint, name_params))
+        # La risposta bulk copre l'intera catena: i contratti ricevuti risultano scaricati su tutti gli intervalli
+        for span_start, span_end in spans:
+            self._record_coverage(span_start, span_end, sorted(received), interval_ms)
+        return received
@@ -0,0 +1,175 @@
+import logging
+import threading
+
+import config
+from utils.concurrency import TaskResult, interleave, run_tasks
+from utils.resample import can_resample, resample_order
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateOrchestrator:
+    """
+    Aggiorna più simboli insieme con un solo ThetaDataFetcher: client HTTP (pool di connessioni e rate
+    limit), manifest, cache dei metadati e coda dei job sono condivisi da tutti i simboli.
+
+    Per ogni timeframe il lavoro di tutti i simboli viene pianificato insieme ed eseguito in fasi
+    (ricampionamento locale, underlying, pianificazione dei contratti, contratti + greche); i task dei diversi simboli vengono
+    alternati nello stesso pool di thread, così il terminale resta sempre occupato e nessun simbolo
+    monopolizza il budget di richieste. Un errore su un simbolo non ferma gli altri.
+
+    Esempio:
+        fetcher = ThetaDataFetcher(username, password, None)
+        summaries = UpdateOrchestrator(fetcher, ["SPY", "QQQ", "SPX"]).run(["daily", "1minute"])
+    """
+
+    def __init__(self, fetcher, symbols, max_concurrency=config.ORCHESTRATOR_MAX_CONCURRENCY):
+        self.fetcher = fetcher
+        self.symbols = list(dict.fromkeys(symbols))
+        self.max_concurrency = max_concurrency
+        self.summaries = {}
+        self._lock = threading.Lock()
+
+    def run(self, selected_timeframes, recent_only=True):
+        """
+        Aggiorna underlying, opzioni e greche di tutti i simboli per i timeframe indicati.
+
+        Args:
+            selected_timeframes (list): Timeframe da aggiornare.
+            recent_only (bool): Come in ThetaDataFetcher.update_data.
+
+        Returns:
+            dict: simbolo -> {"status": "ok" | "partial" | "failed", "tasks", "done", "failed",
+                "failures": [(timeframe, fase, dettaglio, errore)]}.
+        """
+        self.summaries = {symbol: {"status": "ok", "tasks": 0, "done": 0, "failed": 0, "failures": []} for symbol in self.symbols}
+
+        workers = {}
+        for res in run_tasks(self._start_worker, [(symbol,) for symbol in self.symbols], self.max_concurrency):
+            if res.ok:
+                workers[res.task[0]] = res.result
+            else:
+                self._fail(res.task[0], None, "setup", res.task[0], res.error)
+
+        for timeframe in resample_order(selected_timeframes):
+            logger.info(f"🔄 Updating {len(workers)} symbols for timeframe: {timeframe}", extra={"timeframe": timeframe, "symbols": len(workers)})
+            self._run_timeframe(timeframe, workers, recent_only)
+
+        for symbol, summary in self.summaries.items():
+            if summary["failed"]:
+                summary["status"] = "partial" if summary["done"] else "failed"
+            message = f"{symbol}: {summary['done']}/{summary['tasks']} task completati, {summary['failed']} falliti"
+            if summary["status"] == "ok":
+                logger.info(f"✅ {message}", extra={"symbol": symbol, **{k: summary[k] for k in ("status", "tasks", "done", "failed")}})
+            else:
+                logger.warning(f"⚠️ {message}", extra={"symbol": symbol, **{k: summary[k] for k in ("status", "tasks", "done", "failed")}})
+        logger.info(f"📊 {self.fetcher.metrics.summary()}")
+        return self.summaries
+
+    def _start_worker(self, symbol):
+        """Fetcher del simbolo, (tipo, fetcher, store) dell'underlying e sessioni disponibili."""
+        worker = self.fetcher.for_symbol(symbol)
+        underlying = worker._underlying()
+        return worker, underlying, worker._date_range(underlying[0])
+
+    def _run_timeframe(self, timeframe, workers, recent_only):
+        # 1. Sessioni già presenti a 1 minuto ricampionate in locale (nessuna richiesta): i piani le escludono
+        if config.RESAMPLE_ENABLED and can_resample(timeframe):
+            self._execute(timeframe, [(symbol, "resample", timeframe, worker._resample_timeframe, (timeframe, underlying, date_range))
+                                      for symbol, (worker, underlying, date_range) in workers.items()])
+
+        # 2. Piani dal solo manifest (nessuna richiesta)
+        plans = {}
+        for symbol, (worker, underlying, date_range) in workers.items():
+            try:
+                plans[symbol] = worker._plan_timeframe(timeframe, underlying, date_range, recent_only)
+            except Exception as e:
+                self._fail(symbol, timeframe, "plan", timeframe, e)
+
+        # 3. Underlying di tutti i simboli: serve alla selezione dei contratti e al join delle greche
+        self._execute(timeframe, interleave(
+            [(symbol, "underlying", _span_label(span), workers[symbol][0]._update_underlying_span, (plan, *span))
+             for span in plan["missing_underlying"]]
+            for symbol, plan in plans.items()
+        ))
+
+        # 4. Job delle opzioni (liste di scadenze e strike), un simbolo per thread
+        prepared = run_tasks(self._prepare_options, [(workers[symbol][0], plan) for symbol, plan in plans.items()], self.max_concurrency)
+
+        # 5. Contratti e greche di tutti i simboli alternati nello stesso pool; le greche calcolate in locale
+        #    leggono le quote salvate, quindi vengono eseguite in una fase successiva (6)
+        local_greeks = config.GREEKS_SOURCE == "local"
+        groups, greeks_groups, jobs = [], [], {}
+        for res in prepared:
+            worker, plan = res.task
+            symbol = worker.symbol
+            units = [(symbol, "greeks", _span_label(span), worker._update_greeks_span, (plan, *span)) for span in plan["missing_greeks"]]
+            if local_greeks:
+                # Senza job delle opzioni le quote non sono state scaricate: le greche restano da calcolare
+                greeks_groups.append(units if res.ok else [])
+                units = []
+            if res.ok:
+                job, tasks = res.result
+                jobs[symbol] = (worker, job)
+                units += [(symbol, "options", _task_label(task), worker.options_fetcher.run_task, (task,)) for task in tasks]
+            else:
+                self._fail(symbol, timeframe, "options", "plan", res.error)
+            groups.append(units)
+        results = self._execute(timeframe, interleave(groups))
+
+        for symbol, (worker, job) in jobs.items():
+            option_results = [TaskResult(res.task[4], error=res.error) for res in results
+                              if res.task[0] == symbol and res.task[1] == "options"]
+            worker.options_fetcher.finish_job(job, option_results)
+
+        # 6. Greche calcolate in locale, dopo che le quote di tutti i simboli sono state salvate
+        self._execute(timeframe, interleave(greeks_groups))
+
+    def _prepare_options(self, worker, plan):
+        worker._select_universe(plan)
+        return worker.options_fetcher.prepare_job(plan["start_date"], plan["last_date"], plan["interval_ms"])
+
+    def _execute(self, timeframe, units):
+        """Esegue le unità (symbol, fase, dettaglio, funzione, argomenti) nel pool condiviso e aggiorna i riepiloghi."""
+        if not units:
+            return []
+        progress = {"done": 0}
+        step = max(1, len(units) // 10)
+
+        def run(symbol, stage, detail, func, args):
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    progress["done"] += 1
+                    done = progress["done"]
+                if done % step == 0 or done == len(units):
+                    logger.info(f"⏳ {timeframe}: {done}/{len(units)} task", extra={"timeframe": timeframe, "done": done, "total": len(units)})
+
+        results = run_tasks(run, units, self.max_concurrency)
+        for res in results:
+            symbol, stage, detail = res.task[:3]
+            summary = self.summaries[symbol]
+            summary["tasks"] += 1
+            if res.ok:
+                summary["done"] += 1
+            else:
+                self._fail(symbol, timeframe, stage, detail, res.error)
+        return results
+
+    def _fail(self, symbol, timeframe, stage, detail, error):
+        with self._lock:
+            summary = self.summaries[symbol]
+            summary["failed"] += 1
+            summary["failures"].append((timeframe, stage, detail, str(error)))
+        logger.debug(f"❌ {symbol} {timeframe} {stage} {detail}: {error}",
+                     extra={"symbol": symbol, "timeframe": timeframe, "stage": stage})
+
+
+def _span_label(span):
+    return f"{span[0]:%Y%m%d}-{span[1]:%Y%m%d}"
+
+
+def _task_label(task):
+    params = task["params"]
+    return f"{params['exp']} {params['strike']} {params['right']} {params['start_date']}-{params['end_date']}"
@@ -1,13 +1,18 @@
-import requests
 import os
 import pandas as pd
 
+import config
+from utils.http_client import get_default_client
+
 class FetchStock:
-    BASE_URL = "http://127.0.0.1:25510"
+    BASE_URL = config.BASE_URL
 
-    def __init__(self, symbol, stock_data_dir):
+    def __init__(self, symbol, stock_data_dir, base_url=BASE_URL, client=None):
         self.symbol = symbol
         self.stock_data_dir = stock_data_dir
+        self.base_url = base_url
+        self.client = client or get_default_client(base_url)
+        self.metrics = self.client.metrics
         os.makedirs(self.stock_data_dir, exist_ok=True)
 
     def fetch_daily_stock_data(self, start_date, end_date):
@@ -17,11 +22,7 @@ class FetchStock:
             "start_date": start_date.strftime("%Y%m%d"),
             "end_date": end_date.strftime("%Y%m%d")
         }
-        response = requests.get(f"{self.base_url}/v2/hist/stock/eod", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/hist/stock/eod", params=params)
     
 
     def fetch_intraday_stock_data(self, start_date, end_date, interval_ms):
@@ -32,11 +33,7 @@ class FetchStock:
             "end_date": end_date.strftime("%Y%m%d"),
             "ivl": interval_ms
         }
-        response = requests.get(f"{self.base_url}/v2/hist/stock/ohlc", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/hist/stock/ohlc", params=params)
     
     
     def fetch_intraday_underlying_data(self, start_date, end_date, interval_ms):
@@ -47,11 +44,7 @@ class FetchStock:
             "end_date": end_date.strftime("%Y%m%d"),
             "ivl": interval_ms
         }
-        response = requests.get(f"{self.BASE_URL}/v2/hist/stock/ohlc", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/hist/stock/ohlc", params=params)
     
     
     def fetch_daily_underlying_data(self, start_date, end_date):
@@ -61,10 +54,6 @@ class FetchStock:
             "start_date": start_date.strftime("%Y%m%d"),
             "end_date": end_date.strftime("%Y%m%d")
         }
-        response = requests.get(f"{self.BASE_URL}/v2/hist/stock/eod", params=params)
-        response.raise_for_status()
-
-        data = response.json().get("response", [])
-        return pd.DataFrame(data) if data else None
+        return self.client.get_frame("/v2/hist/stock/eod", params=params)
 
 
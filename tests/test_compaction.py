@@ -0,0 +1,41 @@
+import pandas as pd
+
+import utils.compaction as compaction
+from utils.compaction import compact_dataset
+from utils.storage import DatasetStore
+
+
+def _quotes(bid):
+    return pd.DataFrame({
+        "date": [20240102], "expiration": [20240119], "strike": [470000], "right": ["C"],
+        "ms_of_day": [34200000], "bid": [bid], "ask": [bid + 0.05],
+    })
+
+
+def test_late_fragment_survives_next_compaction(tmp_path, monkeypatch):
+    store = DatasetStore(str(tmp_path))
+    store.append(_quotes(1.0), "SPY", "option_quote", "1minute")
+    store.append(_quotes(2.0), "SPY", "option_quote", "1minute")
+    dataset_dir = store.dataset_dir("SPY", "option_quote", "1minute")
+
+    # Un frammento scritto durante la compattazione (dopo la lettura degli input) viene spostato nella
+    # nuova partizione con la sua data di modifica, più vecchia di quella del file compattato
+    upsert_runs = compaction.upsert_runs
+
+    def upsert_runs_with_late_write(runs, key):
+        store.append(_quotes(3.0), "SPY", "option_quote", "1minute")
+        return upsert_runs(runs, key)
+
+    monkeypatch.setattr(compaction, "upsert_runs", upsert_runs_with_late_write)
+    first = compact_dataset(dataset_dir)
+    monkeypatch.setattr(compaction, "upsert_runs", upsert_runs)
+    assert first["files_after"] == 2
+    assert first["rows_replaced"] == 1
+
+    second = compact_dataset(dataset_dir)
+    assert second["partitions_compacted"] == 1
+    assert second["rows_replaced"] == 1
+
+    df = store.query("SPY", "option_quote", "1minute", output="scanner").to_table().to_pandas()
+    assert len(df) == 1
+    assert df["bid"].iloc[0] == 3.0
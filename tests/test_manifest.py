@@ -0,0 +1,25 @@
+import pandas as pd
+
+from utils.manifest import NO_CONTRACT, CoverageManifest
+from utils.storage import DatasetStore
+
+
+def test_rebuild_keeps_underlying_coverage_from_other_roots(tmp_path):
+    options_dir, stock_dir = tmp_path / "options", tmp_path / "stock"
+    DatasetStore(str(options_dir)).append(pd.DataFrame({
+        "date": [20240102], "expiration": [20240119], "strike": [470000], "right": ["C"],
+        "open": [1.0], "high": [1.0], "low": [1.0], "close": [1.0], "volume": [1], "count": [1],
+    }), "SPY", "option_eod", "daily")
+    DatasetStore(str(stock_dir)).append(pd.DataFrame({
+        "date": [20240102, 20240103], "ms_of_day": [0, 0],
+        "open": [470.0, 471.0], "high": [471.0, 472.0], "low": [469.0, 470.0], "close": [470.5, 471.5],
+        "volume": [100, 100], "count": [10, 10],
+    }), "SPY", "stock", "daily")
+
+    manifest = CoverageManifest(str(options_dir / "coverage.sqlite"))
+    assert manifest.rebuild([str(options_dir), str(stock_dir)]) == 3
+
+    assert manifest.covered("SPY", "option_eod", "daily", (20240119, 470000, "C")) == [
+        (pd.Timestamp("2024-01-02"), pd.Timestamp("2024-01-02"))]
+    assert manifest.covered("SPY", "stock", "daily", NO_CONTRACT) == [
+        (pd.Timestamp("2024-01-02"), pd.Timestamp("2024-01-03"))]
@@ -0,0 +1,284 @@
+import argparse
+import inspect
+import logging
+import os
+import shutil
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import config
+from utils.metrics import get_default_metrics
+from utils.schema import PRIMARY_KEYS, primary_key, read_schema_info
+from utils.storage import fragment_sequence, write_fragment
+from utils.upsert import upsert_runs
+
+logger = logging.getLogger(__name__)
+
+# Ordinamento delle righe dentro una partizione date= (la data è costante nella partizione)
+SORT_COLUMNS = ("expiration", "strike", "right", "ms_of_day")
+# Colonne chiave: dictionary encoding, ed eventualmente bloom filter sulle prime due
+KEY_COLUMNS = ("root", "expiration", "strike", "right")
+BLOOM_FILTER_COLUMNS = ("expiration", "strike")
+
+COMPACTED_METADATA_KEY = b"thetadata.compacted"
+
+# I bloom filter in scrittura richiedono una versione recente di pyarrow
+_BLOOM_FILTERS_SUPPORTED = "bloom_filter_options" in inspect.signature(pq.write_table).parameters
+
+
+def _fragment_entries(partition_dir):
+    """Frammenti Parquet visibili di una partizione (i file nascosti sono scritture in corso)."""
+    return sorted(
+        (entry for entry in os.scandir(partition_dir)
+         if entry.is_file() and entry.name.endswith(".parquet") and not entry.name.startswith((".", "_"))),
+        key=lambda entry: entry.name,
+    )
+
+
+def _staging_path(partition_dir, suffix):
+    parent, name = os.path.split(partition_dir.rstrip(os.sep))
+    return os.path.join(parent, f".{name}.{suffix}")
+
+
+def _is_compacted(path):
+    return COMPACTED_METADATA_KEY in (pq.read_metadata(path).metadata or {})
+
+
+def _sort(table):
+    """Ordina la tabella per SORT_COLUMNS (le colonne dictionary vengono confrontate come stringhe)."""
+    columns = [column for column in SORT_COLUMNS if column in table.column_names]
+    if not columns:
+        return table, []
+    keys = pa.table({
+        column: table[column].cast(pa.string()) if pa.types.is_dictionary(table[column].type) else table[column]
+        for column in columns
+    })
+    indices = pc.sort_indices(keys, sort_keys=[(column, "ascending") for column in columns])
+    return table.take(indices), columns
+
+
+def recover(dataset_dir):
+    """
+    Ripristina le partizioni lasciate a metà da una compattazione interrotta: le cartelle in
+    preparazione vengono eliminate e, se lo scambio non è stato completato, la partizione originale
+    torna al suo posto.
+    """
+    if not os.path.isdir(dataset_dir):
+        return
+    for entry in os.scandir(dataset_dir):
+        if not entry.is_dir() or not entry.name.startswith("."):
+            continue
+        if entry.name.endswith(".compacting"):
+            shutil.rmtree(entry.path, ignore_errors=True)
+        elif entry.name.endswith(".old"):
+            original = os.path.join(dataset_dir, entry.name[1:-len(".old")])
+            if os.path.exists(original):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.replace(entry.path, original)
+                logger.warning(f"♻️ Partizione ripristinata dopo una compattazione interrotta: {original}")
+
+
+def compact_partition(partition_dir, row_group_size=config.COMPACTION_ROW_GROUP_SIZE,
+                      max_rows_per_file=config.COMPACTION_MAX_ROWS_PER_FILE, bloom_filters=config.COMPACTION_BLOOM_FILTERS,
+                      deduplicate=config.COMPACTION_DEDUPLICATE, force=False):
+    """
+    Compatta i frammenti di una partizione date= in pochi file grandi ordinati per SORT_COLUMNS.
+
+    Con deduplicate i frammenti vengono fusi per chiave primaria (utils.upsert) in ordine di scrittura
+    (sequenza nel footer, vedi utils.storage.SEQUENCE_METADATA_KEY; i file compattati ricevono la più
+    alta tra quelle dei frammenti fusi): per ogni chiave resta la riga del frammento più recente, così un dato corretto (es. riscaricato)
+    sostituisce quello vecchio. Vale solo per i frammenti con lo schema canonico nel footer.
+
+    I nuovi file vengono scritti in una cartella nascosta accanto alla partizione, che viene poi
+    scambiata con quella originale con due rename; i frammenti comparsi nel frattempo vengono
+    spostati nella nuova partizione. Il numero di righe scritte viene verificato contro quello dei
+    frammenti originali, meno quelle sostituite, prima dello scambio. Non va eseguita mentre un aggiornamento scrive nella
+    stessa partizione.
+
+    Args:
+        row_group_size (int): Righe per row group.
+        max_rows_per_file (int): Righe massime per file compattato.
+        bloom_filters (bool): Bloom filter su expiration e strike (se supportati da pyarrow).
+        deduplicate (bool): Una riga per chiave primaria, con l'ultima scrittura che vince.
+        force (bool): Riscrive anche le partizioni con un solo file non ancora compattato.
+
+    Returns:
+        dict | None: files_before, files_after, bytes_before, bytes_after, rows, rows_replaced (righe
+            sostituite da un frammento più recente o duplicate); None se la partizione non ha bisogno di compattazione.
+    """
+    entries = _fragment_entries(partition_dir)
+    if not entries or (len(entries) == 1 and (not force or _is_compacted(entries[0].path))):
+        return None
+
+    inputs = {entry.name for entry in entries}
+    bytes_before = sum(entry.stat().st_size for entry in entries)
+    rows_before = sum(pq.read_metadata(entry.path).num_rows for entry in entries)
+    kind, _ = read_schema_info(entries[0].path)
+    rows_replaced = 0
+
+    with get_default_metrics().timer("compact", rows=rows_before, nbytes=bytes_before):
+        # I frammenti della stessa partizione hanno lo stesso schema; i metadati (kind, versione) vengono dal primo
+        tables = [pq.ParquetFile(entry.path).read() for entry in entries]
+        sequences = [fragment_sequence(entry.path, table.schema.metadata or {}) for entry, table in zip(entries, tables)]
+        key = primary_key(kind, tables[0].column_names) if deduplicate and kind in PRIMARY_KEYS else ()
+        if key:
+            # Ordine di scrittura: sequenza del frammento (a parità, il nome)
+            order = sorted(range(len(entries)), key=lambda i: (sequences[i], entries[i].name))
+            table, stats = upsert_runs([tables[i] for i in order], key)
+            table = table.replace_schema_metadata(tables[0].schema.metadata)
+            rows_replaced = stats["replaced"] + stats["dropped"]
+            sort_columns = [column for column in SORT_COLUMNS if column in table.column_names]
+        else:
+            table, sort_columns = _sort(pa.concat_tables(tables, promote_options="permissive"))
+        metadata = dict(table.schema.metadata or {})
+        metadata[COMPACTED_METADATA_KEY] = b"1"
+        table = table.replace_schema_metadata(metadata)
+
+        options = {
+            "row_group_size": row_group_size,
+            "use_dictionary": [column for column in KEY_COLUMNS if column in table.column_names],
+            "write_page_index": True,
+            "sorting_columns": [pq.SortingColumn(table.column_names.index(column)) for column in sort_columns],
+        }
+        if bloom_filters and _BLOOM_FILTERS_SUPPORTED:
+            options["bloom_filter_options"] = {
+                column: {"ndv": max(1, pc.count_distinct(table[column]).as_py()), "fpp": 0.05}
+                for column in BLOOM_FILTER_COLUMNS if column in table.column_names
+            }
+        elif bloom_filters:
+            logger.warning("⚠️ Questa versione di pyarrow non scrive bloom filter: compattazione senza.")
+
+        staged_dir = _staging_path(partition_dir, "compacting")
+        shutil.rmtree(staged_dir, ignore_errors=True)
+        try:
+            paths = [
+                write_fragment(staged_dir, table.slice(offset, max_rows_per_file), name=f"compacted-{uuid.uuid4().hex}",
+                               sequence=max(sequences), **options)
+                for offset in range(0, max(table.num_rows, 1), max_rows_per_file)
+            ]
+            rows_after = sum(pq.read_metadata(path).num_rows for path in paths)
+            if rows_after != rows_before - rows_replaced:
+                raise ValueError(f"Compattazione di {partition_dir}: {rows_after} righe scritte invece di {rows_before - rows_replaced}.")
+            bytes_after = sum(os.path.getsize(path) for path in paths)
+
+            old_dir = _staging_path(partition_dir, "old")
+            os.replace(partition_dir, old_dir)
+            os.replace(staged_dir, partition_dir)
+        except Exception:
+            shutil.rmtree(staged_dir, ignore_errors=True)
+            raise
+
+        # Frammenti scritti durante la compattazione: restano nella partizione
+        late = [entry for entry in _fragment_entries(old_dir) if entry.name not in inputs]
+        for entry in late:
+            os.replace(entry.path, os.path.join(partition_dir, entry.name))
+        shutil.rmtree(old_dir)
+
+    return {
+        "files_before": len(entries),
+        "files_after": len(paths) + len(late),
+        "bytes_before": bytes_before,
+        "bytes_after": bytes_after,
+        "rows": rows_after,
+        "rows_replaced": rows_replaced,
+    }
+
+
+def compact_dataset(dataset_dir, start=None, end=None, **options):
+    """
+    Compatta le partizioni date= di un dataset (symbol/type/timeframe) comprese in [start, end] (YYYYMMDD).
+
+    Solo le partizioni con più di un frammento vengono riscritte, quindi ripetere la compattazione
+    dopo un aggiornamento tocca solo le date a cui sono stati aggiunti dati.
+
+    Returns:
+        dict: Riepilogo (partizioni compattate/saltate, file, byte prima e dopo, byte risparmiati, righe verificate).
+    """
+    recover(dataset_dir)
+    report = _empty_report()
+    if not os.path.isdir(dataset_dir):
+        return report
+    for entry in sorted(os.scandir(dataset_dir), key=lambda entry: entry.name):
+        if not entry.is_dir() or not entry.name.startswith("date="):
+            continue
+        day = int(entry.name[len("date="):])
+        if (start is not None and day < int(start)) or (end is not None and day > int(end)):
+            continue
+        try:
+            result = compact_partition(entry.path, **options)
+        except Exception as e:
+            logger.error(f"❌ Compattazione fallita per {entry.path}: {e}", extra={"partition": entry.path})
+            report["failed"] += 1
+            continue
+        if result is None:
+            report["partitions_skipped"] += 1
+            continue
+        report["partitions_compacted"] += 1
+        for key, value in result.items():
+            report[key] += value
+    report["bytes_saved"] = report["bytes_before"] - report["bytes_after"]
+    return report
+
+
+def compact_store(root_dir, symbols=None, data_types=None, timeframes=None, **options):
+    """
+    Compatta tutti i dataset di uno storage DatasetStore ({root}/symbol=/type=/timeframe=/date=),
+    eventualmente limitati ai simboli, tipi e timeframe indicati.
+    """
+    report = _empty_report()
+    for symbol_dir in _subdirs(root_dir, "symbol", symbols):
+        for type_dir in _subdirs(symbol_dir, "type", data_types):
+            for timeframe_dir in _subdirs(type_dir, "timeframe", timeframes):
+                result = compact_dataset(timeframe_dir, **options)
+                if result["partitions_compacted"] or result["failed"]:
+                    logger.info(f"🗜️ {os.path.relpath(timeframe_dir, root_dir)}: {result['partitions_compacted']} partizioni, "
+                                f"{result['files_before']} -> {result['files_after']} file, "
+                                f"{result['bytes_saved'] / 2**20:.1f} MB risparmiati, {result['rows_replaced']} righe sostituite",
+                                extra={"dataset": timeframe_dir, **result})
+                for key, value in result.items():
+                    report[key] += value
+    return report
+
+
+def _subdirs(directory, key, values=None):
+    if not os.path.isdir(directory):
+        return []
+    prefix = f"{key}="
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_dir() and entry.name.startswith(prefix) and (values is None or entry.name[len(prefix):] in values)
+    )
+
+
+def _empty_report():
+    return dict.fromkeys(("partitions_compacted", "partitions_skipped", "failed", "files_before", "files_after",
+                          "bytes_before", "bytes_after", "bytes_saved", "rows", "rows_replaced"), 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compatta i frammenti Parquet dello storage in file grandi e ordinati.")
+    parser.add_argument("root_dir", help="Cartella radice dello storage (symbol=/type=/timeframe=/date=).")
+    parser.add_argument("--symbol", action="append", help="Simbolo da compattare (ripetibile; default: tutti).")
+    parser.add_argument("--type", action="append", dest="data_types", help="Tipo di dato (ripetibile; default: tutti).")
+    parser.add_argument("--timeframe", action="append", help="Timeframe (ripetibile; default: tutti).")
+    parser.add_argument("--row-group-size", type=int, default=config.COMPACTION_ROW_GROUP_SIZE)
+    parser.add_argument("--bloom-filters", action="store_true", default=config.COMPACTION_BLOOM_FILTERS)
+    parser.add_argument("--keep-duplicates", action="store_false", dest="deduplicate", default=config.COMPACTION_DEDUPLICATE,
+                        help="Non fonde le righe con la stessa chiave primaria.")
+    parser.add_argument("--force", action="store_true", help="Riscrive anche le partizioni con un solo file.")
+    args = parser.parse_args()
+
+    report = compact_store(args.root_dir, args.symbol, args.data_types, args.timeframe, row_group_size=args.row_group_size,
+                           bloom_filters=args.bloom_filters, deduplicate=args.deduplicate, force=args.force)
+    print(f"✅ {report['partitions_compacted']} partizioni compattate ({report['partitions_skipped']} già compatte, "
+          f"{report['failed']} fallite): {report['files_before']} -> {report['files_after']} file, "
+          f"{report['bytes_before'] / 2**20:.1f} -> {report['bytes_after'] / 2**20:.1f} MB "
+          f"({report['bytes_saved'] / 2**20:.1f} MB risparmiati), {report['rows']} righe verificate, "
+          f"{report['rows_replaced']} sostituite.")
+
+
+if __name__ == "__main__":
+    main()
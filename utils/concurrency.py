@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskResult:
+    """Esito di un singolo task: il task originale, il risultato oppure l'eccezione sollevata."""
+
+    __slots__ = ("task", "result", "error")
+
+    def __init__(self, task, result=None, error=None):
+        self.task = task
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _run_one(worker, task):
+    try:
+        return TaskResult(task, result=worker(*task))
+    except Exception as e:
+        return TaskResult(task, error=e)
+
+
+def run_tasks(worker, tasks, max_concurrency=1):
+    """
+    Runs worker(*task) for every task with at most max_concurrency calls in flight.
+
+    Results are returned in the same order as tasks. An exception raised by a single
+    task is captured in its TaskResult instead of stopping the whole run.
+    """
+    tasks = list(tasks)
+    if max_concurrency is None or max_concurrency <= 1:
+        return [_run_one(worker, task) for task in tasks]
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        return list(executor.map(lambda task: _run_one(worker, task), tasks))
+
+
+def interleave(groups):
+    """Round-robin merge of several task lists: one task from each list in turn, preserving each list's order."""
+    groups = [list(group) for group in groups]
+    merged = []
+    for i in range(max((len(group) for group in groups), default=0)):
+        merged.extend(group[i] for group in groups if i < len(group))
+    return merged
@@ -0,0 +1,183 @@
+import codecs
+import json
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+# Fine dell'array `response` per righe piatte: chiusura dell'ultima riga seguita dalla chiusura dell'array
+_END_OF_ROWS = re.compile(r"\]\s*\]")
+_WHITESPACE = " \t\r\n"
+
+# Colonne aggiunte alle righe di una risposta bulk, prese dall'oggetto `contract`
+CONTRACT_FIELDS = ("root", "expiration", "strike", "right")
+
+
+class ColumnBuffers:
+    """Accumula le colonne come blocchi NumPy tipizzati, un blocco per porzione di risposta decodificata."""
+
+    def __init__(self):
+        self.blocks = []        # blocchi per posizione di colonna
+        self.extra = {}         # colonne aggiuntive (es. campi del contratto) per nome
+        self.rows = 0
+
+    def add_rows(self, rows, extra=None):
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        while len(self.blocks) < len(columns):
+            self.blocks.append([])
+        for position, values in enumerate(columns):
+            self.blocks[position].append(np.asarray(values))
+        for name, value in (extra or {}).items():
+            self.extra.setdefault(name, []).append(np.full(len(rows), value))
+        self.rows += len(rows)
+
+    def to_arrays(self, names=None):
+        names = list(names or [])
+        arrays = {}
+        for position, blocks in enumerate(self.blocks):
+            name = names[position] if position < len(names) else position
+            arrays[name] = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        for name, blocks in self.extra.items():
+            arrays[name] = np.concatenate(blocks)
+        return arrays
+
+
+class _Stream:
+    """Testo decodificato in modo incrementale da un iteratore di chunk di byte."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.eof = False
+
+    def fill(self):
+        """Aggiunge il chunk successivo al buffer; False se lo stream è terminato."""
+        for chunk in self._chunks:
+            if chunk:
+                self.buf += self._decoder.decode(chunk)
+                return True
+        if not self.eof:
+            self.buf += self._decoder.decode(b"", final=True)
+            self.eof = True
+        return False
+
+    def skip(self, chars=_WHITESPACE):
+        """Salta i caratteri indicati, leggendo altri chunk se serve; restituisce il primo carattere utile."""
+        while True:
+            stripped = self.buf.lstrip(chars)
+            self.buf = stripped
+            if stripped:
+                return stripped[0]
+            if not self.fill():
+                raise ValueError("Risposta JSON troncata.")
+
+    def expect(self, char):
+        if self.skip() != char:
+            raise ValueError(f"JSON non valido: atteso {char!r}, trovato {self.buf[:20]!r}")
+        self.buf = self.buf[1:]
+
+    def value(self):
+        """Decodifica il prossimo valore JSON completo, leggendo altri chunk finché non è disponibile."""
+        self.skip()
+        decoder = json.JSONDecoder()
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf)
+                self.buf = self.buf[end:]
+                return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                # Ritenta solo dopo aver raddoppiato il buffer, per non ri-decodificare un valore grande a ogni chunk
+                target = 2 * len(self.buf)
+                while len(self.buf) < target and self.fill():
+                    pass
+
+
+def _read_flat_rows(stream, buffers):
+    """Legge l'array `response` di righe piatte ([v1, v2, ...]) a blocchi, senza costruire l'intera lista."""
+    stream.expect("[")
+    while True:
+        if stream.skip(_WHITESPACE + ",") == "]":
+            stream.buf = stream.buf[1:]
+            return
+        end = _END_OF_ROWS.search(stream.buf)
+        if end:
+            buffers.add_rows(json.loads("[" + stream.buf[:end.start() + 1] + "]"))
+            stream.buf = stream.buf[end.end():]
+            return
+        # Tutte le righe complete presenti nel buffer (le righe sono piatte: l'ultima `]` chiude una riga)
+        last = stream.buf.rfind("]")
+        if last == -1:
+            if not stream.fill():
+                raise ValueError("Risposta JSON troncata.")
+            continue
+        buffers.add_rows(json.loads("[" + stream.buf[:last + 1] + "]"))
+        stream.buf = stream.buf[last + 1:]
+
+
+def _read_bulk_items(stream, buffers):
+    """Legge l'array `response` di una risposta bulk: un oggetto {"contract": ..., "ticks": [...]} per contratto."""
+    stream.expect("[")
+    while True:
+        if stream.skip(_WHITESPACE + ",") == "]":
+            stream.buf = stream.buf[1:]
+            return
+        item = stream.value()
+        contract = item.get("contract") or item.get("ticker") or {}
+        buffers.add_rows(item.get("ticks", []), {key: contract.get(key) for key in CONTRACT_FIELDS})
+
+
+def decode_stream(chunks, bulk=False):
+    """
+    Decodifica una risposta del terminale ({"header": {...}, "response": [...]}) da un iteratore di byte.
+
+    Returns:
+        tuple: (header, dict nome colonna -> np.ndarray). I nomi vengono da header.format.
+    """
+    stream = _Stream(chunks)
+    buffers = ColumnBuffers()
+    header = {}
+    stream.expect("{")
+    while stream.skip(_WHITESPACE + ",") != "}":
+        key = stream.value()
+        stream.expect(":")
+        if key == "response":
+            if stream.skip() == "[":
+                (_read_bulk_items if bulk else _read_flat_rows)(stream, buffers)
+            else:
+                stream.value()
+        elif key == "header":
+            header = stream.value() or {}
+        else:
+            stream.value()
+    return header, buffers.to_arrays(header.get("format"))
+
+
+def decode_response(response, bulk=False, as_arrow=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Decodifica in streaming una risposta HTTP del terminale (richiesta con stream=True).
+
+    Il corpo viene letto a chunk e ogni porzione di righe finisce direttamente in colonne NumPy
+    tipizzate, quindi il picco di memoria resta vicino alla dimensione finale delle colonne.
+
+    Args:
+        response: requests.Response.
+        bulk (bool): True per gli endpoint /v2/bulk_hist/*, le cui righe vengono affiancate dalle colonne
+            del contratto (root, expiration, strike, right).
+        as_arrow (bool): Se True restituisce una pyarrow.Table invece di un DataFrame.
+
+    Returns:
+        pd.DataFrame | pa.Table | None: None se la risposta non contiene righe.
+    """
+    _, arrays = decode_stream(response.iter_content(chunk_size=chunk_size), bulk=bulk)
+    if not arrays or len(next(iter(arrays.values()))) == 0:
+        return None
+    if as_arrow:
+        return pa.table({str(name): values for name, values in arrays.items()})
+    return pd.DataFrame(arrays, copy=False)
@@ -0,0 +1,230 @@
+import math
+import numpy as np
+import pandas as pd
+
+import config
+from utils.merge_data import iter_joined_days
+from utils.metrics import get_default_metrics
+from utils.trading_calendar import MS_PER_DAY, session_bounds
+
+# Calcolo locale (Black-Scholes-Merton, tasso e dividend yield continui) di volatilità implicita e
+# greche di primo, secondo e terzo ordine a partire dalle quote salvate e dal prezzo dell'underlying.
+# Unità: volatilità, tassi e tempo in frazioni annue (365 giorni); theta, charm, veta e color per
+# anno e con il segno dello scorrere del tempo (-d/dT, come theta); vega, vanna, vomma, zomma e
+# ultima per 1.0 di volatilità; rho ed epsilon per 1.0 di tasso.
+
+_SQRT2 = math.sqrt(2.0)
+_INV_SQRT_2PI = 1.0 / math.sqrt(2.0 * math.pi)
+_MS_PER_YEAR = 365.0 * MS_PER_DAY
+
+# Colonne prodotte, nell'ordine dello schema "greeks" (utils.schema)
+GREEK_COLUMNS = ("delta", "theta", "vega", "rho", "epsilon", "lambda", "gamma", "vanna", "charm", "vomma", "veta",
+                 "speed", "zomma", "color", "ultima")
+
+
+def norm_pdf(x):
+    return _INV_SQRT_2PI * np.exp(-0.5 * x * x)
+
+
+def norm_cdf(x):
+    """Funzione di ripartizione normale standard (erfc di Numerical Recipes, errore relativo < 1.2e-7)."""
+    z = np.abs(x) / _SQRT2
+    t = 1.0 / (1.0 + 0.5 * z)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+        0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (-0.82215223 + t * 0.17087277))))))))
+    tail = 0.5 * t * np.exp(-z * z + poly)
+    return np.where(x >= 0, 1.0 - tail, tail)
+
+
+def _d1_d2(spot, strike, t, rate, dividend, sigma):
+    vol_sqrt_t = sigma * np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * sigma * sigma) * t) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t, vol_sqrt_t
+
+
+def black_scholes(spot, strike, t, sigma, is_call, rate=config.GREEKS_RISK_FREE_RATE, dividend=config.GREEKS_DIVIDEND_YIELD):
+    """Prezzo Black-Scholes-Merton (array NumPy; is_call booleano)."""
+    d1, d2, _ = _d1_d2(spot, strike, t, rate, dividend, sigma)
+    spot_df = spot * np.exp(-dividend * t)
+    strike_df = strike * np.exp(-rate * t)
+    call = spot_df * norm_cdf(d1) - strike_df * norm_cdf(d2)
+    return np.where(is_call, call, call - spot_df + strike_df)
+
+
+def implied_volatility(price, spot, strike, t, is_call, rate=config.GREEKS_RISK_FREE_RATE, dividend=config.GREEKS_DIVIDEND_YIELD,
+                       tol=config.GREEKS_IV_TOLERANCE, max_iter=config.GREEKS_IV_MAX_ITER, low=1e-4, high=5.0,
+                       min_price=1e-6):
+    """
+    Volatilità implicita vettoriale: Newton su tutte le righe insieme, con intervallo [low, high] che
+    contiene sempre la soluzione e ripiego sulla bisezione quando il passo di Newton esce
+    dall'intervallo o la vega è nulla. Ogni iterazione lavora solo sulle righe non ancora convergenti.
+
+    La convergenza è relativa: |prezzo del modello - prezzo| <= tol * prezzo. Le righe senza soluzione
+    (prezzo sotto min_price o fuori dai limiti di arbitraggio, volatilità fuori da [low, high], valore
+    temporale sotto la precisione richiesta, scadenza passata, dati mancanti) restituiscono NaN.
+
+    Returns:
+        tuple: (iv, iv_error) con iv_error = (prezzo del modello - prezzo) / prezzo.
+    """
+    price, spot, strike, t = (np.asarray(a, dtype=np.float64) for a in np.broadcast_arrays(price, spot, strike, t))
+    is_call = np.broadcast_to(np.asarray(is_call, dtype=bool), price.shape)
+    with np.errstate(invalid="ignore", over="ignore"):
+        spot_df = spot * np.exp(-dividend * t)
+        strike_df = strike * np.exp(-rate * t)
+        lower = np.maximum(np.where(is_call, spot_df - strike_df, strike_df - spot_df), 0.0)
+        upper = np.where(is_call, spot_df, strike_df)
+        valid = np.isfinite(price) & np.isfinite(spot) & (t > 0) & (spot > 0) & (price >= min_price) & (price - lower > tol * price) & (price < upper)
+
+    # La soluzione deve stare in [low, high]: il prezzo del modello cresce con la volatilità
+    candidates = np.flatnonzero(valid)
+    args = (spot[candidates], strike[candidates], t[candidates])
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        inside = ((black_scholes(*args, low, is_call[candidates], rate, dividend) <= price[candidates])
+                  & (black_scholes(*args, high, is_call[candidates], rate, dividend) >= price[candidates]))
+    valid[candidates[~inside]] = False
+
+    lo = np.full(price.shape, low)
+    hi = np.full(price.shape, high)
+    # Stima iniziale di Brenner-Subrahmanyam, ristretta all'intervallo
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sigma = np.clip(np.sqrt(2.0 * np.pi / t) * price / spot, low * 2, high / 2)
+    sigma = np.where(valid, sigma, np.nan)
+    active = np.flatnonzero(valid)
+    for _ in range(max_iter):
+        if not len(active):
+            break
+        s, p = sigma[active], price[active]
+        sp, st, tt, call = spot[active], strike[active], t[active], is_call[active]
+        d1, _, _ = _d1_d2(sp, st, tt, rate, dividend, s)
+        diff = black_scholes(sp, st, tt, s, call, rate, dividend) - p
+        vega = sp * np.exp(-dividend * tt) * norm_pdf(d1) * np.sqrt(tt)
+        # Il prezzo cresce con la volatilità: il segno dell'errore restringe l'intervallo
+        above = diff > 0
+        lo[active] = np.where(above, lo[active], s)
+        hi[active] = np.where(above, s, hi[active])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = s - diff / vega
+        bisect = ~np.isfinite(step) | (step <= lo[active]) | (step >= hi[active])
+        sigma[active] = np.where(bisect, 0.5 * (lo[active] + hi[active]), step)
+        done = (np.abs(diff) <= tol * p) | (hi[active] - lo[active] <= 1e-10)
+        sigma[active[done]] = s[done]
+        active = active[~done]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        error = (black_scholes(spot, strike, t, sigma, is_call, rate, dividend) - price) / price
+    return sigma, np.where(valid, error, np.nan)
+
+
+def greeks(spot, strike, t, sigma, is_call, rate=config.GREEKS_RISK_FREE_RATE, dividend=config.GREEKS_DIVIDEND_YIELD, price=None):
+    """
+    Greche di primo, secondo e terzo ordine (vedi GREEK_COLUMNS) come dict nome -> array float64.
+    price (prezzo dell'opzione) serve solo per lambda; se omesso si usa il prezzo del modello.
+    """
+    spot, strike, t, sigma = (np.asarray(a, dtype=np.float64) for a in (spot, strike, t, sigma))
+    is_call = np.asarray(is_call, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        d1, d2, vol_sqrt_t = _d1_d2(spot, strike, t, rate, dividend, sigma)
+        sqrt_t = np.sqrt(t)
+        q_df, r_df = np.exp(-dividend * t), np.exp(-rate * t)
+        pdf = norm_pdf(d1)
+        sign = np.where(is_call, 1.0, -1.0)
+        cdf_d1, cdf_d2 = norm_cdf(sign * d1), norm_cdf(sign * d2)
+        if price is None:
+            price = black_scholes(spot, strike, t, sigma, is_call, rate, dividend)
+
+        delta = sign * q_df * cdf_d1
+        gamma = q_df * pdf / (spot * vol_sqrt_t)
+        vega = spot * q_df * pdf * sqrt_t
+        theta = -spot * q_df * pdf * sigma / (2.0 * sqrt_t) - sign * rate * strike * r_df * cdf_d2 + sign * dividend * spot * q_df * cdf_d1
+        rho = sign * strike * t * r_df * cdf_d2
+        epsilon = -sign * spot * t * q_df * cdf_d1
+        lam = delta * spot / price
+        vanna = -q_df * pdf * d2 / sigma
+        drift = (2.0 * (rate - dividend) * t - d2 * vol_sqrt_t) / (2.0 * t * vol_sqrt_t)
+        charm = sign * dividend * q_df * cdf_d1 - q_df * pdf * drift
+        vomma = vega * d1 * d2 / sigma
+        veta = spot * q_df * pdf * sqrt_t * (dividend + (rate - dividend) * d1 / vol_sqrt_t - (1.0 + d1 * d2) / (2.0 * t))
+        speed = -gamma / spot * (d1 / vol_sqrt_t + 1.0)
+        zomma = gamma * (d1 * d2 - 1.0) / sigma
+        color = q_df * pdf / (2.0 * spot * t * vol_sqrt_t) * (
+            2.0 * dividend * t + 1.0 + (2.0 * (rate - dividend) * t - d2 * vol_sqrt_t) * d1 / vol_sqrt_t)
+        ultima = -vega / (sigma * sigma) * (d1 * d2 * (1.0 - d1 * d2) + d1 * d1 + d2 * d2)
+    return {"delta": delta, "theta": theta, "vega": vega, "rho": rho, "epsilon": epsilon, "lambda": lam, "gamma": gamma,
+            "vanna": vanna, "charm": charm, "vomma": vomma, "veta": veta, "speed": speed, "zomma": zomma, "color": color,
+            "ultima": ultima}
+
+
+def _close_ms(days):
+    """Orario di chiusura (ms_of_day) della sessione di ciascuna data YYYYMMDD, calcolato una volta per data distinta."""
+    unique, inverse = np.unique(np.asarray(days, dtype=np.int64), return_inverse=True)
+    _, close_ms = session_bounds(pd.to_datetime(unique.astype(str), format="%Y%m%d").values.astype("datetime64[D]"))
+    return close_ms[inverse]
+
+
+def _day_number_ms(days):
+    """Data YYYYMMDD -> ms dall'epoch della mezzanotte (giorno * MS_PER_DAY)."""
+    unique, inverse = np.unique(np.asarray(days, dtype=np.int64), return_inverse=True)
+    epoch_days = pd.to_datetime(unique.astype(str), format="%Y%m%d").values.astype("datetime64[D]").astype(np.int64)
+    return epoch_days[inverse] * MS_PER_DAY
+
+
+def years_to_expiration(date, ms_of_day, expiration):
+    """
+    Tempo alla scadenza in anni: dalla quota (non oltre la chiusura della sessione, così le rilevazioni
+    EOD valgono come prezzi di chiusura) alla chiusura della sessione del giorno di scadenza.
+    """
+    date = np.asarray(date, dtype=np.int64)
+    expiration = np.asarray(expiration, dtype=np.int64)
+    quote_ms = np.minimum(np.asarray(ms_of_day, dtype=np.int64), _close_ms(date))
+    start = _day_number_ms(date) + quote_ms
+    end = _day_number_ms(expiration) + _close_ms(expiration)
+    return (end - start) / _MS_PER_YEAR
+
+
+def greeks_frame(df, rate=config.GREEKS_RISK_FREE_RATE, dividend=config.GREEKS_DIVIDEND_YIELD):
+    """
+    Righe di opzioni con underlying_price (vedi iter_joined_days) -> DataFrame con le colonne dello schema
+    "greeks": IV dal mid (bid/ask), o dalla chiusura quando il mid non è disponibile, e greche calcolate
+    con quella IV. Le righe senza IV valida hanno greche NaN.
+    """
+    bid = df["bid"].to_numpy(dtype=np.float64, na_value=np.nan)
+    ask = df["ask"].to_numpy(dtype=np.float64, na_value=np.nan)
+    price = np.where((bid > 0) & (ask >= bid), 0.5 * (bid + ask), np.nan)
+    if "close" in df.columns:
+        close = df["close"].to_numpy(dtype=np.float64, na_value=np.nan)
+        price = np.where(np.isnan(price) & (close > 0), close, price)
+    spot = df["underlying_price"].to_numpy(dtype=np.float64, na_value=np.nan)
+    strike = df["strike"].to_numpy(dtype=np.float64) / 1000.0
+    is_call = (df["right"].astype(str).str.upper().str[:1] == "C").to_numpy()
+    t = years_to_expiration(df["date"], df["ms_of_day"], df["expiration"])
+
+    iv, iv_error = implied_volatility(price, spot, strike, t, is_call, rate, dividend)
+    values = greeks(spot, strike, t, iv, is_call, rate, dividend, price=price)
+
+    out = {"ms_of_day": df["ms_of_day"].to_numpy(), "bid": bid, "ask": ask}
+    out.update((name, values[name].astype(np.float32)) for name in GREEK_COLUMNS)
+    out["implied_vol"] = iv.astype(np.float32)
+    out["iv_error"] = iv_error.astype(np.float32)
+    out["ms_of_day2"] = df["ms_of_day"].to_numpy()
+    out["underlying_price"] = spot
+    for column in ("underlying_ms_of_day", "open_interest", "date", "root", "expiration", "strike", "right"):
+        if column in df.columns:
+            out[column] = df[column].array
+    return pd.DataFrame(out)
+
+
+def iter_local_greeks(options_df, underlying_df, oi_df=None, intraday=False, rate=config.GREEKS_RISK_FREE_RATE,
+                      dividend=config.GREEKS_DIVIDEND_YIELD, chunk_rows=config.GREEKS_CHUNK_ROWS):
+    """
+    IV e greche calcolate localmente, una giornata alla volta (e in blocchi di al più chunk_rows righe,
+    per limitare la memoria dei calcoli intermedi), dalle quote di opzioni (option_quote intraday,
+    option_eod daily) e dalle barre dell'underlying allineate con un join as-of.
+
+    Yields:
+        pd.DataFrame: Righe di una giornata nello schema "greeks", pronte per DatasetStore.append.
+    """
+    metrics = get_default_metrics()
+    for day_df in iter_joined_days(options_df, oi_df=oi_df, underlying_df=underlying_df, intraday=intraday):
+        with metrics.timer("greeks", rows=len(day_df)):
+            chunks = [greeks_frame(day_df.iloc[i:i + chunk_rows], rate, dividend) for i in range(0, len(day_df), chunk_rows)]
+        yield chunks[0] if len(chunks) == 1 else pd.concat(chunks, ignore_index=True)
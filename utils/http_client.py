@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+from utils.decoder import decode_response
+from utils.metrics import get_default_metrics
+
+# 474 = terminal disconnected from MDDS, 571 = server starting: both are transient
+RETRY_STATUS_CODES = {429, 474, 500, 502, 503, 504, 571}
+NO_DATA_STATUS = 472
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` accumulated."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then consumes it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ThetaClient:
+    """
+    Shared HTTP client for Theta Terminal.
+
+    Keeps a pooled keep-alive session, applies per-endpoint timeouts, retries 429/5xx
+    and connection errors with exponential backoff and throttles every request through
+    a single token bucket, so all fetchers sharing the client share the terminal budget.
+    """
+
+    def __init__(self,
+                 base_url=config.BASE_URL,
+                 pool_size=config.HTTP_POOL_SIZE,
+                 max_retries=config.HTTP_MAX_RETRIES,
+                 backoff_base=config.HTTP_BACKOFF_BASE,
+                 backoff_max=config.HTTP_BACKOFF_MAX,
+                 requests_per_second=config.TERMINAL_REQUESTS_PER_SECOND,
+                 burst=config.TERMINAL_BURST,
+                 timeouts=None,
+                 metrics=None
+                ):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeouts = dict(config.HTTP_TIMEOUTS if timeouts is None else timeouts)
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        # Latenze, byte, righe, retry ed errori per endpoint (vedi utils.metrics)
+        self.metrics = metrics or get_default_metrics()
+        # Chiamata dopo un errore di connessione (es. TerminalManager.recover): se restituisce True il
+        # terminale è di nuovo raggiungibile e la richiesta viene ripetuta subito
+        self.on_connection_lost = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def timeout_for(self, endpoint):
+        """Returns the (connect, read) timeout for the longest matching endpoint prefix."""
+        matches = [prefix for prefix in self.timeouts if endpoint.startswith(prefix)]
+        if not matches:
+            return config.HTTP_DEFAULT_TIMEOUT
+        return self.timeouts[max(matches, key=len)]
+
+    def _backoff(self, attempt, response=None):
+        """Sleeps before the next attempt, honouring Retry-After when the terminal sends it."""
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            delay = max(delay, float(response.headers["Retry-After"]))
+        time.sleep(delay * (0.5 + random.random() / 2))
+
+    def get(self, endpoint, params=None, timeout=None, retries=None, stream=False):
+        """
+        GET `endpoint` (e.g. "/v2/list/roots/stock") and return the successful response.
+
+        Raises requests.exceptions.RequestException (HTTPError for non-retryable status
+        codes) once all retries are exhausted, so callers never see a failed response.
+        """
+        url = f"{self.base_url}{endpoint}"
+        timeout = timeout or self.timeout_for(endpoint)
+        retries = self.max_retries if retries is None else retries
+
+        for attempt in range(retries + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = "timeout" if isinstance(e, requests.exceptions.Timeout) else "connection"
+                self.metrics.record_request(endpoint, time.perf_counter() - start, error, retry=attempt > 0)
+                if attempt >= retries:
+                    raise
+                if isinstance(e, requests.exceptions.ConnectionError) and self.on_connection_lost is not None \
+                        and self.on_connection_lost():
+                    continue
+                self._backoff(attempt)
+                continue
+            self.metrics.record_request(endpoint, time.perf_counter() - start, response.status_code, retry=attempt > 0)
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < retries:
+                response.close()
+                self._backoff(attempt, response)
+                continue
+
+            if response.status_code >= 400:
+                # Requisito 4.1.1.2: il testo completo della risposta finisce nell'eccezione
+                raise requests.exceptions.HTTPError(
+                    f"{response.status_code} for {url}: {response.text}", response=response
+                )
+            return response
+
+    def get_payload(self, endpoint, params=None, **kwargs):
+        """GET and return the whole JSON envelope ({"header": ..., "response": ...}); {} when there is no data."""
+        try:
+            response = self.get(endpoint, params=params, **kwargs)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == NO_DATA_STATUS:
+                return {}
+            raise
+        payload = response.json()
+        response_rows = payload.get("response")
+        self.metrics.record_payload(endpoint, len(response.content), len(response_rows) if isinstance(response_rows, list) else 0)
+        return payload
+
+    def get_json(self, endpoint, params=None, **kwargs):
+        """GET and return the `response` payload of the terminal's JSON envelope ([] when there is no data)."""
+        return self.get_payload(endpoint, params=params, **kwargs).get("response", [])
+
+    def get_bytes(self, endpoint, params=None, **kwargs):
+        """
+        GET and return the raw response body, None when the terminal has no data.
+
+        Decoding is left to the caller (see utils.pipeline, which decodes in a process pool);
+        only the received bytes are recorded here.
+        """
+        try:
+            response = self.get(endpoint, params=params, **kwargs)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == NO_DATA_STATUS:
+                return None
+            raise
+        body = response.content
+        self.metrics.record_payload(endpoint, len(body))
+        return body
+
+    def get_frame(self, endpoint, params=None, bulk=False, **kwargs):
+        """
+        GET with a streamed body decoded straight into a named, typed DataFrame (see utils.decoder).
+
+        Returns None when the terminal has no data for the request.
+        """
+        try:
+            response = self.get(endpoint, params=params, stream=True, **kwargs)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == NO_DATA_STATUS:
+                return None
+            raise
+        # Il tempo di decode include la lettura dello stream: la decodifica avviene mentre arrivano i byte
+        with response, self.metrics.timer("decode") as stage:
+            df = decode_response(response, bulk=bulk)
+            rows = 0 if df is None else len(df)
+            nbytes = _bytes_read(response)
+            stage.update(rows=rows, bytes=nbytes)
+        self.metrics.record_payload(endpoint, nbytes, rows)
+        return df
+
+    def close(self):
+        self.session.close()
+
+
+def _bytes_read(response):
+    """Byte letti dal socket per una risposta in streaming (Content-Length se non disponibile)."""
+    try:
+        return response.raw.tell()
+    except (AttributeError, OSError):
+        return int(response.headers.get("Content-Length", 0) or 0)
+
+
+_default_clients = {}
+_default_lock = threading.Lock()
+
+
+def get_default_client(base_url=config.BASE_URL):
+    """Returns the process-wide client for `base_url`, creating it on first use."""
+    with _default_lock:
+        client = _default_clients.get(base_url)
+        if client is None:
+            client = _default_clients[base_url] = ThetaClient(base_url)
+        return client
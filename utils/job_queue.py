@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Stati di un task
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+
+def task_key(endpoint, params):
+    """Chiave stabile di un task (stesso endpoint e parametri -> stessa chiave), usata anche come nome del frammento."""
+    text = endpoint + "?" + "&".join(f"{k}={params[k]}" for k in sorted(params))
+    return hashlib.sha1(text.encode()).hexdigest()[:20]
+
+
+class JobQueue:
+    """
+    Coda di lavoro persistente (SQLite) dei download pianificati.
+
+    Un job è il piano di un aggiornamento (es. tutti i contratti SPY EOD tra due date) materializzato
+    come task (endpoint + parametri) con stato pending / in_flight / done / failed. Ogni cambio di
+    stato viene salvato subito, quindi dopo un crash il job riprende dai soli task non completati:
+    i task rimasti in_flight tornano pending, perché la loro esecuzione è idempotente (il frammento
+    scritto ha un nome derivato dalla chiave del task e viene sovrascritto, non duplicato).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                job TEXT NOT NULL,
+                task_key TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                params TEXT NOT NULL,
+                priority INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                UNIQUE (job, task_key)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_state ON tasks (job, state, priority, id)")
+
+    def close(self):
+        self._conn.close()
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    def _update(self, sql, args=()):
+        with self._lock:
+            return self._conn.execute(sql, args).rowcount
+
+    def has_job(self, job):
+        return bool(self._query("SELECT 1 FROM tasks WHERE job=? LIMIT 1", (job,)))
+
+    def add_tasks(self, job, tasks):
+        """
+        Aggiunge al job i task [(endpoint, params[, priority])] in una sola transazione.
+        I task già presenti (stessa chiave) vengono ignorati: ripianificare è idempotente.
+
+        Returns:
+            int: Numero di task effettivamente inseriti.
+        """
+        now = time.time()
+        rows = []
+        for task in tasks:
+            endpoint, params = task[0], task[1]
+            priority = task[2] if len(task) > 2 else 0
+            rows.append((job, task_key(endpoint, params), endpoint, json.dumps(params), priority, PENDING, now))
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("""
+                    INSERT OR IGNORE INTO tasks (job, task_key, endpoint, params, priority, state, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return self._conn.total_changes - before
+
+    def recover(self, job):
+        """Riporta a pending i task rimasti in_flight (processo interrotto durante l'esecuzione)."""
+        return self._update("UPDATE tasks SET state=?, updated_at=? WHERE job=? AND state=?",
+                            (PENDING, time.time(), job, IN_FLIGHT))
+
+    def tasks(self, job, states=(PENDING,)):
+        """Task del job negli stati indicati, in ordine di priorità, come dict (id, task_key, endpoint, params, attempts)."""
+        marks = ",".join("?" * len(states))
+        rows = self._query(f"""
+            SELECT id, task_key, endpoint, params, attempts FROM tasks
+            WHERE job=? AND state IN ({marks}) ORDER BY priority, id
+        """, (job, *states))
+        return [{"id": r[0], "task_key": r[1], "endpoint": r[2], "params": json.loads(r[3]), "attempts": r[4]} for r in rows]
+
+    def start(self, task_id):
+        self._update("UPDATE tasks SET state=?, attempts=attempts+1, updated_at=? WHERE id=?",
+                     (IN_FLIGHT, time.time(), task_id))
+
+    def complete(self, task_id):
+        self._update("UPDATE tasks SET state=?, error=NULL, updated_at=? WHERE id=?", (DONE, time.time(), task_id))
+
+    def fail(self, task_id, error):
+        self._update("UPDATE tasks SET state=?, error=?, updated_at=? WHERE id=?",
+                     (FAILED, str(error), time.time(), task_id))
+
+    def counts(self, job):
+        """Numero di task per stato."""
+        counts = dict.fromkeys(STATES, 0)
+        for state, count in self._query("SELECT state, COUNT(*) FROM tasks WHERE job=? GROUP BY state", (job,)):
+            counts[state] = count
+        return counts
+
+    def failures(self, job):
+        """(params, errore) dei task falliti."""
+        rows = self._query("SELECT params, error FROM tasks WHERE job=? AND state=? ORDER BY id", (job, FAILED))
+        return [(json.loads(params), error) for params, error in rows]
+
+    def delete_job(self, job):
+        self._update("DELETE FROM tasks WHERE job=?", (job,))
+
+    def jobs(self):
+        """Job presenti nella coda con i conteggi per stato."""
+        return {job: self.counts(job) for (job,) in self._query("SELECT DISTINCT job FROM tasks ORDER BY job")}
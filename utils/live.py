@@ -0,0 +1,329 @@
+import logging
+import threading
+import time
+import uuid
+import numpy as np
+import pandas as pd
+
+import config
+from utils.concurrency import run_tasks
+from utils.ring_buffer import RingBuffer
+from utils.schema import schema_for, underlying_kind
+from utils.trading_calendar import session_bounds, trading_days
+from utils.universe import UniverseSelector, contract_priority, days_to_expiration
+
+logger = logging.getLogger(__name__)
+
+MARKET_TIMEZONE = "America/New_York"
+
+# Endpoint delle barre intraday seguite in tempo reale
+UNDERLYING_ENDPOINTS = {"stock": "/v2/hist/stock/ohlc", "index": "/v2/hist/index/ohlc"}
+OPTION_ENDPOINT = "/v2/hist/option/quote"
+
+
+def market_clock():
+    """(sessione come pd.Timestamp, ms dalla mezzanotte) nell'ora di New York."""
+    now = pd.Timestamp.now(tz=MARKET_TIMEZONE)
+    midnight = now.normalize()
+    return midnight.tz_localize(None), int((now - midnight).total_seconds() * 1000)
+
+
+def _buffer_columns(kind, contract=False):
+    """Colonne del ring buffer: schema canonico di kind, più il contratto (right come carattere)."""
+    columns = schema_for(kind)
+    if contract:
+        columns.update(expiration="int32", strike="int32", right="U1")
+    return columns
+
+
+class LiveFollower:
+    """
+    Segue in tempo reale le barre intraday dell'underlying e di un sottoinsieme di contratti.
+
+    Ogni poll chiede al terminale solo le barre completate dopo l'ultima ricevuta (start_time/end_time
+    sulla sessione corrente): nessuna lista di root, nessuna lettura dei file di dati, nessuna
+    riscrittura. Le barre nuove finiscono in due RingBuffer (underlying e opzioni) leggibili senza
+    copie, e vengono salvate nello storage in blocco ogni flush_seconds come nuovi frammenti.
+
+    Alla ripartenza nella stessa giornata il follower riprende dall'ultima barra già salvata; a
+    sessione chiusa la giornata viene registrata nel manifest, così update_data non la riscarica.
+
+    Args:
+        fetcher (ThetaDataFetcher): Fornisce client, storage, manifest e metadati del simbolo.
+        timeframe (str): Timeframe intraday (config.INTRADAY_TIMEFRAMES).
+        contracts (list): Contratti (exp, strike, right) da seguire; None = i max_contracts più
+            vicini (scadenza e moneyness rispetto all'ultimo prezzo dell'underlying) nell'universo
+            di config.UNIVERSE, scelti all'inizio di ogni sessione.
+        poll_seconds (float): Intervallo tra due poll.
+        flush_seconds (float): Intervallo tra due salvataggi su disco.
+        capacity (int): Barre conservate in memoria per strumento.
+        clock (callable): clock() -> (sessione, ms_of_day) in ora di New York (default market_clock).
+    """
+
+    def __init__(self, fetcher, timeframe="1minute", contracts=None, poll_seconds=config.LIVE_POLL_SECONDS,
+                 flush_seconds=config.LIVE_FLUSH_SECONDS, capacity=config.LIVE_BUFFER_CAPACITY,
+                 max_contracts=config.LIVE_MAX_CONTRACTS, max_concurrency=config.LIVE_MAX_CONCURRENCY, clock=market_clock):
+        self.fetcher = fetcher
+        self.symbol = fetcher.symbol
+        self.client = fetcher.client
+        self.timeframe = timeframe
+        self.interval_ms = fetcher.get_interval_ms(timeframe)
+        self.underlying_type, _, self.underlying_store = fetcher._underlying()
+        self.fixed_contracts = list(contracts) if contracts is not None else None
+        self.max_contracts = max_contracts
+        self.max_concurrency = max_concurrency
+        self.poll_seconds = poll_seconds
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+
+        # 🔹 **Barre in memoria (lettura senza copie con view()/since())**
+        self.underlying = RingBuffer(capacity, _buffer_columns(underlying_kind(timeframe)))
+        self.options = RingBuffer(capacity * max(1, len(self.fixed_contracts) if self.fixed_contracts else max_contracts),
+                                  _buffer_columns("quote", contract=True))
+        self._flushed = {"underlying": 0, "options": 0}
+
+        self.day = None
+        self.contracts = None
+        self._open_ms = self._close_ms = None
+        self._next_ms = {}
+        self._resumed = {}
+        self._last_price = None
+        self._closed = False
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"polls": 0, "requests": 0, "errors": 0, "rows": 0, "flushed_rows": 0, "lost_rows": 0, "lag_ms": None}
+
+    # 🔹 **Ciclo principale**
+
+    def run(self, until_close=True):
+        """
+        Esegue poll e flush finché non viene chiamato stop() oppure, con until_close, finché la sessione
+        corrente non è chiusa. Il watchdog del terminale resta attivo per tutta la durata.
+
+        Returns:
+            dict: Statistiche (poll, richieste, errori, righe ricevute e salvate, ritardo dell'ultima barra).
+        """
+        self._stop.clear()
+        last_flush = time.monotonic()
+        with self.fetcher.terminal.watch():
+            try:
+                while not self._stop.is_set():
+                    started = time.monotonic()
+                    state = self.poll_once()
+                    if state == "closed" and until_close:
+                        break
+                    if time.monotonic() - last_flush >= self.flush_seconds:
+                        self.flush()
+                        last_flush = time.monotonic()
+                    self._stop.wait(max(0.0, self.poll_seconds - (time.monotonic() - started)))
+            finally:
+                self.flush()
+                self._finish_day()
+        logger.info(f"📡 {self.symbol} live terminato: {self.stats['flushed_rows']} righe salvate in {self.stats['polls']} poll.",
+                    extra={"symbol": self.symbol, **self.stats})
+        return self.stats
+
+    def start(self, until_close=True):
+        """Avvia run() in un thread in background e restituisce il follower."""
+        self._thread = threading.Thread(target=self.run, args=(until_close,), name=f"live-{self.symbol}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Ferma il ciclo (dopo il poll in corso), salva le barre in memoria e attende il thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    # 🔹 **Poll**
+
+    def poll_once(self):
+        """
+        Scarica le barre completate dopo l'ultimo poll per underlying e contratti.
+
+        Returns:
+            str: "closed" (giornata non di borsa o sessione terminata), "pre" (prima dell'apertura) o "open".
+        """
+        day, now_ms = self.clock()
+        if day != self.day:
+            self._begin_day(day)
+        if self._open_ms is None:
+            return "closed"
+        if now_ms < self._open_ms + self.interval_ms:
+            return "pre"
+
+        # Inizio dell'ultima barra completata (le barre partono dall'apertura a multipli dell'intervallo)
+        last_start = self._open_ms + ((min(now_ms, self._close_ms) - self._open_ms) // self.interval_ms - 1) * self.interval_ms
+        with self.fetcher.metrics.timer("live_poll") as stage:
+            # L'underlying per primo: il suo ultimo prezzo ordina i contratti da seguire
+            rows = self._collect(run_tasks(self._poll_instrument, [(None, last_start)]))
+            if self.contracts is None:
+                self.contracts = self._select_contracts(day)
+            due = [(contract, last_start) for contract in self.contracts if self._next_ms[contract] <= last_start]
+            rows += self._collect(run_tasks(self._poll_instrument, due, self.max_concurrency))
+            stage["rows"] = rows
+
+        self.stats["polls"] += 1
+        self.stats["rows"] += rows
+        if len(self.underlying):
+            self.stats["lag_ms"] = min(now_ms, self._close_ms) - int(self.underlying.view(1)["ms_of_day"][0]) - self.interval_ms
+        self._closed = now_ms >= self._close_ms
+        return "closed" if self._closed else "open"
+
+    def _poll_instrument(self, contract, last_start):
+        """Barre [prossima barra attesa, last_start] di un contratto (None = underlying) nella sessione corrente."""
+        start_ms = self._next_ms[contract]
+        day = self.day.strftime("%Y%m%d")
+        params = {"root": self.symbol, "start_date": day, "end_date": day, "ivl": self.interval_ms,
+                  "start_time": start_ms, "end_time": last_start}
+        if contract is None:
+            endpoint = UNDERLYING_ENDPOINTS[self.underlying_type]
+        else:
+            endpoint = OPTION_ENDPOINT
+            params.update(exp=contract[0], strike=contract[1], right=contract[2])
+        df = self.client.get_frame(endpoint, params=params)
+        if df is None or len(df) == 0:
+            return None
+        # Il filtro sugli orari viene ripetuto qui: mai barre incomplete o già ricevute
+        ms = df["ms_of_day"].to_numpy()
+        return df[(ms >= start_ms) & (ms <= last_start)]
+
+    def _collect(self, results):
+        """Aggiunge ai ring buffer le barre ricevute (un solo thread scrive) e avanza la prossima barra attesa."""
+        rows = 0
+        for res in results:
+            contract = res.task[0]
+            self.stats["requests"] += 1
+            if not res.ok:
+                self.stats["errors"] += 1
+                logger.warning(f"⚠️ Poll live fallito per {contract or self.symbol}: {res.error}",
+                               extra={"symbol": self.symbol, "contract": contract})
+                continue
+            df = res.result
+            if df is None or len(df) == 0:
+                continue
+            values = {column: df[column].to_numpy() for column in df.columns}
+            if contract is None:
+                self.underlying.extend(values)
+            else:
+                n = len(df)
+                values.update(expiration=np.full(n, int(contract[0])), strike=np.full(n, int(contract[1])),
+                              right=np.full(n, contract[2]))
+                self.options.extend(values)
+            self._next_ms[contract] = int(df["ms_of_day"].max()) + self.interval_ms
+            rows += len(df)
+        return rows
+
+    # 🔹 **Sessioni e contratti**
+
+    def _begin_day(self, day):
+        """Chiude la giornata precedente e prepara la nuova: orari di sessione e ripresa dall'ultima barra salvata."""
+        if self.day is not None:
+            self.flush()
+            self._finish_day()
+        self.day, self._closed, self._last_price = day, False, None
+        self.contracts = list(self.fixed_contracts) if self.fixed_contracts is not None else None
+        days = trading_days(day, day)
+        if not len(days):
+            self._open_ms = self._close_ms = None
+            self._next_ms, self._resumed = {}, {}
+            return
+        open_ms, close_ms = session_bounds(days)
+        self._open_ms, self._close_ms = int(open_ms[0]), int(close_ms[0])
+        self._next_ms = {None: self._open_ms}
+        if self.contracts is not None:
+            self._next_ms.update((contract, self._open_ms) for contract in self.contracts)
+        self._resume(day)
+
+    def _resume(self, day):
+        """Prossima barra attesa per ogni strumento a partire da quanto già salvato oggi (una sola partizione)."""
+        number = int(day.strftime("%Y%m%d"))
+        stored = self.underlying_store.query(self.symbol, self.underlying_type, self.timeframe, number, number,
+                                             columns=["ms_of_day", "close"], output="pandas")
+        if len(stored):
+            last = stored["ms_of_day"].idxmax()
+            self._next_ms[None] = int(stored["ms_of_day"][last]) + self.interval_ms
+            self._last_price = float(stored["close"][last])
+        stored = self.fetcher.options_store.query(self.symbol, "option_quote", self.timeframe, number, number,
+                                                  columns=["expiration", "strike", "right", "ms_of_day"], output="pandas")
+        self._resumed = {}
+        if len(stored):
+            last = stored.groupby(["expiration", "strike", "right"], observed=True)["ms_of_day"].max()
+            self._resumed = {(int(exp), int(strike), str(right)): int(ms) + self.interval_ms for (exp, strike, right), ms in last.items()}
+        for contract in list(self._next_ms):
+            if contract is not None:
+                self._next_ms[contract] = self._resumed.get(self._contract_key(contract), self._open_ms)
+
+    @staticmethod
+    def _contract_key(contract):
+        return int(contract[0]), int(contract[1]), str(contract[2])
+
+    def _select_contracts(self, day):
+        """
+        I max_contracts contratti non scaduti dell'universo più vicini: prima le scadenze vicine, poi la
+        distanza dello strike dall'ultimo prezzo dell'underlying (ricevuto live o, in mancanza, salvato oggi o in daily).
+        """
+        options_fetcher = self.fetcher.options_fetcher
+        contracts = options_fetcher._collect_contracts(self.max_concurrency)
+        selector = UniverseSelector.from_store(self.underlying_store, self.symbol, self.underlying_type)
+        today = np.array([np.datetime64(day.date(), "D")])
+        if len(self.underlying):
+            spot = float(self.underlying.view(1)["close"][0])
+        elif self._last_price is not None:
+            spot = self._last_price
+        else:
+            spot = float(selector.spot(today)[0]) if selector is not None else np.nan
+        ranked = []
+        for exp, strike, right in contracts:
+            dte = days_to_expiration(exp, today)[0]
+            if dte < 0 or (selector is not None and not selector.select(exp, strike, right, today)[0]):
+                continue
+            moneyness = abs(strike / 1000.0 / spot - 1.0) if spot > 0 else None
+            ranked.append((contract_priority(dte, moneyness), (exp, strike, right)))
+        ranked.sort(key=lambda item: item[0])
+        selected = [contract for _, contract in ranked[:self.max_contracts]]
+        self._next_ms.update((contract, self._resumed.get(self._contract_key(contract), self._open_ms)) for contract in selected)
+        logger.info(f"📡 {self.symbol} live: {len(selected)} contratti seguiti su {len(contracts)}.",
+                    extra={"symbol": self.symbol, "contracts": len(selected)})
+        return selected
+
+    # 🔹 **Salvataggio**
+
+    def flush(self):
+        """Salva nello storage le barre ricevute dopo l'ultimo flush (un frammento per buffer)."""
+        saves = (
+            ("underlying", self.underlying, lambda df: self.underlying_store.append(
+                df, self.symbol, self.underlying_type, self.timeframe, kind=underlying_kind(self.timeframe), name=f"live-{uuid.uuid4().hex}")),
+            ("options", self.options, lambda df: self.fetcher.options_store.append(
+                df, self.symbol, "option_quote", self.timeframe, name=f"live-{uuid.uuid4().hex}")),
+        )
+        flushed = 0
+        for key, buffer, save in saves:
+            views, sequence, lost = buffer.since(self._flushed[key])
+            if lost:
+                self.stats["lost_rows"] += lost
+                logger.warning(f"⚠️ {lost} barre {key} sovrascritte prima del salvataggio: aumentare capacity o ridurre flush_seconds.",
+                               extra={"symbol": self.symbol, "lost": lost})
+            rows = sequence - self._flushed[key] - lost
+            if rows:
+                with self.fetcher.metrics.timer("live_flush", rows=rows):
+                    save(pd.DataFrame(views))
+                flushed += rows
+            self._flushed[key] = sequence
+        self.stats["flushed_rows"] += flushed
+        if flushed:
+            logger.info(f"💾 {self.symbol} live: {flushed} barre salvate (ritardo {(self.stats['lag_ms'] or 0) / 1000:.1f}s).",
+                        extra={"symbol": self.symbol, "rows": flushed, "lag_ms": self.stats["lag_ms"]})
+        return flushed
+
+    def _finish_day(self):
+        """A sessione chiusa registra nel manifest gli strumenti ricevuti fino all'ultima barra."""
+        if not self._closed or self._close_ms is None:
+            return
+        complete = [contract for contract, next_ms in self._next_ms.items() if next_ms >= self._close_ms]
+        if None in complete:
+            self.fetcher.manifest.add(self.symbol, self.underlying_type, self.timeframe, self.day, self.day, include_today=True)
+        contracts = [contract for contract in complete if contract is not None]
+        if contracts:
+            self.fetcher.manifest.add(self.symbol, "option_quote", self.timeframe, self.day, self.day, contracts=contracts, include_today=True)
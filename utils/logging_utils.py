@@ -0,0 +1,40 @@
+import json
+import logging
+import sys
+
+# Attributi standard di un LogRecord: tutto il resto arriva da `extra=` ed è un campo strutturato
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON per record: timestamp, livello, logger, messaggio e i campi passati con extra=."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in record.__dict__.items() if k not in _RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def configure_logging(level="INFO", json_format=False, stream=None, force=False):
+    """
+    Configura il logging del processo: testo leggibile (default) o JSON strutturato.
+
+    Non modifica una configurazione già presente (es. quella di un'applicazione che importa il
+    fetcher) a meno di force=True.
+    """
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%H:%M:%S"))
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from utils.storage import CONTRACTS_METADATA_KEY
+
+# Chiave di copertura dei dati non legati a un contratto (underlying, greche bulk, ...)
+NO_CONTRACT = (0, 0, "")
+
+
+def _to_day(value):
+    """Converte YYYYMMDD (int/str), date o Timestamp nel numero ordinale del giorno."""
+    if isinstance(value, (int, np.integer, str)) and len(str(value)) == 8:
+        value = pd.Timestamp(str(value))
+    return pd.Timestamp(value).toordinal()
+
+
+def _from_day(day):
+    return pd.Timestamp.fromordinal(day)
+
+
+class CoverageManifest:
+    """
+    Registro persistente (SQLite) degli intervalli di date già scaricati per ogni
+    (symbol, type, timeframe, expiration, strike, right).
+
+    Le sessioni mancanti si ricavano da covered() con utils.trading_calendar.missing_sessions, che
+    conosce weekend e festività. Un intervallo è "coperto" quando la richiesta che lo riguardava è andata a buon fine, anche se
+    il terminale non ha restituito righe (es. festività): la pianificazione degli aggiornamenti
+    non deve quindi mai aprire i file di dati. Gli intervalli adiacenti o sovrapposti vengono
+    fusi a ogni inserimento, per cui ogni contratto ha pochissime righe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS coverage (
+                symbol TEXT NOT NULL,
+                type TEXT NOT NULL,
+                timeframe TEXT NOT NULL,
+                expiration INTEGER NOT NULL,
+                strike INTEGER NOT NULL,
+                "right" TEXT NOT NULL,
+                start_day INTEGER NOT NULL,
+                end_day INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE INDEX IF NOT EXISTS coverage_key
+            ON coverage (symbol, type, timeframe, expiration, strike, "right", start_day)
+        """)
+
+    def close(self):
+        self._conn.close()
+
+    @staticmethod
+    def _key(symbol, data_type, timeframe, contract=None):
+        expiration, strike, right = contract or NO_CONTRACT
+        return (symbol, data_type, timeframe, int(expiration), int(strike), right)
+
+    def _add_locked(self, key, start, end):
+        rows = self._conn.execute("""
+            SELECT rowid, start_day, end_day FROM coverage
+            WHERE symbol=? AND type=? AND timeframe=? AND expiration=? AND strike=? AND "right"=?
+              AND start_day <= ? AND end_day >= ?
+        """, (*key, end + 1, start - 1)).fetchall()
+        if rows:
+            start = min(start, *(row[1] for row in rows))
+            end = max(end, *(row[2] for row in rows))
+            self._conn.executemany("DELETE FROM coverage WHERE rowid=?", [(row[0],) for row in rows])
+        self._conn.execute("INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (*key, start, end))
+
+    def add(self, symbol, data_type, timeframe, start_date, end_date, contracts=None, include_today=False):
+        """
+        Registra [start_date, end_date] come coperto per i contratti indicati (None = dato senza contratto).
+
+        Le date da oggi in poi vengono escluse (salvo include_today=True) perché i dati della
+        sessione in corso non sono ancora definitivi. Tutti gli inserimenti avvengono in una
+        sola transazione.
+        """
+        start, end = _to_day(start_date), _to_day(end_date)
+        if not include_today:
+            end = min(end, pd.Timestamp.today().toordinal() - 1)
+        if end < start:
+            return
+        keys = [self._key(symbol, data_type, timeframe, c) for c in (contracts if contracts is not None else [None])]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for key in keys:
+                    self._add_locked(key, start, end)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def covered(self, symbol, data_type, timeframe, contract=None):
+        """Intervalli coperti come lista ordinata di (start, end) pd.Timestamp."""
+        key = self._key(symbol, data_type, timeframe, contract)
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT start_day, end_day FROM coverage
+                WHERE symbol=? AND type=? AND timeframe=? AND expiration=? AND strike=? AND "right"=?
+                ORDER BY start_day
+            """, key).fetchall()
+        return [(_from_day(start), _from_day(end)) for start, end in rows]
+
+    def coverage(self, symbol, data_type, timeframe):
+        """
+        Intervalli coperti di tutti i contratti del dataset, con una sola query, come dict
+        (expiration, strike, right) -> lista ordinata di (start, end) pd.Timestamp (NO_CONTRACT per i dati senza contratto).
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT expiration, strike, "right", start_day, end_day FROM coverage
+                WHERE symbol=? AND type=? AND timeframe=?
+                ORDER BY expiration, strike, "right", start_day
+            """, (symbol, data_type, timeframe)).fetchall()
+        result = {}
+        for expiration, strike, right, start, end in rows:
+            result.setdefault((expiration, strike, right), []).append((_from_day(start), _from_day(end)))
+        return result
+
+    def last_covered(self, symbol, data_type, timeframe, contract=None):
+        """Ultimo giorno coperto (pd.Timestamp) oppure None."""
+        covered = self.covered(symbol, data_type, timeframe, contract)
+        return covered[-1][1] if covered else None
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM coverage")
+
+    def rebuild(self, root_dirs):
+        """
+        Ricostruisce il manifest da uno o più storage DatasetStore leggendo solo i footer Parquet.
+
+        Lo stesso manifest registra opzioni e underlying, salvati in cartelle diverse (options_dir,
+        stock_dir, index_dir): vanno passate tutte, perché la copertura precedente viene sostituita
+        per intero in una sola transazione. Ogni frammento sotto symbol=/type=/timeframe=/date= copre
+        la sua data per i contratti elencati nei metadati del footer; per frammenti scritti senza quei
+        metadati vengono lette solo le colonne chiave. I giorni senza dati (festività) non hanno
+        frammenti e risulteranno di nuovo mancanti.
+
+        Args:
+            root_dirs (str | list): Cartella radice dello storage, o lista di cartelle.
+
+        Returns:
+            int: Numero di frammenti analizzati.
+        """
+        if isinstance(root_dirs, str):
+            root_dirs = [root_dirs]
+        coverage = {}
+        fragments = 0
+        for root_dir in root_dirs:
+            for directory, _, files in os.walk(root_dir):
+                parts = dict(
+                    part.split("=", 1) for part in os.path.relpath(directory, root_dir).split(os.sep) if "=" in part
+                )
+                if not {"symbol", "type", "timeframe", "date"} <= parts.keys():
+                    continue
+                for name in files:
+                    if not name.endswith(".parquet") or name.startswith((".", "_")):
+                        continue
+                    fragments += 1
+                    contracts = fragment_contracts(os.path.join(directory, name))
+                    base = (parts["symbol"], parts["type"], parts["timeframe"])
+                    day = _to_day(parts["date"])
+                    for contract in contracts:
+                        coverage.setdefault(base + tuple(contract), set()).add(day)
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM coverage")
+                for key, days in coverage.items():
+                    key = self._key(*key[:3], key[3:])
+                    for start, end in _runs(sorted(days)):
+                        self._conn.execute("INSERT INTO coverage VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (*key, start, end))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return fragments
+
+
+def fragment_contracts(path):
+    """Contratti (expiration, strike, right) contenuti in un frammento; [NO_CONTRACT] se non ha colonne di contratto."""
+    metadata = pq.read_metadata(path).metadata or {}
+    if CONTRACTS_METADATA_KEY in metadata:
+        return [tuple(c) for c in json.loads(metadata[CONTRACTS_METADATA_KEY])]
+    schema_names = set(pq.read_schema(path).names)
+    if not {"expiration", "strike", "right"} <= schema_names:
+        return [NO_CONTRACT]
+    keys = pq.read_table(path, columns=["expiration", "strike", "right"]).to_pandas().drop_duplicates()
+    return list(keys.itertuples(index=False, name=None))
+
+
+def _runs(days):
+    """Raggruppa giorni ordinali ordinati in intervalli consecutivi (start, end)."""
+    runs = []
+    for day in days:
+        if runs and day == runs[-1][1] + 1:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gestione del manifest di copertura dei dati scaricati.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="Ricostruisce il manifest leggendo i footer Parquet dello storage.")
+    rebuild.add_argument("root_dirs", nargs="+",
+                         help="Cartelle radice dello storage (symbol=/type=/timeframe=/date=): opzioni e underlying "
+                              "(options_dir stock_dir index_dir), che condividono lo stesso manifest.")
+    rebuild.add_argument("--manifest", help="Percorso del manifest (default: <prima cartella>/coverage.sqlite).")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        manifest = CoverageManifest(args.manifest or os.path.join(args.root_dirs[0], "coverage.sqlite"))
+        fragments = manifest.rebuild(args.root_dirs)
+        print(f"✅ Manifest ricostruito da {fragments} frammenti: {manifest.path}")
+
+
+if __name__ == "__main__":
+    main()
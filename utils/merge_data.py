@@ -1,39 +1,187 @@
+import logging
 import os
+import numpy as np
 import pandas as pd
-# Funzioni per unire opzioni con greche, IV, OI
+import pyarrow.dataset as ds
 
-def merge_option_data(self, options_df, greeks_df, iv_df, oi_df):
-    """Unisce opzioni con greche, IV e OI sulle righe giuste."""
-    if options_df is None:
-        return None
+from utils.metrics import get_default_metrics
+from utils.schema import normalize, primary_key
+from utils.storage import append_partitioned, partition_values
+from utils.trading_calendar import MS_PER_DAY
+from utils.upsert import upsert
+
+logger = logging.getLogger(__name__)
+
+# Funzioni per unire opzioni con greche, IV, OI e underlying
+
+# Colonne chiave: non vengono mai copiate dal lato destro di un join
+JOIN_KEYS = ("root", "expiration", "strike", "right", "date", "ms_of_day")
+
+# Colonne dell'underlying aggiunte alle righe di opzioni dal join as-of
+UNDERLYING_COLUMNS = {"ms_of_day": "underlying_ms_of_day", "close": "underlying_price"}
+
+
+def contract_key(expiration, strike, right):
+    """
+    Codifica (expiration, strike, right) in un unico int64: expiration YYYYMMDD (25 bit),
+    strike in millesimi di dollaro (32 bit) e right (1 bit, P=1). L'ordine delle chiavi coincide
+    con l'ordine lessicografico della tupla.
+    """
+    expiration = np.asarray(expiration, dtype=np.int64)
+    strike = np.asarray(strike, dtype=np.int64)
+    put = (pd.Series(np.asarray(right)).astype(str).str.upper().str[:1] == "P").to_numpy(dtype=np.int64)
+    return (expiration << 33) | (strike << 1) | put
+
+
+class _SortedFrame:
+    """DataFrame ordinato una sola volta per (date, contratto, ms_of_day), con le chiavi come array NumPy."""
+
+    def __init__(self, df, contract=True):
+        date = df["date"].to_numpy(dtype=np.int64)
+        ms = df["ms_of_day"].to_numpy(dtype=np.int64) if "ms_of_day" in df.columns else np.zeros(len(df), dtype=np.int64)
+        ck = contract_key(df["expiration"], df["strike"], df["right"]) if contract else np.zeros(len(df), dtype=np.int64)
+        order = np.lexsort((ms, ck, date))
+        self.df = df.iloc[order].reset_index(drop=True)
+        self.date, self.ck, self.ms = date[order], ck[order], ms[order]
+        self.has_time = "ms_of_day" in df.columns
+
+    def day_slice(self, day):
+        return np.searchsorted(self.date, day, side="left"), np.searchsorted(self.date, day, side="right")
 
-    # Unione basata su strike, expiration, type (C/P) e timestamp
-    merged_df = options_df.copy()
 
-    if greeks_df is not None:
-        merged_df = merged_df.merge(greeks_df, on=["date", "symbol", "strike", "expiration", "type"], how="left")
+def _exact_indices(left, ls, le, right, rs, re, on_time):
+    """
+    Indici (nel frame destro, -1 se assente) delle righe con stesso contratto (e stesso ms_of_day
+    se on_time) delle righe sinistre della giornata [ls, le).
 
-    if iv_df is not None:
-        merged_df = merged_df.merge(iv_df, on=["date", "symbol", "strike", "expiration", "type"], how="left")
+    Dentro una giornata il contratto viene sostituito dal suo rango tra i contratti del lato destro,
+    così (rango, ms_of_day) entra in un int64 già ordinato: nessun ordinamento per giornata.
+    """
+    if re == rs:
+        return np.full(le - ls, -1, dtype=np.int64)
+    rck = right.ck[rs:re]
+    change = np.concatenate(([True], rck[1:] != rck[:-1]))
+    unique_ck = rck[change]
+    rank = np.cumsum(change) - 1
+    lck = left.ck[ls:le]
+    lrank = np.minimum(np.searchsorted(unique_ck, lck), len(unique_ck) - 1)
+    same_contract = unique_ck[lrank] == lck
+    if on_time:
+        right_key = rank * MS_PER_DAY + right.ms[rs:re]
+        left_key = lrank * MS_PER_DAY + left.ms[ls:le]
+    else:
+        right_key, left_key = rank, lrank
+    pos = np.minimum(np.searchsorted(right_key, left_key), len(right_key) - 1)
+    found = same_contract & (right_key[pos] == left_key)
+    return np.where(found, rs + pos, -1)
 
-    if oi_df is not None:
-        merged_df = merged_df.merge(oi_df, on=["date", "symbol", "strike", "expiration", "type"], how="left")
 
-    return merged_df
+def _asof_indices(left, ls, le, right, rs, re, intraday):
+    """Indice della barra dell'underlying con ms_of_day <= quello della riga (stessa giornata); -1 se assente."""
+    if re == rs:
+        return np.full(le - ls, -1, dtype=np.int64)
+    if not intraday:
+        # Daily: una sola barra per giornata, si usa l'ultima
+        return np.full(le - ls, re - 1, dtype=np.int64)
+    pos = np.searchsorted(right.ms[rs:re], left.ms[ls:le], side="right") - 1
+    return np.where(pos >= 0, rs + pos, -1)
 
 
-def merge_downloaded_data(self, file_path, new_data):
-    """Merges newly downloaded data with existing data, ensuring column consistency."""
-    
-    if not os.path.exists(file_path):
-        new_data.to_parquet(file_path, compression="zstd")
+def _take(values, idx):
+    """values[idx] con valori mancanti dove idx == -1 (gli interi diventano float, i categorical restano tali)."""
+    if len(idx) and idx.min() >= 0:
+        return values[idx]
+    return pd.api.extensions.take(values, idx, allow_fill=True)
+
+
+def iter_joined_days(options_df, greeks_df=None, iv_df=None, oi_df=None, underlying_df=None, intraday=False):
+    """
+    Join vettoriale giornata per giornata di opzioni con greche, IV, open interest e underlying.
+
+    Ogni input viene ordinato una sola volta; poi per ogni giornata:
+        - greche e IV: join esatto su contratto (+ ms_of_day se intraday),
+        - open interest: join esatto su contratto e data (una rilevazione al giorno),
+        - underlying: join as-of all'ultima barra con ms_of_day <= quello della riga (daily: stessa data),
+          che aggiunge underlying_ms_of_day e underlying_price.
+
+    Le colonne già presenti a sinistra non vengono sovrascritte. La memoria di lavoro è limitata a
+    una giornata alla volta.
+
+    Yields:
+        pd.DataFrame: righe di opzioni di una giornata con le colonne aggiunte.
+    """
+    if options_df is None or len(options_df) == 0:
         return
+    left = _SortedFrame(options_df)
+    columns = set(left.df.columns)
+    exact = []
+    for df, on_time in ((greeks_df, intraday), (iv_df, intraday), (oi_df, False)):
+        if df is None or len(df) == 0:
+            continue
+        right = _SortedFrame(df)
+        added = {c: c for c in df.columns if c not in JOIN_KEYS and c not in columns}
+        columns.update(added)
+        exact.append((right, on_time and right.has_time and left.has_time, added))
+    asof = None
+    if underlying_df is not None and len(underlying_df):
+        right = _SortedFrame(underlying_df, contract=False)
+        added = {c: name for c, name in UNDERLYING_COLUMNS.items() if c in underlying_df.columns and name not in columns}
+        asof = (right, added)
+
+    metrics = get_default_metrics()
+    days = np.unique(left.date)
+    for day in days:
+        ls, le = left.day_slice(day)
+        with metrics.timer("merge", rows=le - ls):
+            out = left.df.iloc[ls:le].reset_index(drop=True)
+            for right, on_time, added in exact:
+                rs, re = right.day_slice(day)
+                idx = _exact_indices(left, ls, le, right, rs, re, on_time)
+                for source, name in added.items():
+                    out[name] = _take(right.df[source].array, idx)
+            if asof is not None:
+                right, added = asof
+                rs, re = right.day_slice(day)
+                idx = _asof_indices(left, ls, le, right, rs, re, intraday)
+                for source, name in added.items():
+                    out[name] = _take(right.df[source].array, idx)
+        yield out
+
+
+def merge_option_data(self, options_df, greeks_df=None, iv_df=None, oi_df=None, underlying_df=None, intraday=False):
+    """Unisce opzioni con greche, IV, OI e underlying sulle righe giuste (vedi iter_joined_days)."""
+    if options_df is None:
+        return None
+    chunks = list(iter_joined_days(options_df, greeks_df, iv_df, oi_df, underlying_df, intraday))
+    if not chunks:
+        return options_df.iloc[0:0]
+    return pd.concat(chunks, ignore_index=True)
+
 
-    existing_data = pd.read_parquet(file_path)
+def merge_downloaded_data(self, file_path, new_data, kind=None):
+    """
+    Appends newly downloaded data to the dataset at file_path, ensuring column consistency.
 
-    if set(existing_data.columns) != set(new_data.columns):
-        raise ValueError(f"Column mismatch detected. Existing: {list(existing_data.columns)}, New: {list(new_data.columns)}")
+    file_path is a directory partitioned by `date` (date=YYYYMMDD/part-*.parquet): new rows are
+    written as new immutable fragments, existing data is never read back or rewritten.
+    kind selects the canonical schema (see utils.schema) applied before the column check; with a
+    kind, rows repeating a primary key inside new_data collapse to the last one (utils.upsert), and
+    stored rows with the same key are replaced by the newer fragment at compaction time.
+    """
+    if kind is not None:
+        new_data = normalize(new_data, kind)
+        key = primary_key(kind, new_data.columns)
+        if key:
+            new_data, stats = upsert(new_data.iloc[0:0], new_data, key)
+            if stats["dropped"]:
+                logger.info(f"🔁 {stats['dropped']} righe duplicate sostituite dalla più recente ({stats['rows']} righe da salvare).",
+                            extra={"dataset": file_path, **stats})
+    existing_dates = partition_values(file_path)
+    if existing_dates:
+        # Only the schema stored in the footer of one fragment is read
+        existing_columns = set(ds.dataset(file_path, format="parquet", partitioning="hive").schema.names)
+        if existing_columns != set(new_data.columns):
+            raise ValueError(f"Column mismatch detected. Existing: {sorted(existing_columns)}, New: {list(new_data.columns)}")
 
-    merged_data = pd.concat([existing_data, new_data]).drop_duplicates().sort_values("date")
-    merged_data.to_parquet(file_path, compression="zstd")
+    return append_partitioned(file_path, new_data, kind=kind)
 
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """
+    Cache persistente (file JSON) dei metadati dei contratti: liste di root, scadenze e strike.
+
+    Ogni voce ha un TTL, tranne quelle marcate come immutabili (es. gli strike di una scadenza già
+    passata), che restano valide per sempre. Il file viene riscritto atomicamente a ogni modifica,
+    oppure una sola volta alla fine di un blocco `with cache.batch():`.
+    """
+
+    def __init__(self, path, ttl=config.METADATA_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._dirty = False
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"⚠️ Cache dei metadati illeggibile ({e}), verrà ricostruita: {path}")
+
+    def _is_valid(self, entry, ttl):
+        if entry.get("immutable"):
+            return True
+        return time.time() - entry["fetched_at"] < (self.ttl if ttl is None else ttl)
+
+    def get(self, key, ttl=None):
+        """Valore in cache se presente e non scaduto, altrimenti None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_valid(entry, ttl):
+                return entry["value"]
+        return None
+
+    def set(self, key, value, immutable=False):
+        with self._lock:
+            self._entries[key] = {"value": value, "fetched_at": time.time(), "immutable": bool(immutable)}
+            self._dirty = True
+            if self._batch_depth == 0:
+                self.save()
+
+    def get_or_fetch(self, key, fetch, immutable=False, ttl=None):
+        """
+        Restituisce il valore in cache oppure lo recupera con fetch() e lo salva.
+
+        I risultati vuoti non vengono salvati, così una risposta vuota dovuta a un errore
+        temporaneo non resta in cache.
+        """
+        value = self.get(key, ttl)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = fetch()
+        if value:
+            self.set(key, value, immutable=immutable)
+        return value
+
+    def invalidate(self, prefix=""):
+        """Rimuove le voci la cui chiave inizia con prefix (tutte se prefix è vuoto)."""
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+            self._dirty = True
+            if self._batch_depth == 0:
+                self.save()
+
+    @contextmanager
+    def batch(self):
+        """Raggruppa più modifiche in una sola scrittura su disco."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0 and self._dirty:
+                    self.save()
+
+    def save(self):
+        """Scrive la cache su disco (file temporaneo + rename atomico)."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -0,0 +1,258 @@
+import cProfile
+import io
+import json
+import logging
+import math
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Limiti superiori (secondi) dei bucket degli istogrammi di latenza
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+
+class Histogram:
+    """Istogramma a bucket fissi (conteggi non cumulativi, somma e numero di osservazioni)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Stima del quantile q come limite superiore del bucket che lo contiene."""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {("+Inf" if math.isinf(b) else str(b)): c for b, c in zip(self.buckets, self.counts)},
+        }
+
+
+def _endpoint_stats(buckets):
+    return {"latency": Histogram(buckets), "requests": 0, "bytes": 0, "rows": 0, "retries": 0, "errors": {}}
+
+
+def _stage_stats(buckets):
+    return {"seconds": Histogram(buckets), "rows": 0, "bytes": 0}
+
+
+class Metrics:
+    """
+    Registro thread-safe delle metriche del fetcher.
+
+    Per endpoint: istogramma delle latenze, richieste, byte e righe ricevuti, retry ed errori per codice.
+    Per fase locale (decode, normalize, merge, write): istogramma delle durate, righe e byte elaborati.
+    Esportabile come testo Prometheus (to_prometheus) o come snapshot JSON (snapshot / to_json).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._stages = {}
+
+    def _endpoint(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = _endpoint_stats(self.buckets)
+        return stats
+
+    def record_request(self, endpoint, seconds, status=None, retry=False):
+        """Registra un tentativo di richiesta; status è il codice HTTP o il nome dell'errore di rete."""
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats["latency"].observe(seconds)
+            stats["requests"] += 1
+            if retry:
+                stats["retries"] += 1
+            if status is not None and not (isinstance(status, int) and status < 400):
+                stats["errors"][str(status)] = stats["errors"].get(str(status), 0) + 1
+
+    def record_payload(self, endpoint, nbytes=0, rows=0):
+        """Byte e righe ricevuti da endpoint."""
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats["bytes"] += nbytes or 0
+            stats["rows"] += rows or 0
+
+    def record_stage(self, stage, seconds, rows=0, nbytes=0):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _stage_stats(self.buckets)
+            stats["seconds"].observe(seconds)
+            stats["rows"] += rows or 0
+            stats["bytes"] += nbytes or 0
+
+    @contextmanager
+    def timer(self, stage, rows=0, nbytes=0):
+        """
+        Misura la durata del blocco come fase `stage`. Il dizionario restituito può essere aggiornato
+        dentro il blocco con le righe/byte effettivamente elaborati.
+        """
+        info = {"rows": rows, "bytes": nbytes}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, info["rows"], info["bytes"])
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._stages.clear()
+
+    def snapshot(self):
+        """Snapshot serializzabile in JSON di tutte le metriche."""
+        with self._lock:
+            endpoints = {
+                endpoint: {**{k: v for k, v in stats.items() if k != "latency"}, "errors": dict(stats["errors"]),
+                           "latency": stats["latency"].to_dict()}
+                for endpoint, stats in self._endpoints.items()
+            }
+            stages = {
+                stage: {"rows": stats["rows"], "bytes": stats["bytes"], "seconds": stats["seconds"].to_dict()}
+                for stage, stats in self._stages.items()
+            }
+        return {"timestamp": time.time(), "endpoints": endpoints, "stages": stages}
+
+    def summary(self):
+        """Riepilogo su una riga: totali per endpoint e tempo speso in ciascuna fase."""
+        snapshot = self.snapshot()
+        endpoints = snapshot["endpoints"].values()
+        requests = sum(s["requests"] for s in endpoints)
+        retries = sum(s["retries"] for s in endpoints)
+        errors = sum(sum(s["errors"].values()) for s in endpoints)
+        mbytes = sum(s["bytes"] for s in endpoints) / 2**20
+        rows = sum(s["rows"] for s in endpoints)
+        stages = ", ".join(f"{stage} {stats['seconds']['sum']:.2f}s" for stage, stats in snapshot["stages"].items())
+        return (f"{requests} richieste ({retries} retry, {errors} errori), {mbytes:.1f} MB, {rows} righe"
+                + (f"; {stages}" if stages else ""))
+
+    def to_json(self, path=None):
+        """Snapshot JSON come stringa; se path è indicato viene anche scritto su file."""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return text
+
+    def to_prometheus(self, prefix="thetadata"):
+        """Metriche nel formato di esposizione testuale di Prometheus."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def histogram(name, help_text, label, items):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for key, hist in items:
+                cumulative = 0
+                for bound, count in hist["buckets"].items():
+                    cumulative += count
+                    lines.append(f'{prefix}_{name}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_sum{{{label}="{key}"}} {hist["sum"]}')
+                lines.append(f'{prefix}_{name}_count{{{label}="{key}"}} {hist["count"]}')
+
+        def counter(name, help_text, label, items):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for key, value in items:
+                lines.append(f'{prefix}_{name}{{{label}="{key}"}} {value}')
+
+        endpoints = snapshot["endpoints"]
+        histogram("request_duration_seconds", "Latency of terminal requests.", "endpoint",
+                  [(e, s["latency"]) for e, s in endpoints.items()])
+        counter("requests_total", "Requests sent to the terminal (retries included).", "endpoint",
+                [(e, s["requests"]) for e, s in endpoints.items()])
+        counter("retries_total", "Retried requests.", "endpoint", [(e, s["retries"]) for e, s in endpoints.items()])
+        counter("response_bytes_total", "Bytes received.", "endpoint", [(e, s["bytes"]) for e, s in endpoints.items()])
+        counter("response_rows_total", "Rows received.", "endpoint", [(e, s["rows"]) for e, s in endpoints.items()])
+        lines.append(f"# HELP {prefix}_errors_total Failed requests by status code.")
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for endpoint, stats in endpoints.items():
+            for code, count in stats["errors"].items():
+                lines.append(f'{prefix}_errors_total{{endpoint="{endpoint}",code="{code}"}} {count}')
+
+        stages = snapshot["stages"]
+        histogram("stage_duration_seconds", "Time spent in local processing stages.", "stage",
+                  [(s, v["seconds"]) for s, v in stages.items()])
+        counter("stage_rows_total", "Rows processed by stage.", "stage", [(s, v["rows"]) for s, v in stages.items()])
+        counter("stage_bytes_total", "Bytes processed by stage.", "stage", [(s, v["bytes"]) for s, v in stages.items()])
+        return "\n".join(lines) + "\n"
+
+
+_default_metrics = Metrics()
+
+
+def get_default_metrics():
+    """Registro di metriche condiviso dal processo (usato dal client HTTP e dallo storage)."""
+    return _default_metrics
+
+
+@contextmanager
+def profiled(profiler="cprofile", output=None, top=30):
+    """
+    Profila il blocco con cProfile o pyinstrument (opzionale, se installato).
+
+    Con cProfile le statistiche vengono salvate in output (file .prof, leggibile con snakeviz/pstats)
+    oppure le prime `top` funzioni per tempo cumulativo finiscono nel log. Con pyinstrument output
+    è un file HTML.
+    """
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise ImportError("pyinstrument non è installato: pip install pyinstrument") from None
+        profile = Profiler()
+        profile.start()
+        try:
+            yield profile
+        finally:
+            profile.stop()
+            if output:
+                with open(output, "w", encoding="utf-8") as f:
+                    f.write(profile.output_html())
+            else:
+                logger.info(profile.output_text(unicode=True, color=False))
+        return
+
+    if profiler != "cprofile":
+        raise ValueError(f"Unknown profiler: {profiler}. Must be 'cprofile' or 'pyinstrument'.")
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if output:
+            profile.dump_stats(output)
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(top)
+            logger.info(stream.getvalue())
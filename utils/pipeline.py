@@ -0,0 +1,220 @@
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import pandas as pd
+
+import config
+from utils.concurrency import TaskResult
+from utils.decoder import DEFAULT_CHUNK_SIZE, decode_stream
+from utils.metrics import get_default_metrics
+from utils.storage import append_partitioned
+
+logger = logging.getLogger(__name__)
+
+
+def _attach(name):
+    """
+    Apre un blocco di memoria condivisa creato dal processo principale, che resta l'unico a rimuoverlo.
+    Prima di Python 3.13 il blocco viene registrato anche nel resource tracker, che però è condiviso
+    con il processo principale: la rimozione finale lo deregistra una volta sola.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_context():
+    """
+    Contesto dei processi del pool: forkserver dove disponibile, altrimenti spawn. Mai fork: i processi
+    vengono avviati mentre i thread di fetch sono già attivi, e un figlio creato con fork erediterebbe
+    i lock (metriche, logging, pool HTTP) tenuti in quel momento da quei thread.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+
+def _stage_delta(before, after):
+    """Fasi misurate tra due snapshot delle metriche: stage -> {seconds, rows, bytes}."""
+    delta = {}
+    for stage, stats in after.items():
+        prev = before.get(stage, {"rows": 0, "bytes": 0, "seconds": {"sum": 0.0}})
+        delta[stage] = {"seconds": stats["seconds"]["sum"] - prev["seconds"]["sum"],
+                        "rows": stats["rows"] - prev["rows"], "bytes": stats["bytes"] - prev["bytes"]}
+    return delta
+
+
+def process_body(shm_name, size, bulk, sink):
+    """
+    Eseguito nel pool di processi: decodifica il corpo di una risposta dalla memoria condivisa,
+    lo normalizza nello schema canonico e lo scrive come frammenti Parquet.
+
+    Args:
+        shm_name (str), size (int): Blocco di memoria condivisa con il corpo della risposta.
+        bulk (bool): Risposta di un endpoint /v2/bulk_hist/* (vedi utils.decoder).
+        sink (dict): Destinazione: dataset_dir, kind, name (vedi utils.storage.append_partitioned),
+            assign (colonne costanti da aggiungere) e drop (colonne da rimuovere).
+
+    Returns:
+        dict: rows, paths e le statistiche delle fasi (decode, normalize, write) misurate per questo
+            corpo, come differenza tra due snapshot: il registro del processo non viene mai azzerato.
+    """
+    metrics = get_default_metrics()
+    before = metrics.snapshot()["stages"]
+    shm = _attach(shm_name)
+    try:
+        body = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+
+    with metrics.timer("decode", nbytes=size) as stage:
+        chunks = (body[i:i + DEFAULT_CHUNK_SIZE] for i in range(0, size, DEFAULT_CHUNK_SIZE))
+        _, arrays = decode_stream(chunks, bulk=bulk)
+        rows = len(next(iter(arrays.values()))) if arrays else 0
+        stage["rows"] = rows
+    del body
+    if not rows:
+        return {"rows": 0, "paths": [], "stages": _stage_delta(before, metrics.snapshot()["stages"])}
+
+    df = pd.DataFrame(arrays, copy=False).drop(columns=sink.get("drop", []), errors="ignore")
+    for column, value in sink.get("assign", {}).items():
+        df[column] = value
+    paths = append_partitioned(sink["dataset_dir"], df, kind=sink.get("kind"), name=sink.get("name"))
+    return {"rows": rows, "paths": paths, "stages": _stage_delta(before, metrics.snapshot()["stages"])}
+
+
+class IngestPipeline:
+    """
+    Ingest a stadi: fetch (thread, I/O di rete) -> decode -> normalize -> write (pool di processi).
+
+    I thread scaricano i corpi delle risposte e li copiano in blocchi di memoria condivisa; una coda
+    limitata (queue_size) li passa ai processi, così la memoria resta limitata e il download rallenta
+    se la decodifica non tiene il passo. I processi decodificano, normalizzano e comprimono i
+    frammenti Parquet in parallelo su tutti i core mentre i thread continuano a scaricare: al
+    processo principale tornano solo righe e percorsi scritti, nessun DataFrame viene serializzato.
+
+    I processi vengono avviati con forkserver (spawn su Windows), mai con fork: lo script che usa la
+    pipeline deve avere la guardia `if __name__ == "__main__":`.
+    """
+
+    def __init__(self, client, fetch_concurrency=4, processes=None, queue_size=config.PIPELINE_QUEUE_SIZE):
+        self.client = client
+        self.fetch_concurrency = max(1, fetch_concurrency or 1)
+        self.processes = processes or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.metrics = client.metrics
+
+    def run(self, items, request, on_written=None):
+        """
+        Scarica, decodifica e scrive tutti gli item.
+
+        Args:
+            items (list): Item da elaborare (es. task della coda dei job).
+            request (callable): request(item) -> (endpoint, params, bulk, sink), chiamata nel thread di fetch.
+            on_written (callable): on_written(item, result) chiamata nel processo principale dopo la
+                scrittura (result è il dizionario di process_body, None se il terminale non ha dati).
+
+        Returns:
+            list: TaskResult con task=(item,), in ordine di completamento; gli errori di qualunque fase
+                finiscono nel TaskResult invece di fermare la pipeline.
+        """
+        items = list(items)
+        fetched = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        results, in_flight = [], {}
+        max_in_flight = self.processes * 2
+
+        def finish(item, result=None, error=None):
+            if error is None and on_written is not None:
+                try:
+                    on_written(item, result)
+                except Exception as e:
+                    error = e
+            results.append(TaskResult((item,), result, error))
+
+        # Il pool di processi viene creato prima dei thread di fetch
+        with ProcessPoolExecutor(self.processes, mp_context=_worker_context()) as workers, \
+                ThreadPoolExecutor(self.fetch_concurrency) as fetchers:
+            fetch_futures = [fetchers.submit(self._fetch, item, request, fetched, stop) for item in items]
+            try:
+                while len(results) < len(items):
+                    while len(in_flight) < max_in_flight and len(results) + len(in_flight) < len(items):
+                        try:
+                            item, body, error = fetched.get(timeout=0.05 if in_flight else None)
+                        except queue.Empty:
+                            break
+                        if error is not None or body is None:
+                            finish(item, error=error)
+                            continue
+                        endpoint, shm, size, bulk, sink = body
+                        try:
+                            future = workers.submit(process_body, shm.name, size, bulk, sink)
+                        except Exception as e:
+                            # Pool rotto (un processo è morto): il blocco non arriverà mai a un processo
+                            _release(shm)
+                            finish(item, error=e)
+                            continue
+                        in_flight[future] = (item, endpoint, shm)
+                    if not in_flight:
+                        continue
+                    done, _ = wait(list(in_flight), timeout=0.05, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item, endpoint, shm = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            finish(item, error=e)
+                            continue
+                        finally:
+                            _release(shm)
+                        self._record(endpoint, result)
+                        finish(item, result)
+            finally:
+                # Interruzione: ferma i fetch, libera la coda (sblocca i thread in attesa) e la memoria condivisa
+                stop.set()
+                while not all(f.done() for f in fetch_futures) or not fetched.empty():
+                    try:
+                        _, body, _ = fetched.get(timeout=0.05)
+                    except queue.Empty:
+                        continue
+                    if body is not None:
+                        _release(body[1])
+                for _, _, shm in in_flight.values():
+                    _release(shm)
+        return results
+
+    def _fetch(self, item, request, fetched, stop):
+        """Thread di fetch: scarica il corpo della risposta e lo mette in coda in un blocco di memoria condivisa."""
+        if stop.is_set():
+            fetched.put((item, None, RuntimeError("Pipeline interrotta")))
+            return
+        try:
+            endpoint, params, bulk, sink = request(item)
+            data = self.client.get_bytes(endpoint, params=params)
+            body = None
+            if data:
+                shm = shared_memory.SharedMemory(create=True, size=len(data))
+                shm.buf[:len(data)] = data
+                body = (endpoint, shm, len(data), bulk, sink)
+            fetched.put((item, body, None))
+        except Exception as e:
+            fetched.put((item, None, e))
+
+    def _record(self, endpoint, result):
+        """Riporta nel registro del processo principale righe e fasi misurate nel processo figlio."""
+        self.metrics.record_payload(endpoint, 0, result["rows"])
+        for stage, stats in result["stages"].items():
+            self.metrics.record_stage(stage, stats["seconds"], stats["rows"], stats["bytes"])
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,178 @@
+import json
+import logging
+import zlib
+import numpy as np
+import pandas as pd
+
+import config
+from utils.manifest import NO_CONTRACT
+from utils.merge_data import contract_key
+from utils.metrics import get_default_metrics
+from utils.trading_calendar import session_bounds, trading_days
+
+logger = logging.getLogger(__name__)
+
+# Ricampionamento locale delle barre intraday: i timeframe più ampi (5/15/30 minuti, 1 ora) vengono
+# costruiti dalle barre a 1 minuto già salvate invece di essere scaricati di nuovo dal terminale.
+# Le barre sono allineate all'apertura della sessione (09:30, 09:35, ...; 1 ora: 09:30, 10:30, ...,
+# 15:30 con l'ultima barra di mezz'ora) e hanno come ms_of_day l'inizio della barra, come quelle
+# del terminale.
+
+# Colonne dei contratti (presenti solo nei dataset di opzioni)
+CONTRACT_COLUMNS = ("expiration", "strike", "right")
+
+
+def can_resample(timeframe, source=config.RESAMPLE_SOURCE_TIMEFRAME):
+    """True se timeframe è un multiplo intero (più ampio) del timeframe di origine."""
+    intervals = config.INTRADAY_TIMEFRAMES
+    if timeframe not in intervals or source not in intervals:
+        return False
+    return intervals[timeframe] > intervals[source] and intervals[timeframe] % intervals[source] == 0
+
+
+def resample_order(timeframes, source=config.RESAMPLE_SOURCE_TIMEFRAME):
+    """I timeframe nell'ordine di aggiornamento: quello di origine per primo, così gli altri vengono ricampionati da dati aggiornati."""
+    timeframes = list(timeframes)
+    return sorted(timeframes, key=lambda timeframe: timeframe != source) if source in timeframes else timeframes
+
+
+def bucket_start(date, ms_of_day, interval_ms):
+    """ms_of_day di inizio della barra di interval_ms che contiene ciascuna riga, allineata all'apertura della sessione."""
+    unique, inverse = np.unique(np.asarray(date, dtype=np.int64), return_inverse=True)
+    open_ms, _ = session_bounds(pd.to_datetime(unique.astype(str), format="%Y%m%d").values.astype("datetime64[D]"))
+    open_ms = open_ms[inverse]
+    return open_ms + np.floor_divide(np.asarray(ms_of_day, dtype=np.int64) - open_ms, interval_ms) * interval_ms
+
+
+def resample_bars(df, interval_ms, kind):
+    """
+    Aggrega barre (di una o più giornate, di uno o più contratti) in barre di interval_ms.
+
+    Le righe vengono ordinate una volta per (date, contratto, ms_of_day); i confini delle barre sono i
+    cambi di (date, contratto, barra) e ogni colonna viene aggregata con una riduzione NumPy sui
+    segmenti (reduceat), senza groupby.
+
+    Args:
+        kind (str): Schema delle barre (utils.schema.SCHEMAS):
+            - "ohlc": open della prima barra con scambi, high/low massimo e minimo, close dell'ultima,
+              volume e count sommati; le barre senza scambi (count = 0) hanno prezzi a zero come
+              quelle del terminale.
+            - "quote" e "price": fotografia all'inizio della barra (la prima riga), come le quote a
+              intervallo del terminale.
+
+    Returns:
+        pd.DataFrame: Una riga per barra con le stesse colonne di df.
+    """
+    if kind not in ("ohlc", "quote", "price"):
+        raise ValueError(f"Invalid kind: {kind}. Must be 'ohlc', 'quote' or 'price'.")
+    if df is None or len(df) == 0:
+        return df
+    date = df["date"].to_numpy(dtype=np.int64)
+    ms = df["ms_of_day"].to_numpy(dtype=np.int64)
+    has_contract = all(column in df.columns for column in CONTRACT_COLUMNS)
+    ck = contract_key(df["expiration"], df["strike"], df["right"]) if has_contract else np.zeros(len(df), dtype=np.int64)
+    order = np.lexsort((ms, ck, date))
+    date, ck, ms = date[order], ck[order], ms[order]
+    bucket = bucket_start(date, ms, interval_ms)
+    change = np.ones(len(order), dtype=bool)
+    change[1:] = (date[1:] != date[:-1]) | (ck[1:] != ck[:-1]) | (bucket[1:] != bucket[:-1])
+    starts = np.flatnonzero(change)
+
+    out = df.iloc[order[starts]].reset_index(drop=True)
+    out["ms_of_day"] = bucket[starts].astype(df["ms_of_day"].dtype)
+    if kind != "ohlc":
+        return out
+
+    n = len(order)
+    traded = df["count"].to_numpy()[order] > 0 if "count" in df.columns else np.ones(n, dtype=bool)
+    position = np.arange(n)
+    first = np.minimum.reduceat(np.where(traded, position, n), starts)
+    last = np.maximum.reduceat(np.where(traded, position, -1), starts)
+    any_trade = last >= 0
+
+    def column(name):
+        return df[name].to_numpy(dtype=np.float64, na_value=np.nan)[order]
+
+    out["open"] = np.where(any_trade, column("open")[np.minimum(first, n - 1)], 0.0)
+    out["close"] = np.where(any_trade, column("close")[np.maximum(last, 0)], 0.0)
+    out["high"] = np.where(any_trade, np.fmax.reduceat(np.where(traded, column("high"), np.nan), starts), 0.0)
+    out["low"] = np.where(any_trade, np.fmin.reduceat(np.where(traded, column("low"), np.nan), starts), 0.0)
+    for name in ("volume", "count"):
+        if name in df.columns:
+            out[name] = np.add.reduceat(df[name].to_numpy(dtype=np.int64)[order], starts)
+    return out
+
+
+def _covered_mask(sessions, intervals):
+    """Maschera delle sessioni comprese in uno degli intervalli (start, end) ordinati."""
+    mask = np.zeros(len(sessions), dtype=bool)
+    for start, end in intervals:
+        lo = np.searchsorted(sessions, np.datetime64(start.date(), "D"), side="left")
+        hi = np.searchsorted(sessions, np.datetime64(end.date(), "D"), side="right")
+        mask[lo:hi] = True
+    return mask
+
+
+def pending_sessions(manifest, symbol, data_type, timeframe, start_date, end_date, source=config.RESAMPLE_SOURCE_TIMEFRAME):
+    """
+    Sessioni di [start_date, end_date] coperte nel timeframe di origine ma non in timeframe, ricavate
+    dal solo manifest (due query).
+
+    Returns:
+        dict: data YYYYMMDD (int) -> lista dei contratti (expiration, strike, right) da ricampionare
+            (NO_CONTRACT per i dati senza contratto).
+    """
+    sessions = trading_days(start_date, end_date)
+    if not len(sessions):
+        return {}
+    days = pd.DatetimeIndex(sessions).strftime("%Y%m%d").astype(int)
+    target = manifest.coverage(symbol, data_type, timeframe)
+    pending = {}
+    for contract, intervals in manifest.coverage(symbol, data_type, source).items():
+        mask = _covered_mask(sessions, intervals) & ~_covered_mask(sessions, target.get(contract, []))
+        for day in days[mask]:
+            pending.setdefault(int(day), []).append(contract)
+    return dict(sorted(pending.items()))
+
+
+def resample_dataset(store, manifest, symbol, data_type, timeframe, start_date, end_date, kind,
+                     source=config.RESAMPLE_SOURCE_TIMEFRAME):
+    """
+    Costruisce le barre di timeframe dalle barre di source già salvate, solo per le sessioni (e i
+    contratti) coperti in source e non ancora in timeframe: rieseguito dopo un aggiornamento tocca
+    soltanto le nuove partizioni. Ogni sessione viene letta, aggregata, salvata e registrata nel
+    manifest come coperta; i frammenti hanno un nome deterministico, quindi ripetere una sessione
+    interrotta prima della registrazione li sostituisce invece di duplicarli.
+
+    Returns:
+        list: Sessioni (YYYYMMDD) ricampionate.
+    """
+    if not can_resample(timeframe, source):
+        raise ValueError(f"Invalid timeframe: {timeframe}. Must be a multiple of {source}.")
+    pending = pending_sessions(manifest, symbol, data_type, timeframe, start_date, end_date, source)
+    if not pending:
+        return []
+    interval_ms = config.INTRADAY_TIMEFRAMES[timeframe]
+    metrics = get_default_metrics()
+    rows = 0
+    for day, contracts in pending.items():
+        # Lettura senza cache delle tabelle: ogni partizione di origine viene letta una sola volta
+        source_df = store.query(symbol, data_type, source, day, day, output="scanner").to_table().to_pandas()
+        is_contract_data = contracts != [NO_CONTRACT]
+        if is_contract_data and len(source_df):
+            wanted = contract_key(*zip(*contracts)) if contracts else np.array([], dtype=np.int64)
+            keys = contract_key(source_df["expiration"], source_df["strike"], source_df["right"])
+            source_df = source_df[np.isin(keys, wanted)]
+        with metrics.timer("resample", rows=len(source_df)):
+            bars = resample_bars(source_df, interval_ms, kind)
+        if bars is not None and len(bars):
+            name = "resampled"
+            if is_contract_data:
+                name += f"-{zlib.crc32(json.dumps(sorted(contracts)).encode()):08x}"
+            store.append(bars, symbol, data_type, timeframe, kind=kind, name=name)
+            rows += len(bars)
+        # La sessione è definitiva nel timeframe di origine, quindi lo è anche quella ricampionata
+        manifest.add(symbol, data_type, timeframe, day, day, contracts=contracts if is_contract_data else None, include_today=True)
+    logger.info(f"🧮 {symbol} {data_type} {timeframe}: {len(pending)} sessioni ricampionate da {source} ({rows} barre)",
+                extra={"symbol": symbol, "data_type": data_type, "timeframe": timeframe, "sessions": len(pending), "rows": rows})
+    return list(pending)
@@ -0,0 +1,96 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+class RingBuffer:
+    """
+    Buffer circolare a colonne di dimensione fissa, basato su array NumPy preallocati.
+
+    Ogni colonna è allocata due volte la capacità e ogni riga viene scritta in due posizioni
+    (i e i + capacity): qualunque finestra delle ultime n righe è quindi una slice contigua e
+    view()/since() restituiscono viste in sola lettura, senza copie. Le viste restano valide finché
+    non vengono aggiunte altre `capacity - n` righe; chi deve conservarle più a lungo le copia.
+
+    Ogni riga ha un numero di sequenza crescente (0, 1, 2, ...): un consumatore ricorda l'ultimo
+    numero letto e con since() riceve solo le righe nuove.
+
+    Args:
+        capacity (int): Righe conservate.
+        columns (dict): Colonna -> dtype NumPy (es. {"ms_of_day": "int32", "close": "float32", "right": "U1"}).
+    """
+
+    def __init__(self, capacity, columns):
+        if capacity <= 0:
+            raise ValueError(f"Invalid capacity: {capacity}. Must be positive.")
+        self.capacity = int(capacity)
+        self.columns = {name: np.dtype(dtype) for name, dtype in columns.items()}
+        self._data = {name: np.zeros(2 * self.capacity, dtype=dtype) for name, dtype in self.columns.items()}
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._written, self.capacity)
+
+    @property
+    def written(self):
+        """Numero di sequenza della prossima riga (= righe scritte dalla creazione)."""
+        return self._written
+
+    def extend(self, values):
+        """
+        Aggiunge righe da un dict colonna -> array (o da un DataFrame); le colonne mancanti restano a zero.
+        Se le righe sono più della capacità vengono conservate solo le ultime.
+
+        Returns:
+            int: Righe aggiunte.
+        """
+        n = len(next(iter(values.values()))) if isinstance(values, dict) else len(values)
+        if n == 0:
+            return 0
+        skip = max(0, n - self.capacity)
+        with self._lock:
+            start = (self._written + skip) % self.capacity
+            positions = (start + np.arange(n - skip)) % self.capacity
+            for name, column in self._data.items():
+                if name not in values:
+                    continue
+                array = np.asarray(values[name])[skip:]
+                column[positions] = array
+                column[positions + self.capacity] = array
+            self._written += n
+        return n
+
+    def _window(self, first, last):
+        """Viste delle righe con sequenza [first, last) (già ristrette a quelle conservate)."""
+        n = last - first
+        start = first % self.capacity
+        views = {}
+        for name, column in self._data.items():
+            view = column[start:start + n]
+            view.flags.writeable = False
+            views[name] = view
+        return views
+
+    def view(self, n=None):
+        """Ultime n righe (tutte quelle conservate se None) come dict colonna -> vista in sola lettura."""
+        with self._lock:
+            last = self._written
+            n = len(self) if n is None else min(n, len(self))
+            return self._window(last - n, last)
+
+    def since(self, sequence):
+        """
+        Righe con numero di sequenza >= sequence.
+
+        Returns:
+            tuple: (dict colonna -> vista, prossimo numero di sequenza, righe perse perché già sovrascritte).
+        """
+        with self._lock:
+            last = self._written
+            first = max(sequence, last - len(self))
+            return self._window(first, last), last, max(0, first - sequence)
+
+    def to_frame(self, n=None):
+        """Copia delle ultime n righe come DataFrame."""
+        return pd.DataFrame({name: view.copy() for name, view in self.view(n).items()})
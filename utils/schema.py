@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Versione dello schema canonico: va incrementata a ogni modifica di SCHEMAS, così i frammenti
+# scritti con uno schema precedente si riconoscono dai metadati del footer.
+SCHEMA_VERSION = 2
+
+SCHEMA_METADATA_KEY = b"thetadata.schema"
+SCHEMA_VERSION_METADATA_KEY = b"thetadata.schema_version"
+
+PRICE = "float32"
+SIZE = "int32"
+EXCHANGE = "int16"
+CONDITION = "int16"
+
+# Colonne che identificano il contratto, comuni a tutti i dati di opzioni
+CONTRACT_COLUMNS = {
+    "root": "category",
+    "expiration": "int32",
+    "strike": "int32",      # millesimi di dollaro, come restituito dal terminale
+    "right": "category",
+}
+
+_QUOTE = {
+    "bid_size": SIZE, "bid_exchange": EXCHANGE, "bid": PRICE, "bid_condition": CONDITION,
+    "ask_size": SIZE, "ask_exchange": EXCHANGE, "ask": PRICE, "ask_condition": CONDITION,
+}
+_OHLC = {"open": PRICE, "high": PRICE, "low": PRICE, "close": PRICE, "volume": "int64", "count": "int32"}
+
+# Schema canonico per tipo di dato, nell'ordine delle colonne salvate
+SCHEMAS = {
+    "eod": {"ms_of_day": "int32", "ms_of_day2": "int32", **_OHLC, **_QUOTE, "date": "int32"},
+    "ohlc": {"ms_of_day": "int32", **_OHLC, "date": "int32"},
+    "quote": {"ms_of_day": "int32", **_QUOTE, "date": "int32"},
+    "price": {"ms_of_day": "int32", "price": PRICE, "date": "int32"},
+    "greeks": {
+        "ms_of_day": "int32", "bid": PRICE, "ask": PRICE,
+        "delta": "float32", "theta": "float32", "vega": "float32", "rho": "float32",
+        "epsilon": "float32", "lambda": "float32",
+        "gamma": "float32", "vanna": "float32", "charm": "float32", "vomma": "float32", "veta": "float32",
+        "speed": "float32", "zomma": "float32", "color": "float32", "ultima": "float32",
+        "implied_vol": "float32", "iv_error": "float32",
+        "ms_of_day2": "int32", "underlying_price": PRICE, "underlying_ms_of_day": "int32",
+        "open_interest": "int32", "date": "int32",
+    },
+    "open_interest": {"ms_of_day": "int32", "open_interest": "int32", "date": "int32"},
+}
+
+# Tipo di schema per ciascun dataset salvato (type= nel percorso dello storage)
+DATASET_KINDS = {
+    "option_eod": "eod",
+    "option_quote": "quote",
+    "greeks": "greeks",
+    "open_interest": "open_interest",
+}
+
+# Chiave primaria di ciascuno schema (una riga per chiave): EOD e open interest hanno una rilevazione
+# al giorno, il cui ms_of_day è l'orario di pubblicazione e non fa parte della chiave.
+# Le colonne del contratto valgono solo per i dati di opzioni (vedi primary_key).
+_DAY_KEY = ("date", "expiration", "strike", "right")
+PRIMARY_KEYS = {
+    "eod": _DAY_KEY,
+    "open_interest": _DAY_KEY,
+    "ohlc": _DAY_KEY + ("ms_of_day",),
+    "quote": _DAY_KEY + ("ms_of_day",),
+    "price": _DAY_KEY + ("ms_of_day",),
+    "greeks": _DAY_KEY + ("ms_of_day",),
+}
+
+
+def primary_key(kind, columns):
+    """Colonne della chiave primaria di kind presenti in columns (es. senza date dentro una partizione date=)."""
+    if kind not in PRIMARY_KEYS:
+        raise ValueError(f"Unknown schema kind: {kind}. Must be one of {sorted(PRIMARY_KEYS)}.")
+    columns = set(columns)
+    return tuple(column for column in PRIMARY_KEYS[kind] if column in columns)
+
+
+def schema_for(kind, contract=False):
+    """Dizionario colonna -> dtype dello schema canonico (con le colonne del contratto se contract=True)."""
+    if kind not in SCHEMAS:
+        raise ValueError(f"Unknown schema kind: {kind}. Must be one of {sorted(SCHEMAS)}.")
+    schema = dict(SCHEMAS[kind])
+    if contract:
+        schema.update(CONTRACT_COLUMNS)
+    return schema
+
+
+def underlying_kind(timeframe):
+    """Schema dei dati dell'underlying (stock o indice): EOD per il daily, OHLC per l'intraday."""
+    return "eod" if timeframe == "daily" else "ohlc"
+
+
+def normalize(df, kind):
+    """
+    Converte df nello schema canonico compatto di `kind`.
+
+    Le colonne note vengono convertite al dtype canonico e ordinate come nello schema; le colonne
+    sconosciute vengono mantenute in coda. Le colonne del contratto (root, expiration, strike, right)
+    sono normalizzate quando presenti; `right` usa sempre le categorie ["C", "P"].
+    """
+    if df is None:
+        return None
+    schema = schema_for(kind, contract=True)
+    out = {}
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if column == "right":
+            values = pd.Categorical(values.astype(str).str.upper().str[0], categories=["C", "P"])
+        elif dtype == "category":
+            values = values.astype("category")
+        elif values.dtype != dtype:
+            if np.dtype(dtype).kind == "i" and values.isna().any():
+                values = values.astype(dtype.capitalize())  # intero nullable (Int32, ...)
+            else:
+                values = values.astype(dtype)
+        out[column] = values
+    extra = [column for column in df.columns if column not in schema]
+    result = pd.DataFrame(out, index=df.index)
+    if extra:
+        result = pd.concat([result, df[extra]], axis=1)
+    return result.reset_index(drop=True)
+
+
+def tag_table(table, kind):
+    """Aggiunge kind e versione dello schema ai metadati di una pyarrow.Table (finiscono nel footer Parquet)."""
+    metadata = dict(table.schema.metadata or {})
+    metadata[SCHEMA_METADATA_KEY] = kind.encode()
+    metadata[SCHEMA_VERSION_METADATA_KEY] = str(SCHEMA_VERSION).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def to_arrow(df, kind):
+    """Normalizza df e lo converte in una pyarrow.Table con kind e versione dello schema nei metadati."""
+    return tag_table(pa.Table.from_pandas(normalize(df, kind), preserve_index=False), kind)
+
+
+def read_schema_info(path):
+    """(kind, version) di un file Parquet; (None, 0) se scritto prima dell'introduzione dello schema."""
+    metadata = pq.read_metadata(path).metadata or {}
+    kind = metadata.get(SCHEMA_METADATA_KEY)
+    version = metadata.get(SCHEMA_VERSION_METADATA_KEY)
+    return (kind.decode() if kind else None), (int(version) if version else 0)
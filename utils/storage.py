@@ -0,0 +1,333 @@
+import json
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow.fs import LocalFileSystem
+
+import config
+from utils.metrics import get_default_metrics
+from utils.schema import DATASET_KINDS, normalize, schema_for, tag_table, underlying_kind
+from utils.table_cache import get_default_cache
+
+# Chiavi di partizione, nell'ordine in cui compaiono nel percorso
+PARTITION_KEYS = ("symbol", "type", "timeframe", "date")
+
+# Colonne che identificano un contratto di opzione
+CONTRACT_KEYS = ("expiration", "strike", "right")
+
+# Metadati del footer Parquet con l'elenco dei contratti presenti nel frammento
+# (permettono di ricostruire il manifest di copertura senza leggere i dati)
+CONTRACTS_METADATA_KEY = b"thetadata.contracts"
+
+# Metadati del footer con il numero di sequenza di scrittura del frammento: ordinano i frammenti di
+# una partizione dal più vecchio al più recente (l'ultima scrittura vince in compattazione). È un
+# orologio in ns reso strettamente crescente nel processo; i file compattati ricevono la sequenza
+# più alta tra i frammenti fusi, quindi restano più vecchi di quelli scritti dopo.
+SEQUENCE_METADATA_KEY = b"thetadata.sequence"
+_sequence_lock = threading.Lock()
+_last_sequence = 0
+
+# Scritture fatte da questo processo per cartella di dataset: insieme alle date di modifica delle
+# cartelle forma la versione delle tabelle in cache (l'mtime da solo ha una risoluzione di qualche ms)
+_generations = {}
+
+
+def _bump_generation(partition_dir):
+    dataset_dir = os.path.dirname(os.path.normpath(partition_dir))
+    _generations[dataset_dir] = _generations.get(dataset_dir, 0) + 1
+
+
+def timeframe_name(interval_ms=None):
+    """Nome del timeframe usato nei percorsi: "daily" oppure il nome in config.INTRADAY_TIMEFRAMES."""
+    if interval_ms is None:
+        return "daily"
+    for name, ms in config.INTRADAY_TIMEFRAMES.items():
+        if ms == interval_ms:
+            return name
+    return f"{interval_ms}ms"
+
+
+def next_sequence():
+    """Prossimo numero di sequenza di scrittura (ns dall'epoch, strettamente crescente nel processo)."""
+    global _last_sequence
+    with _sequence_lock:
+        _last_sequence = max(time.time_ns(), _last_sequence + 1)
+        return _last_sequence
+
+
+def fragment_sequence(path, metadata=None):
+    """Sequenza di scrittura di un frammento; per i frammenti scritti senza, la data di modifica in ns."""
+    if metadata is None:
+        metadata = pq.read_metadata(path).metadata or {}
+    sequence = metadata.get(SEQUENCE_METADATA_KEY)
+    return int(sequence) if sequence else os.stat(path).st_mtime_ns
+
+
+def write_fragment(directory, df, compression=config.PARQUET_COMPRESSION, kind=None, name=None, sequence=None, **write_options):
+    """
+    Scrive df come nuovo frammento Parquet immutabile in directory.
+
+    Il file viene scritto con un nome nascosto (ignorato dai lettori pyarrow) e poi rinominato
+    atomicamente, così un lettore non vede mai un frammento scritto a metà. Se kind è indicato,
+    tipo e versione dello schema canonico vengono salvati nel footer.
+
+    Se name è indicato il frammento si chiama part-{name}.parquet: riscrivere lo stesso frammento
+    (es. rieseguendo un task interrotto) lo sostituisce invece di duplicarne le righe.
+    sequence è il numero di sequenza di scrittura salvato nel footer (default: next_sequence()).
+    Le altre opzioni (row_group_size, use_dictionary, ...) vengono passate a pq.write_table.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = f"part-{name or uuid.uuid4().hex}.parquet"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    final_path = os.path.join(directory, name)
+    table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+    if set(CONTRACT_KEYS) <= set(table.column_names):
+        contracts = table.select(list(CONTRACT_KEYS)).group_by(list(CONTRACT_KEYS)).aggregate([]).to_pylist()
+        metadata = dict(table.schema.metadata or {})
+        metadata[CONTRACTS_METADATA_KEY] = json.dumps([[c[k] for k in CONTRACT_KEYS] for c in contracts]).encode()
+        table = table.replace_schema_metadata(metadata)
+    if kind is not None:
+        table = tag_table(table, kind)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SEQUENCE_METADATA_KEY] = str(sequence or next_sequence()).encode()
+    table = table.replace_schema_metadata(metadata)
+    with get_default_metrics().timer("write", rows=table.num_rows) as stage:
+        pq.write_table(table, tmp_path, compression=compression, **write_options)
+        os.replace(tmp_path, final_path)
+        _bump_generation(directory)
+        stage["bytes"] = os.path.getsize(final_path)
+    return final_path
+
+
+def append_partitioned(dataset_dir, df, partition_col="date", kind=None, name=None):
+    """
+    Aggiunge df a un dataset hive-partizionato su partition_col, un frammento per valore.
+
+    I dati esistenti non vengono mai letti né riscritti: il costo dipende solo dalla dimensione di df.
+    Se kind è indicato, df viene prima convertito nello schema canonico compatto (utils.schema);
+    name rende deterministici i nomi dei frammenti (vedi write_fragment).
+
+    Returns:
+        list: Percorsi dei frammenti scritti.
+    """
+    if df is None or len(df) == 0:
+        return []
+    if kind is not None:
+        with get_default_metrics().timer("normalize", rows=len(df)):
+            df = normalize(df, kind)
+    paths = []
+    for value, group in df.groupby(partition_col, sort=True):
+        directory = os.path.join(dataset_dir, f"{partition_col}={value}")
+        paths.append(write_fragment(directory, group.drop(columns=[partition_col]), kind=kind, name=name))
+    return paths
+
+
+def _day_number(value):
+    """Data (YYYYMMDD int/str, date o Timestamp) -> YYYYMMDD int, come nella partizione `date`."""
+    return int(pd.Timestamp(str(value)).strftime("%Y%m%d"))
+
+
+def partition_values(dataset_dir, partition_col="date"):
+    """Valori di partizione presenti nel dataset, ricavati dai nomi delle cartelle (nessun file aperto)."""
+    if not os.path.isdir(dataset_dir):
+        return []
+    prefix = f"{partition_col}="
+    values = []
+    for entry in os.scandir(dataset_dir):
+        if entry.is_dir() and entry.name.startswith(prefix):
+            values.append(int(entry.name[len(prefix):]))
+    return sorted(values)
+
+
+class DatasetStore:
+    """
+    Storage append-only dei dati scaricati con layout
+    `{root}/symbol=SPY/type=option_eod/timeframe=daily/date=20240102/part-<uuid>.parquet`.
+
+    Ogni scrittura crea nuovi frammenti immutabili; la lettura passa da un pyarrow dataset
+    con partizionamento hive, quindi i filtri su symbol/type/timeframe/date escludono
+    intere cartelle senza aprirne i file.
+    """
+
+    PARTITION_SCHEMA = pa.schema([
+        ("symbol", pa.string()),
+        ("type", pa.string()),
+        ("timeframe", pa.string()),
+        ("date", pa.int32()),
+    ])
+
+    def __init__(self, root_dir, cache=None):
+        self.root_dir = root_dir
+        # Tabelle già lette (utils.table_cache): condivise dal processo salvo cache esplicita
+        self.cache = cache if cache is not None else get_default_cache()
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def dataset_dir(self, symbol, data_type, timeframe):
+        return os.path.join(self.root_dir, f"symbol={symbol}", f"type={data_type}", f"timeframe={timeframe}")
+
+    def append(self, df, symbol, data_type, timeframe, kind=None, name=None):
+        """
+        Aggiunge df (che deve contenere la colonna `date` in formato YYYYMMDD) come nuovi frammenti.
+
+        kind è lo schema canonico da applicare (utils.schema.SCHEMAS); se omesso viene ricavato da
+        data_type tramite utils.schema.DATASET_KINDS, quando possibile.
+        """
+        kind = kind or DATASET_KINDS.get(data_type)
+        return append_partitioned(self.dataset_dir(symbol, data_type, timeframe), df, kind=kind, name=name)
+
+    def dates(self, symbol, data_type, timeframe):
+        """Date (YYYYMMDD, int) per cui esiste almeno un frammento."""
+        return partition_values(self.dataset_dir(symbol, data_type, timeframe))
+
+    def dataset(self, symbol=None, data_type=None, timeframe=None):
+        """
+        Restituisce un pyarrow dataset. Se symbol, data_type e timeframe sono tutti indicati il dataset
+        è limitato a quella cartella (la colonna `date` viene dal percorso), altrimenti copre tutto lo store.
+        """
+        if symbol is not None and data_type is not None and timeframe is not None:
+            path = self.dataset_dir(symbol, data_type, timeframe)
+            schema = pa.schema([self.PARTITION_SCHEMA.field("date")])
+        else:
+            path = self.root_dir
+            schema = self.PARTITION_SCHEMA
+        return ds.dataset(path, format="parquet", partitioning=ds.partitioning(schema, flavor="hive"))
+
+    def read(self, symbol, data_type, timeframe, columns=None, filter=None):
+        """
+        Legge i dati in un DataFrame leggendo solo le colonne richieste e le partizioni che soddisfano filter.
+        Letture ripetute degli stessi dati non modificati vengono servite dalla cache delle tabelle.
+        """
+        if not os.path.isdir(self.dataset_dir(symbol, data_type, timeframe)):
+            return pd.DataFrame(columns=columns)
+        return self.query(symbol, data_type, timeframe, columns=columns, filter=filter, output="pandas")
+
+    def fragments(self, symbol, data_type, timeframe, start=None, end=None):
+        """
+        Percorsi dei frammenti delle partizioni `date` comprese in [start, end]: vengono elencate solo le
+        cartelle delle date richieste, non l'intero dataset.
+        """
+        directory = self.dataset_dir(symbol, data_type, timeframe)
+        low = _day_number(start) if start is not None else None
+        high = _day_number(end) if end is not None else None
+        paths = []
+        for value in partition_values(directory):
+            if (low is not None and value < low) or (high is not None and value > high):
+                continue
+            day_dir = os.path.join(directory, f"date={value}")
+            # I frammenti in scrittura hanno un nome nascosto (.part-*.tmp) e vengono ignorati
+            paths.extend(sorted(entry.path for entry in os.scandir(day_dir)
+                                if entry.is_file() and entry.name.endswith(".parquet") and not entry.name.startswith((".", "_"))))
+        return paths
+
+    def query(self, symbol, data_type, timeframe, start=None, end=None, expirations=None, strikes=None, rights=None,
+              columns=None, filter=None, output="scanner", batch_size=config.QUERY_BATCH_SIZE):
+        """
+        Lettura lazy dei dati salvati con pushdown dei filtri.
+
+        Le date fuori da [start, end] vengono escluse dal percorso delle partizioni (i loro file non
+        vengono nemmeno elencati); i filtri su expirations, strikes e rights vengono valutati sulle
+        statistiche dei row group Parquet, quindi i row group che non possono contenere righe utili
+        non vengono letti. Si leggono solo le colonne richieste, con file mappati in memoria.
+
+        Args:
+            start, end: Intervallo di date (incluso); None = senza limite.
+            expirations (list): Scadenze (YYYYMMDD); strikes (list): strike come salvati (es. 470000);
+                rights (list): "C" e/o "P".
+            columns (list): Colonne da leggere (None = tutte, compresa `date`).
+            filter (pyarrow.dataset.Expression): Filtro aggiuntivo.
+            output (str):
+                - "scanner": pyarrow.dataset.Scanner (to_table, to_batches, to_reader, head, count_rows).
+                - "dataset": pyarrow dataset filtrato (proiezione delle colonne a carico del chiamante).
+                - "batches": iteratore di pyarrow.RecordBatch da al più batch_size righe.
+                - "polars": polars.LazyFrame (richiede polars).
+                - "table": pyarrow.Table già letta.
+                - "pandas": DataFrame già letto.
+
+        Le uscite "table" e "pandas" passano dalla cache delle tabelle: la stessa query sugli stessi
+        dati non modificati costa una lookup (più uno stat per partizione) invece di una lettura.
+        """
+        expression = filter
+        for column, values in (("expiration", expirations), ("strike", strikes), ("right", rights)):
+            if values is None:
+                continue
+            if column == "expiration":
+                values = [_day_number(value) for value in values]
+            elif column == "right":
+                values = [str(value).upper()[0] for value in values]
+            condition = ds.field(column).isin(list(values))
+            expression = condition if expression is None else expression & condition
+
+        if output in ("table", "pandas"):
+            directory = self.dataset_dir(symbol, data_type, timeframe)
+            low = _day_number(start) if start is not None else None
+            high = _day_number(end) if end is not None else None
+            key = (directory, low, high, tuple(columns) if columns else None, None if expression is None else str(expression))
+            load = lambda: self._dataset(symbol, data_type, timeframe, start, end).to_table(
+                columns=columns, filter=expression, batch_size=batch_size)
+            if self.cache.enabled:
+                table = self.cache.get_or_load(key, self._version(directory, low, high), load)
+            else:
+                table = load()
+            return table if output == "table" else table.to_pandas()
+
+        dataset = self._dataset(symbol, data_type, timeframe, start, end)
+        if output == "dataset":
+            return dataset if expression is None else dataset.filter(expression)
+        if output == "polars":
+            try:
+                import polars as pl
+            except ImportError:
+                raise ImportError("polars non è installato: pip install polars") from None
+            frame = pl.scan_pyarrow_dataset(dataset if expression is None else dataset.filter(expression))
+            return frame.select(columns) if columns else frame
+        scanner = dataset.scanner(columns=columns, filter=expression, batch_size=batch_size)
+        if output == "scanner":
+            return scanner
+        if output == "batches":
+            return scanner.to_batches()
+        raise ValueError(f"Invalid output: {output}. Must be 'scanner', 'dataset', 'batches', 'polars', 'table' or 'pandas'.")
+
+    def _dataset(self, symbol, data_type, timeframe, start=None, end=None):
+        """pyarrow dataset dei soli frammenti delle partizioni in [start, end], con file mappati in memoria."""
+        paths = self.fragments(symbol, data_type, timeframe, start, end)
+        if not paths:
+            return self._empty_dataset(data_type, timeframe)
+        partitioning = ds.partitioning(pa.schema([self.PARTITION_SCHEMA.field("date")]), flavor="hive")
+        return ds.dataset(paths, format="parquet", partitioning=partitioning,
+                          partition_base_dir=self.dataset_dir(symbol, data_type, timeframe),
+                          filesystem=LocalFileSystem(use_mmap=True))
+
+    @staticmethod
+    def _version(directory, low=None, high=None):
+        """
+        Versione dei dati di un dataset in [low, high]: (data, inode, mtime) di ogni cartella date= più le
+        scritture fatte da questo processo. Cambia quando un frammento viene aggiunto, sostituito o
+        rimosso, anche da un altro processo, senza aprire né elencare i file.
+        """
+        signature = []
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            return ()
+        with entries:
+            for entry in entries:
+                if not entry.is_dir() or not entry.name.startswith("date="):
+                    continue
+                value = int(entry.name[len("date="):])
+                if (low is not None and value < low) or (high is not None and value > high):
+                    continue
+                stat = entry.stat()
+                signature.append((value, stat.st_ino, stat.st_mtime_ns))
+        return _generations.get(os.path.normpath(directory), 0), tuple(sorted(signature))
+
+    def _empty_dataset(self, data_type, timeframe):
+        """Dataset vuoto con lo schema canonico del tipo di dato: le query senza frammenti restituiscono zero righe."""
+        kind = DATASET_KINDS.get(data_type) or underlying_kind(timeframe)
+        schema = schema_for(kind, contract=data_type in DATASET_KINDS)
+        empty = normalize(pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in schema.items()}), kind)
+        return ds.dataset(pa.Table.from_pandas(empty, preserve_index=False))
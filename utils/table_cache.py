@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+
+import config
+
+
+class TableCache:
+    """
+    Cache LRU di pyarrow.Table già decodificate, con un limite rigido di memoria.
+
+    Ogni voce è salvata con una versione (es. data di modifica e inode delle cartelle lette): se alla
+    lettura successiva la versione è cambiata la voce viene scartata e ricaricata. Quando la somma
+    dei byte supera max_bytes vengono eliminate le voci usate meno di recente; una tabella più grande
+    dell'intero budget non viene mai messa in cache.
+
+    Le tabelle Arrow sono immutabili, quindi la stessa istanza può essere restituita a più chiamanti.
+    Due miss contemporanei sulla stessa chiave caricano la tabella due volte (l'ultima vince).
+    """
+
+    def __init__(self, max_bytes=config.TABLE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # chiave -> (versione, tabella, byte)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(("hits", "misses", "evictions", "invalidations", "uncacheable"), 0)
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes and self.max_bytes > 0)
+
+    def get(self, key, version):
+        """Tabella in cache per key se la versione coincide, altrimenti None (miss)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != version:
+                self._remove(key)
+                self._counters["invalidations"] += 1
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+            return entry[1]
+
+    def put(self, key, version, table):
+        """Aggiunge la tabella ed elimina le voci meno recenti finché il totale rientra nel budget."""
+        nbytes = table.nbytes
+        with self._lock:
+            if not self.enabled or nbytes > self.max_bytes:
+                self._counters["uncacheable"] += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, table, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def get_or_load(self, key, version, loader):
+        """Tabella in cache oppure loader() (messa in cache con version)."""
+        table = self.get(key, version) if self.enabled else None
+        if table is None:
+            table = loader()
+            self.put(key, version, table)
+        return table
+
+    def invalidate(self, prefix=None):
+        """Elimina le voci la cui chiave inizia con prefix (es. una cartella del dataset); tutte se None."""
+        with self._lock:
+            keys = [key for key in self._entries if prefix is None or str(key[0]).startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            self._counters["invalidations"] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def stats(self):
+        """Hit, miss, hit rate, eliminazioni, invalidazioni, voci e byte occupati."""
+        with self._lock:
+            counters = dict(self._counters)
+            lookups = counters["hits"] + counters["misses"]
+            return {**counters, "hit_rate": round(counters["hits"] / lookups, 4) if lookups else None,
+                    "entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+_default_cache = TableCache()
+
+
+def get_default_cache():
+    """Cache delle tabelle condivisa dal processo (usata da DatasetStore.read e DatasetStore.query)."""
+    return _default_cache
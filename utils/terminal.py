@@ -0,0 +1,240 @@
+import glob
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_VERSION_PATTERN = re.compile(r'version "(\d+)(?:\.(\d+))?')
+_RELEASE_PATTERN = re.compile(r'^JAVA_VERSION="(\d+)(?:\.(\d+))?', re.MULTILINE)
+
+
+def _major(match):
+    """Versione principale di Java da una corrispondenza (1.8 -> 8, 22.0.1 -> 22)."""
+    major = int(match.group(1))
+    return int(match.group(2) or 0) if major == 1 else major
+
+
+def java_version(path):
+    """
+    Versione principale dell'eseguibile Java in path, None se non determinabile.
+
+    Legge il file `release` della JDK/JRE quando presente; solo in mancanza di quello esegue `java -version`.
+    """
+    home = os.path.dirname(os.path.dirname(os.path.realpath(path)))
+    release = os.path.join(home, "release")
+    if os.path.isfile(release):
+        with open(release, "r", encoding="utf-8", errors="ignore") as f:
+            match = _RELEASE_PATTERN.search(f.read())
+        if match:
+            return _major(match)
+    try:
+        output = subprocess.run([path, "-version"], capture_output=True, text=True, timeout=15).stderr
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = _VERSION_PATTERN.search(output)
+    return _major(match) if match else None
+
+
+def java_candidates():
+    """Possibili eseguibili Java, nell'ordine: config.JAVA_PATH, JAVA_HOME, PATH, cartelle di installazione standard."""
+    executable = "java.exe" if os.name == "nt" else "java"
+    candidates = []
+    if config.JAVA_PATH:
+        candidates.append(config.JAVA_PATH)
+    if os.environ.get("JAVA_HOME"):
+        candidates.append(os.path.join(os.environ["JAVA_HOME"], "bin", executable))
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        if directory:
+            candidates.append(os.path.join(directory, executable))
+    if os.name == "nt":
+        for root in filter(None, (os.environ.get("ProgramFiles"), os.environ.get("ProgramFiles(x86)"))):
+            candidates += sorted(glob.glob(os.path.join(root, "*", "*", "bin", executable)), reverse=True)
+    elif sys.platform == "darwin":
+        candidates += sorted(glob.glob("/Library/Java/JavaVirtualMachines/*/Contents/Home/bin/java"), reverse=True)
+    else:
+        candidates += sorted(glob.glob("/usr/lib/jvm/*/bin/java"), reverse=True)
+    seen, result = set(), []
+    for path in candidates:
+        if os.path.isfile(path) and os.path.realpath(path) not in seen:
+            seen.add(os.path.realpath(path))
+            result.append(path)
+    return result
+
+
+class TerminalManager:
+    """
+    Ciclo di vita del Theta Terminal: avvio su richiesta, attesa della readiness con probe
+    esponenziali brevi, watchdog durante i download lunghi e riavvio automatico.
+
+    Java viene cercato solo quando serve avviare il terminale e il risultato (percorso e versione,
+    validati con la data di modifica dell'eseguibile) resta nella cache dei metadati.
+
+    Il client HTTP chiama recover() dopo un errore di connessione: se il terminale non risponde
+    viene riavviato (una sola volta anche con più thread in errore) e le richieste in corso vengono
+    ripetute appena è di nuovo pronto.
+    """
+
+    def __init__(self, client, username, password, jar_path, metadata_cache=None, java_path=None,
+                 start_timeout=config.TERMINAL_START_TIMEOUT, max_restarts=config.TERMINAL_MAX_RESTARTS):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.jar_path = jar_path
+        self.metadata_cache = metadata_cache
+        self._java_path = java_path
+        self.start_timeout = start_timeout
+        self.max_restarts = max_restarts
+        self.restarts = 0
+        self.process = None
+        self._lock = threading.Lock()
+        self._watchers = 0
+        self._stop_watch = threading.Event()
+        self._watch_thread = None
+
+    # 🔹 **Java**
+
+    def find_java(self, min_version=config.JAVA_MIN_VERSION):
+        """Percorso di un'installazione Java >= min_version (cercata una volta sola, poi dalla cache)."""
+        if self._java_path:
+            return self._java_path
+        cached = self.metadata_cache.get("java") if self.metadata_cache is not None else None
+        if cached and os.path.isfile(cached["path"]) and os.path.getmtime(cached["path"]) == cached["mtime"] \
+                and cached["version"] >= min_version:
+            self._java_path = cached["path"]
+            return self._java_path
+        for path in java_candidates():
+            version = java_version(path)
+            if version is not None and version >= min_version:
+                logger.info(f"Usando Java {version}: {path}", extra={"java_path": path, "java_version": version})
+                if self.metadata_cache is not None:
+                    self.metadata_cache.set("java", {"path": path, "mtime": os.path.getmtime(path), "version": version}, immutable=True)
+                self._java_path = path
+                return path
+        raise RuntimeError(f"Impossibile trovare un'installazione Java {min_version}+ valida (imposta config.JAVA_PATH o JAVA_HOME).")
+
+    # 🔹 **Avvio e readiness**
+
+    def is_ready(self, timeout=config.TERMINAL_PROBE_TIMEOUT):
+        """True se il terminale risponde alle richieste HTTP."""
+        try:
+            self.client.get("/v2/list/roots/option", timeout=timeout, retries=0)
+            return True
+        except requests.exceptions.RequestException:
+            return False
+
+    def start(self):
+        """Avvia Theta Terminal in background."""
+        java = self.find_java()
+        creation_flags = subprocess.DETACHED_PROCESS if os.name == "nt" else 0
+        self.process = subprocess.Popen(
+            [java, "-jar", self.jar_path, self.username, self.password],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            creationflags=creation_flags
+        )
+        logger.info("✅ Theta Terminal avviato, in attesa della connessione...", extra={"pid": self.process.pid})
+
+    def stop(self):
+        """Termina il processo del terminale avviato da questo manager (se presente)."""
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Attende che il terminale risponda con probe a intervallo crescente (da TERMINAL_PROBE_INITIAL a
+        TERMINAL_PROBE_MAX secondi). False se scade il timeout o se il processo termina prima.
+        """
+        deadline = time.monotonic() + (self.start_timeout if timeout is None else timeout)
+        delay = config.TERMINAL_PROBE_INITIAL
+        started = time.monotonic()
+        while time.monotonic() < deadline:
+            if self.is_ready():
+                logger.info(f"✅ Theta Terminal pronto in {time.monotonic() - started:.1f}s.")
+                return True
+            if self.process is not None and self.process.poll() is not None:
+                logger.error(f"❌ Il processo di Theta Terminal è terminato (codice {self.process.returncode}).")
+                return False
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, config.TERMINAL_PROBE_MAX)
+        return False
+
+    def ensure_running(self):
+        """Verifica che il terminale risponda, avviandolo se necessario. Solleva ConnectionError se non parte."""
+        if self.is_ready():
+            return
+        logger.warning("Theta Terminal non è attivo. Tentativo di avvio...")
+        self.start()
+        if not self.wait_until_ready():
+            raise ConnectionError("Impossibile avviare Theta Terminal. Controlla i log.")
+
+    # 🔹 **Recupero automatico**
+
+    def recover(self):
+        """
+        Chiamato dopo un errore di connessione: True se il terminale è (di nuovo) raggiungibile.
+
+        Un solo thread alla volta esegue il riavvio; gli altri attendono e poi trovano il terminale pronto.
+        """
+        with self._lock:
+            if self.is_ready():
+                return True
+            if self.restarts >= self.max_restarts:
+                logger.error(f"❌ Theta Terminal non raggiungibile e già riavviato {self.restarts} volte: rinuncio.")
+                return False
+            self.restarts += 1
+            logger.warning(f"⚠️ Theta Terminal non raggiungibile: riavvio ({self.restarts}/{self.max_restarts})...",
+                           extra={"restarts": self.restarts})
+            self.stop()
+            try:
+                self.start()
+            except (OSError, RuntimeError) as e:
+                logger.error(f"❌ Errore nell'avvio di Theta Terminal: {e}")
+                return False
+            return self.wait_until_ready()
+
+    @contextmanager
+    def watch(self, interval=config.TERMINAL_WATCHDOG_INTERVAL):
+        """
+        Watchdog attivo per la durata del blocco: se il processo del terminale termina (o, se avviato
+        esternamente, smette di rispondere) viene riavviato senza attendere la richiesta successiva.
+        """
+        with self._lock:
+            self._watchers += 1
+            if self._watch_thread is None:
+                self._stop_watch.clear()
+                self._watch_thread = threading.Thread(target=self._watch, args=(interval,), name="terminal-watchdog", daemon=True)
+                self._watch_thread.start()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._watchers -= 1
+                thread = self._watch_thread if self._watchers == 0 else None
+                if thread is not None:
+                    self._stop_watch.set()
+                    self._watch_thread = None
+            if thread is not None:
+                thread.join()
+
+    def _watch(self, interval):
+        while not self._stop_watch.wait(interval):
+            if self.process is not None:
+                alive = self.process.poll() is None
+            else:
+                alive = self.is_ready()
+            if not alive:
+                self.recover()
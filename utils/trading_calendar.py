@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+# Orari della sessione regolare US (ms dall'inizio della giornata, ora di New York,
+# la stessa convenzione di `ms_of_day` nelle risposte del terminale)
+REGULAR_OPEN_MS = (9 * 60 + 30) * 60000
+REGULAR_CLOSE_MS = 16 * 60 * 60000
+EARLY_CLOSE_MS = 13 * 60 * 60000
+
+MS_PER_DAY = 86400000
+
+# Chiusure straordinarie non derivabili dalle regole
+SPECIAL_CLOSURES = {
+    "2001-09-11", "2001-09-12", "2001-09-13", "2001-09-14",
+    "2004-06-11", "2007-01-02", "2012-10-29", "2012-10-30",
+    "2018-12-05", "2025-01-09",
+}
+
+
+def _observed(day):
+    """Festività che cade di sabato -> venerdì precedente, di domenica -> lunedì successivo."""
+    if day.weekday() == 5:
+        return day - pd.Timedelta(days=1)
+    if day.weekday() == 6:
+        return day + pd.Timedelta(days=1)
+    return day
+
+
+def _nth_weekday(year, month, weekday, n):
+    """n-esimo giorno della settimana del mese (n=-1 -> ultimo)."""
+    if n > 0:
+        first = pd.Timestamp(year=year, month=month, day=1)
+        return first + pd.Timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = pd.Timestamp(year=year, month=month, day=1) + pd.offsets.MonthEnd(0)
+    return last - pd.Timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _easter(year):
+    """Domenica di Pasqua (calendario gregoriano, algoritmo anonimo)."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return pd.Timestamp(year=year, month=month, day=day)
+
+
+def holidays(year):
+    """Festività NYSE dell'anno (regole correnti + chiusure straordinarie)."""
+    days = set()
+    new_year = pd.Timestamp(year=year, month=1, day=1)
+    # Se Capodanno cade di sabato la borsa resta aperta il 31 dicembre
+    if new_year.weekday() != 5:
+        days.add(_observed(new_year))
+    if year >= 1998:
+        days.add(_nth_weekday(year, 1, 0, 3))               # Martin Luther King Jr. Day
+    days.add(_nth_weekday(year, 2, 0, 3))                   # Washington's Birthday
+    days.add(_easter(year) - pd.Timedelta(days=2))          # Good Friday
+    days.add(_nth_weekday(year, 5, 0, -1))                  # Memorial Day
+    if year >= 2022:
+        days.add(_observed(pd.Timestamp(year=year, month=6, day=19)))  # Juneteenth
+    days.add(_observed(pd.Timestamp(year=year, month=7, day=4)))       # Independence Day
+    days.add(_nth_weekday(year, 9, 0, 1))                   # Labor Day
+    days.add(_nth_weekday(year, 11, 3, 4))                  # Thanksgiving
+    days.add(_observed(pd.Timestamp(year=year, month=12, day=25)))     # Christmas
+    days.update(pd.Timestamp(d) for d in SPECIAL_CLOSURES if d.startswith(str(year)))
+    return days
+
+
+def early_closes(year):
+    """Giornate con chiusura anticipata alle 13:00."""
+    days = set()
+    july_3 = pd.Timestamp(year=year, month=7, day=3)
+    if july_3.weekday() < 4:
+        days.add(july_3)                                    # Vigilia dell'Independence Day (lun-gio)
+    days.add(_nth_weekday(year, 11, 3, 4) + pd.Timedelta(days=1))  # Venerdì dopo Thanksgiving
+    christmas_eve = pd.Timestamp(year=year, month=12, day=24)
+    if christmas_eve.weekday() < 5:
+        days.add(christmas_eve)
+    return days - holidays(year)
+
+
+def _to_days(value):
+    return np.datetime64(pd.Timestamp(str(value) if isinstance(value, (int, np.integer)) else value).normalize().date(), "D")
+
+
+def trading_days(start_date, end_date):
+    """Sessioni di borsa in [start_date, end_date] come array datetime64[D] ordinato."""
+    start, end = _to_days(start_date), _to_days(end_date)
+    if end < start:
+        return np.array([], dtype="datetime64[D]")
+    closed = set()
+    for year in range(start.astype(object).year, end.astype(object).year + 1):
+        closed.update(holidays(year))
+    closed = np.array(sorted(np.datetime64(d.date(), "D") for d in closed), dtype="datetime64[D]")
+    days = np.arange(start, end + 1, dtype="datetime64[D]")
+    days = days[np.is_busday(days)]
+    return days[~np.isin(days, closed)]
+
+
+def session_bounds(days):
+    """(open_ms, close_ms) di ogni sessione in days, tenendo conto delle chiusure anticipate."""
+    days = np.asarray(days, dtype="datetime64[D]")
+    open_ms = np.full(len(days), REGULAR_OPEN_MS, dtype=np.int64)
+    close_ms = np.full(len(days), REGULAR_CLOSE_MS, dtype=np.int64)
+    if len(days):
+        early = set()
+        for year in range(days[0].astype(object).year, days[-1].astype(object).year + 1):
+            early.update(np.datetime64(d.date(), "D") for d in early_closes(year))
+        close_ms[np.isin(days, np.array(sorted(early), dtype="datetime64[D]"))] = EARLY_CLOSE_MS
+    return open_ms, close_ms
+
+
+def missing_sessions(start_date, end_date, covered=()):
+    """
+    Sessioni di [start_date, end_date] non contenute negli intervalli covered ((start, end) di date).
+
+    Returns:
+        np.ndarray: datetime64[D] ordinato.
+    """
+    days = trading_days(start_date, end_date)
+    if len(days) == 0 or not covered:
+        return days
+    starts = np.array([_to_days(s) for s, _ in covered], dtype="datetime64[D]")
+    ends = np.array([_to_days(e) for _, e in covered], dtype="datetime64[D]")
+    order = np.argsort(starts)
+    starts, ends = starts[order], ends[order]
+    # Ultimo intervallo che inizia prima (o nello stesso giorno) di ciascuna sessione
+    idx = np.searchsorted(starts, days, side="right") - 1
+    inside = (idx >= 0) & (days <= ends[np.maximum(idx, 0)])
+    return days[~inside]
+
+
+def session_spans(days, max_span_days=None):
+    """
+    Raggruppa sessioni in intervalli di sessioni consecutive (weekend e festività non interrompono
+    un intervallo), ciascuno lungo al massimo max_span_days giorni di calendario.
+
+    Returns:
+        list: Lista di tuple (start, end) di pd.Timestamp.
+    """
+    days = np.unique(np.asarray(days, dtype="datetime64[D]"))
+    if len(days) == 0:
+        return []
+    sessions = trading_days(days[0], days[-1])
+    position = np.searchsorted(sessions, days)
+    breaks = np.flatnonzero(np.diff(position) != 1) + 1
+    spans = []
+    for run in np.split(days, breaks):
+        start = run[0]
+        for i in range(1, len(run)):
+            if max_span_days is not None and (run[i] - start).astype(int) + 1 > max_span_days:
+                spans.append((pd.Timestamp(start), pd.Timestamp(run[i - 1])))
+                start = run[i]
+        spans.append((pd.Timestamp(start), pd.Timestamp(run[-1])))
+    return spans
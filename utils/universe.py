@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+
+import config
+from utils.greeks import norm_cdf
+
+
+def _to_days(values):
+    """YYYYMMDD (int/str), date o Timestamp -> datetime64[D]."""
+    index = pd.Index(values)
+    if index.dtype.kind in "iu" or index.inferred_type == "string":
+        index = pd.to_datetime(index.astype(str), format="%Y%m%d")
+    return np.asarray(pd.DatetimeIndex(index).normalize().values, dtype="datetime64[D]")
+
+
+def days_to_expiration(expiration, days):
+    """Giorni di calendario tra ciascuna data di days e la scadenza (YYYYMMDD)."""
+    exp = np.datetime64(pd.Timestamp(str(expiration)).date(), "D")
+    return (exp - np.asarray(days, dtype="datetime64[D]")).astype(np.int64)
+
+
+def approx_delta(strike, spot, dte, right, volatility):
+    """|delta| Black-Scholes (tasso zero) con volatilità costante: serve solo a selezionare la catena."""
+    t = np.maximum(np.asarray(dte, dtype=float), 1.0) / 365.0
+    spot = np.asarray(spot, dtype=float)
+    d1 = (np.log(spot / strike) + 0.5 * volatility ** 2 * t) / (volatility * np.sqrt(t))
+    call = norm_cdf(d1)
+    return call if right == "C" else 1.0 - call
+
+
+def contract_priority(dte, moneyness=None):
+    """
+    Priorità di download (più bassa = prima): prima le scadenze vicine, a parità di DTE i contratti
+    più vicini al denaro. moneyness è |strike / spot - 1| (None se lo spot non è noto).
+    """
+    dte = int(min(max(dte, 0), 99999))
+    distance = 999 if moneyness is None or not np.isfinite(moneyness) else int(min(round(moneyness * 1000), 999))
+    return dte * 1000 + distance
+
+
+class UniverseSelector:
+    """
+    Seleziona, data per data, i contratti da scaricare in base a DTE e moneyness (o delta) rispetto
+    al prezzo dell'underlying già salvato.
+
+    Args:
+        prices (pd.Series): Prezzo di chiusura dell'underlying indicizzato per data (YYYYMMDD o Timestamp).
+            Per le date senza prezzo si usa l'ultimo disponibile; prima del primo prezzo la moneyness
+            non viene filtrata.
+        min_dte, max_dte (int): Finestra di giorni alla scadenza (None = nessun limite superiore).
+        moneyness (float): Banda massima di |strike / spot - 1| (es. 0.1 = ±10%).
+        delta (tuple): Banda (min, max) di |delta|, calcolato con volatilità costante `volatility`.
+    """
+
+    def __init__(self, prices=None, min_dte=0, max_dte=None, moneyness=None, delta=None, volatility=0.2):
+        self.min_dte = min_dte
+        self.max_dte = max_dte
+        self.moneyness = moneyness
+        self.delta = delta
+        self.volatility = volatility
+        if prices is not None and len(prices):
+            prices = prices.dropna()
+            order = np.argsort(_to_days(prices.index))
+            self._price_days = _to_days(prices.index)[order]
+            self._prices = prices.to_numpy(dtype=float)[order]
+        else:
+            self._price_days = np.array([], dtype="datetime64[D]")
+            self._prices = np.array([], dtype=float)
+
+    @classmethod
+    def from_config(cls, prices=None, settings=None):
+        """Selettore con i parametri di config.UNIVERSE; None se nessun filtro è attivo."""
+        settings = dict(config.UNIVERSE if settings is None else settings)
+        if settings.get("max_dte") is None and settings.get("moneyness") is None and settings.get("delta") is None \
+                and not settings.get("min_dte"):
+            return None
+        return cls(prices, **settings)
+
+    @classmethod
+    def from_store(cls, store, symbol, data_type, settings=None):
+        """Selettore basato sulle chiusure daily dell'underlying salvate in store (DatasetStore)."""
+        df = store.read(symbol, data_type, "daily", columns=["date", "close"])
+        prices = df.set_index("date")["close"] if len(df) else None
+        if prices is not None:
+            prices = prices[~prices.index.duplicated(keep="last")]
+        return cls.from_config(prices, settings)
+
+    def spot(self, days):
+        """Prezzo dell'underlying per ciascuna data (ultimo disponibile), NaN se non noto."""
+        days = np.asarray(days, dtype="datetime64[D]")
+        if len(self._prices) == 0:
+            return np.full(len(days), np.nan)
+        idx = np.searchsorted(self._price_days, days, side="right") - 1
+        return np.where(idx >= 0, self._prices[np.maximum(idx, 0)], np.nan)
+
+    def select(self, expiration, strike, right, days):
+        """Maschera booleana delle date (datetime64[D]) in cui il contratto rientra nell'universo."""
+        days = np.asarray(days, dtype="datetime64[D]")
+        dte = days_to_expiration(expiration, days)
+        keep = dte >= self.min_dte
+        if self.max_dte is not None:
+            keep &= dte <= self.max_dte
+        if self.moneyness is None and self.delta is None:
+            return keep
+        spot = self.spot(days)
+        known = np.isfinite(spot)
+        strike_price = strike / 1000.0
+        if self.moneyness is not None:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                keep &= ~known | (np.abs(strike_price / spot - 1.0) <= self.moneyness)
+        if self.delta is not None:
+            low, high = self.delta
+            with np.errstate(invalid="ignore", divide="ignore"):
+                delta = approx_delta(strike_price, np.where(known, spot, strike_price), dte, right, self.volatility)
+            keep &= ~known | ((delta >= low) & (delta <= high))
+        return keep
+
+    def priority(self, expiration, strike, day):
+        """Priorità del task che inizia in day (vedi contract_priority)."""
+        day = np.asarray([day], dtype="datetime64[D]")
+        spot = self.spot(day)[0]
+        moneyness = abs(strike / 1000.0 / spot - 1.0) if np.isfinite(spot) else None
+        return contract_priority(days_to_expiration(expiration, day)[0], moneyness)
@@ -0,0 +1,199 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.metrics import get_default_metrics
+
+# Upsert per chiave primaria (utils.schema.PRIMARY_KEYS) di due run ordinate, con l'ultima scrittura
+# che vince: una riga corretta (es. un tick ripubblicato con un prezzo diverso) sostituisce quella
+# vecchia invece di restare come duplicato. Le chiavi vengono ridotte a un solo int64 per riga:
+# rango del gruppo (date, expiration, strike, right) << 27 | ms_of_day; i ranghi si calcolano sui
+# soli gruppi distinti, quindi il costo per riga è lineare (più un searchsorted su int64).
+
+_MS_BITS = 27   # ms_of_day < 86_400_000 < 2**27
+
+
+def _column(table, name):
+    """Colonna chiave come array NumPy int64 (right: 0 = call, 1 = put; i dictionary vengono decodificati)."""
+    column = table[name]
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if name != "right":
+        return column.to_numpy(zero_copy_only=False).astype(np.int64, copy=False)
+    if pa.types.is_dictionary(column.type):
+        is_put = np.array([str(value).upper().startswith("P") for value in column.dictionary.to_pylist()], dtype=np.int64)
+        return is_put[column.indices.to_numpy(zero_copy_only=False)] if len(is_put) else np.zeros(len(column), dtype=np.int64)
+    return pc.starts_with(pc.utf8_upper(column.cast(pa.string())), "P").to_numpy(zero_copy_only=False).astype(np.int64)
+
+
+def _is_sorted(columns):
+    """True se le righe sono in ordine lessicografico (non decrescente) sulle colonne, in un solo passaggio."""
+    if not columns or len(columns[0]) < 2:
+        return True
+    ordered = np.ones(len(columns[0]) - 1, dtype=bool)
+    for values in reversed(columns):
+        ordered = (values[1:] > values[:-1]) | ((values[1:] == values[:-1]) & ordered)
+    return bool(ordered.all())
+
+
+def _key_columns(table, key):
+    return [_column(table, name) for name in key]
+
+
+def sort_run(table, key):
+    """
+    Ordina la tabella per chiave (stabile: a parità di chiave resta l'ordine di arrivo) solo se non lo è già.
+
+    Returns:
+        tuple: (tabella ordinata, colonne chiave come array int64).
+    """
+    columns = _key_columns(table, key)
+    if _is_sorted(columns):
+        return table, columns
+    order = np.lexsort(columns[::-1])
+    return table.take(pa.array(order)), [values[order] for values in columns]
+
+
+def _group_starts(columns, n):
+    """Prime righe di ogni gruppo (cambio di una delle colonne) in una run ordinata."""
+    change = np.zeros(n, dtype=bool)
+    change[:1] = True
+    for values in columns:
+        change[1:] |= values[1:] != values[:-1]
+    return np.flatnonzero(change)
+
+
+def _row_keys(base_columns, update_columns, key):
+    """Chiavi int64 confrontabili delle due run: rango del gruppo comune (date, contratto) e ms_of_day."""
+    has_ms = key[-1] == "ms_of_day"
+    group_cols = len(key) - 1 if has_ms else len(key)
+    runs = []
+    for columns in (base_columns, update_columns):
+        n = len(columns[0])
+        starts = _group_starts(columns[:group_cols], n)
+        runs.append((columns, n, starts))
+
+    # Gruppi distinti delle due run (pochi rispetto alle righe), ordinati e numerati insieme
+    groups = [np.concatenate([columns[i][starts] for columns, _, starts in runs]) for i in range(group_cols)]
+    ranks = np.zeros(sum(len(starts) for _, _, starts in runs), dtype=np.int64)
+    if groups and len(ranks):
+        order = np.lexsort(groups[::-1])
+        distinct = np.zeros(len(order), dtype=bool)
+        distinct[0] = True
+        for values in groups:
+            values = values[order]
+            distinct[1:] |= values[1:] != values[:-1]
+        ranks[order] = np.cumsum(distinct) - 1
+
+    keys, offset = [], 0
+    for columns, n, starts in runs:
+        run_ranks = ranks[offset:offset + len(starts)]
+        offset += len(starts)
+        lengths = np.diff(np.append(starts, n))
+        row_keys = np.repeat(run_ranks, lengths)
+        if has_ms:
+            row_keys = (row_keys << _MS_BITS) | columns[-1]
+        keys.append(row_keys)
+    return keys
+
+
+def _last_of_equal(keys):
+    """Maschera dell'ultima riga di ogni chiave ripetuta (run ordinata): le precedenti sono superate."""
+    keep = np.ones(len(keys), dtype=bool)
+    keep[:-1] = keys[:-1] != keys[1:]
+    return keep
+
+
+def upsert(base, updates, key, assume_sorted=False):
+    """
+    Fonde updates in base per chiave primaria con l'ultima scrittura che vince.
+
+    Le due run vengono ordinate per chiave solo se necessario (controllo lineare) e poi fuse in un
+    solo passaggio: per ogni chiave resta la riga di updates se presente, altrimenti quella di base;
+    dentro ciascuna run, a parità di chiave vince l'ultima riga. Le righe vengono assemblate con una
+    sola take sui buffer Arrow, senza passare da pandas.
+
+    Args:
+        base, updates (pa.Table | pd.DataFrame): Dati esistenti e nuovi (stesse colonne chiave).
+        key (tuple): Colonne della chiave primaria, ms_of_day per ultima se presente (vedi utils.schema.primary_key).
+        assume_sorted (bool): Salta il controllo dell'ordinamento (le run devono essere già ordinate per key).
+
+    Returns:
+        tuple: (risultato ordinato per key, dello stesso tipo di base; statistiche {"inserted": righe nuove,
+            "replaced": righe di base sostituite da updates, "dropped": righe superate dentro la stessa run,
+            "rows": righe in uscita}).
+    """
+    as_pandas = isinstance(base, pd.DataFrame)
+    base = pa.Table.from_pandas(base, preserve_index=False) if as_pandas else base
+    updates = pa.Table.from_pandas(updates, preserve_index=False) if isinstance(updates, pd.DataFrame) else updates
+    key = tuple(key)
+    if not key:
+        raise ValueError("Invalid key: at least one primary key column is required.")
+
+    with get_default_metrics().timer("upsert", rows=base.num_rows + updates.num_rows):
+        if assume_sorted:
+            base_columns, update_columns = _key_columns(base, key), _key_columns(updates, key)
+        else:
+            base, base_columns = sort_run(base, key)
+            updates, update_columns = sort_run(updates, key)
+        base_keys, update_keys = _row_keys(base_columns, update_columns, key)
+
+        base_keep = _last_of_equal(base_keys)
+        update_keep = _last_of_equal(update_keys)
+        dropped = int((~base_keep).sum() + (~update_keep).sum())
+        base_idx, update_idx = np.flatnonzero(base_keep), np.flatnonzero(update_keep)
+        base_keys, update_keys = base_keys[base_idx], update_keys[update_idx]
+
+        # Righe di base con la stessa chiave di una riga nuova: sostituite
+        position = np.searchsorted(base_keys, update_keys)
+        found = position < len(base_keys)
+        found[found] = base_keys[position[found]] == update_keys[found]
+        replaced = int(found.sum())
+        survivors = np.ones(len(base_keys), dtype=bool)
+        survivors[position[found]] = False
+        base_idx, base_keys = base_idx[survivors], base_keys[survivors]
+
+        # Fusione delle due run (chiavi ormai distinte): posizione finale di ogni riga nuova
+        inserted_at = np.searchsorted(base_keys, update_keys) + np.arange(len(update_keys))
+        from_updates = np.zeros(len(base_idx) + len(update_idx), dtype=bool)
+        from_updates[inserted_at] = True
+        indices = np.empty(len(from_updates), dtype=np.int64)
+        indices[from_updates] = update_idx + base.num_rows
+        indices[~from_updates] = base_idx
+
+        combined = pa.concat_tables([base, updates], promote_options="permissive") if updates.num_rows else base
+        result = combined.take(pa.array(indices))
+
+    stats = {"inserted": len(update_idx) - replaced, "replaced": replaced, "dropped": dropped, "rows": result.num_rows}
+    return (result.to_pandas() if as_pandas else result), stats
+
+
+def upsert_runs(runs, key):
+    """
+    Fonde più run (pa.Table) in ordine di scrittura, dalla più vecchia alla più recente, con l'ultima
+    scrittura che vince. Le run vengono fuse a coppie adiacenti (la sinistra è sempre la più vecchia),
+    quindi ogni riga partecipa a O(log k) fusioni invece di k.
+
+    Returns:
+        tuple: (tabella ordinata per key, statistiche {"rows_in", "replaced": righe sostituite da una run
+            più recente, "dropped": duplicati dentro la stessa run, "rows": righe in uscita}).
+    """
+    runs = list(runs)
+    if not runs:
+        raise ValueError("Invalid runs: at least one table is required.")
+    totals = {"rows_in": sum(run.num_rows for run in runs), "replaced": 0, "dropped": 0}
+    if len(runs) == 1:
+        # Una sola run: fusione con una tabella vuota, per ordinarla e togliere i duplicati interni
+        runs.append(runs[0].slice(0, 0))
+    while len(runs) > 1:
+        merged = []
+        for i in range(0, len(runs) - 1, 2):
+            table, stats = upsert(runs[i], runs[i + 1], key)
+            merged.append(table)
+            totals["replaced"] += stats["replaced"]
+            totals["dropped"] += stats["dropped"]
+        if len(runs) % 2:
+            merged.append(runs[-1])
+        runs = merged
+    return runs[0], {**totals, "rows": runs[0].num_rows}